@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Startup benchmark of the CLI
+
+Run 'src/main.py <video>' with 'python -X importtime' several times, report the
+wall time and the slowest imports, and check the startup budget:
+    - the median wall time is below --budget-ms
+    - probing a local video never imports a networking stack
+
+Usage:
+    python benchmarks/startup.py [video] [--runs 10] [--budget-ms 150] [--top 15]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+MAIN_PY = os.path.join(ROOT_PATH, 'src', 'main.py')
+DEFAULT_VIDEO = os.path.join(ROOT_PATH, 'tests', 'test_videos', 'test_video.mov')
+NETWORK_MODULES = ('requests', 'urllib3', 'ssl', 'http.client')
+
+
+def parse_importtime(stderr: str) -> dict:
+    """'import time: self [us] | cumulative | imported package' lines -> {package: (self_us, cumulative_us)}"""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, package = line[len('import time:'):].split('|')
+        imports[package.strip()] = (int(self_us), int(cumulative_us))
+    return imports
+
+
+def run_once(video: str) -> (float, dict):
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', MAIN_PY, video, '--json'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return time.perf_counter() - start, parse_importtime(process.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup benchmark of the CLI')
+    parser.add_argument('video', nargs='?', default=DEFAULT_VIDEO)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=150)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    wall_times = []
+    imports = {}
+    for _ in range(args.runs):
+        wall_time, imports = run_once(args.video)
+        wall_times.append(wall_time * 1000)
+    median = statistics.median(wall_times)
+
+    print('wall time: median {:.1f} ms, min {:.1f} ms, max {:.1f} ms ({} runs)'.format(
+        median, min(wall_times), max(wall_times), args.runs))
+    print('imports: {} modules, {:.1f} ms in total'.format(
+        len(imports), sum(self_us for self_us, _ in imports.values()) / 1000))
+    print('slowest imports (cumulative):')
+    for package, (self_us, cumulative_us) in sorted(imports.items(), key=lambda item: -item[1][1])[:args.top]:
+        print('  {:>8.1f} ms  {}'.format(cumulative_us / 1000, package))
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append('median wall time {:.1f} ms exceeds budget {:.1f} ms'.format(median, args.budget_ms))
+    if '://' not in args.video:
+        network = [m for m in NETWORK_MODULES if m in imports]
+        if network:
+            failures.append('local probe imports networking modules: {}'.format(', '.join(network)))
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+"""
+Async Video Readers
+
+AsyncRemoteReader fetches blocks of a remote video by HTTP 'Range' requests on
+asyncio streams (no thread per video) and keeps them in a page store.
+Its read, read_int, read_str, seek, tell and refresh have the same meaning as
+those of VideoReader, read and co. are coroutines.
+
+The (blocking) parsers are not duplicated: 'drive' runs a parser against a
+ReplayReader, a VideoReader over the page store which raises NeedData instead of
+blocking when a page is missing. The missing range is fetched and the parser is
+run again from the head, pages fetched before are served from memory.
+Each run is done in the default executor, so a slow parse does not stall the
+event loop, and is charged to the reader budget (limits.ProbeBudget) if any.
+"""
+
+import asyncio
+import functools
+import logging
+import ssl
+import weakref
+from collections import defaultdict
+from urllib.parse import urljoin, urlsplit
+
+from input import FAKE_HEADERS, MAX_BUFFER_LENGTH, POOL_MAXSIZE, REMOTE_BLOCK_LENGTH, REMOTE_TIMEOUT, \
+    PageCache, StreamAdapter, VideoReader, parse_content_range_total
+
+__all__ = ('NeedData', 'AsyncHTTPPool', 'AsyncRemoteReader', 'ReplayReader', 'get_pool', 'close_pool')
+
+ASYNC_MAX_BUFFER_LENGTH = 16 * MAX_BUFFER_LENGTH  # page store of each reader, the whole header must fit
+READAHEAD_LENGTH = 4 * REMOTE_BLOCK_LENGTH  # least bytes fetched for a miss
+MAX_DRIVE_ROUNDS = 256  # a parser needing more fetches than this is given up
+MAX_REDIRECTS = 5
+MAX_NON_RANGE_BYTES = 64 * MAX_BUFFER_LENGTH  # servers ignoring 'Range' send the whole video
+
+
+class NeedData(Exception):
+    """Raised by ReplayReader: bytes [position, position + length) are not fetched yet"""
+
+    def __init__(self, position: int, length: int):
+        super().__init__(position, length)
+        self.position = position
+        self.length = length
+
+
+class _Connection:
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        try:
+            self.writer.close()
+        except RuntimeError:  # its event loop is closed, the socket is released with the transport
+            pass
+
+
+class AsyncHTTPPool:
+    """Minimal HTTP/1.1 client keeping alive at most limit_per_host connections per host"""
+
+    def __init__(self, limit_per_host: int=POOL_MAXSIZE, timeout: float=REMOTE_TIMEOUT):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._idle = defaultdict(list)  # (scheme, host, port) -> idle connections
+        self._semaphores = {}
+        self._ssl_context = None
+        self.connections_opened = 0
+
+    def _semaphore(self, key) -> asyncio.Semaphore:
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.limit_per_host)
+        return self._semaphores[key]
+
+    async def _connect(self, key) -> _Connection:
+        scheme, host, port = key
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+        self.connections_opened += 1
+        return _Connection(reader, writer)
+
+    @staticmethod
+    async def _read_body(conn: _Connection, headers: dict) -> (bytes, bool):
+        """Return body and whether the connection can be reused"""
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await conn.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await conn.reader.readline()) not in (b'\r\n', b'\n', b''):  # trailers
+                        pass
+                    break
+                chunks.append(await conn.reader.readexactly(size))
+                await conn.reader.readline()
+            return b''.join(chunks), True
+        if 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length > MAX_NON_RANGE_BYTES:
+                raise Exception('Response body of {} bytes is too large'.format(length))
+            return await conn.reader.readexactly(length), True
+        return await conn.reader.read(MAX_NON_RANGE_BYTES), False
+
+    async def _request_once(self, key, path: str, headers: dict, reuse: bool) -> (int, dict, bytes):
+        idle = self._idle[key]
+        conn = idle.pop() if reuse and idle else await self._connect(key)
+        reusable = False
+        try:
+            host = key[1] if key[2] in (80, 443) else '{}:{}'.format(key[1], key[2])
+            lines = ['GET {} HTTP/1.1'.format(path), 'Host: {}'.format(host), 'Connection: keep-alive']
+            lines += ['{}: {}'.format(k, v) for k, v in headers.items()]
+            conn.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            await conn.writer.drain()
+            status_line = await conn.reader.readline()
+            if not status_line:
+                raise ConnectionResetError('Connection closed by {}'.format(key[1]))
+            status = int(status_line.split()[1])
+            response_headers = {}
+            while True:
+                line = (await conn.reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                response_headers[name.strip().lower()] = value.strip()
+            body, reusable = await self._read_body(conn, response_headers)
+            reusable = reusable and response_headers.get('connection', '').lower() != 'close'
+            return status, response_headers, body
+        finally:
+            if reusable:
+                idle.append(conn)
+            else:
+                conn.close()
+
+    async def get(self, url: str, headers: dict=None) -> (int, dict, bytes):
+        """GET url, follow redirects, return status, headers (lower case names) and body"""
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            async with self._semaphore(key):
+                try:
+                    status, response_headers, body = await asyncio.wait_for(
+                        self._request_once(key, path, headers or {}, reuse=True), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError, IndexError, ValueError):
+                    # a kept-alive connection may have been closed by the server
+                    status, response_headers, body = await asyncio.wait_for(
+                        self._request_once(key, path, headers or {}, reuse=False), self.timeout)
+            if status in (301, 302, 303, 307, 308) and 'location' in response_headers:
+                url = urljoin(url, response_headers['location'])
+                continue
+            return status, response_headers, body
+        raise Exception('Too many redirects: {}'.format(url))
+
+    def close(self):
+        for connections in self._idle.values():
+            for conn in connections:
+                conn.close()
+        self._idle.clear()
+
+
+_pools = weakref.WeakKeyDictionary()  # event loop -> pool, dropped with the loop
+
+
+def get_pool() -> AsyncHTTPPool:
+    """Pool shared by async readers of the running event loop
+
+    The pools of closed loops are closed and dropped here, as their idle connections keep the loops alive.
+    """
+    for closed_loop in [loop for loop in list(_pools.keys()) if loop.is_closed()]:
+        _pools.pop(closed_loop).close()
+    loop = asyncio.get_running_loop()
+    if loop not in _pools:
+        _pools[loop] = AsyncHTTPPool()
+    return _pools[loop]
+
+
+def close_pool() -> None:
+    """Close the pool of the running event loop, e.g. before the loop shuts down"""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        pool.close()
+
+
+class _PageStoreStream(StreamAdapter):
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.position = 0
+
+    def read(self, num_of_byte: int=1) -> bytes:
+        data = self.owner.cached(self.position, num_of_byte)
+        self.position += len(data)
+        return data
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int) -> int:
+        self.position = offset
+        return self.position
+
+    def close(self):
+        pass
+
+
+class ReplayReader(VideoReader):
+    """VideoReader over the page store of an AsyncRemoteReader, raises NeedData on missing pages"""
+
+    def __init__(self, owner):
+        self.owner = owner
+        super().__init__(owner.video_loc, max_buffer_length=owner.page_length, page_length=owner.page_length)
+
+    def _open_stream(self):
+        self.stream = _PageStoreStream(self.owner)
+
+    def _init_total_bytes(self):
+        self.total_bytes = self.owner.total_bytes
+
+
+class AsyncRemoteReader:
+
+    def __init__(self, video_loc: str, pool: AsyncHTTPPool=None, page_length: int=REMOTE_BLOCK_LENGTH,
+                 max_buffer_length: int=ASYNC_MAX_BUFFER_LENGTH):
+        if not video_loc.startswith('http'):
+            raise Exception('Add a proper schema to your remote location: \n'
+                            'https://{0} or\n'
+                            'http://{0}'.format(video_loc))
+        self.video_loc = video_loc
+        self.pool = pool
+        self.page_length = page_length
+        self.total_bytes = -1
+        self._pages = PageCache(page_length, max_buffer_length)
+        self._full_body = None  # the whole video if the server ignores 'Range'
+        self._reader = None
+        self.budget = None  # limits.ProbeBudget of drive, kept across its rounds
+
+    async def open(self):
+        if self.pool is None:
+            self.pool = get_pool()
+        await self.fetch(0, self.page_length)
+        self._reader = ReplayReader(self)
+        logging.debug("Location: {}".format(self.video_loc))
+        logging.debug("Bytes: {}".format(self.total_bytes))
+        return self
+
+    def cached(self, position: int, num_of_byte: int) -> bytes:
+        """Bytes [position, position + num_of_byte) from the page store, raise NeedData if missing"""
+        if self._full_body is not None:
+            return self._full_body[position: position + num_of_byte]
+        if self.total_bytes >= 0:
+            num_of_byte = max(0, min(num_of_byte, self.total_bytes - position))
+        data_list = []
+        end = position + num_of_byte
+        while position < end:
+            index, page_offset = divmod(position, self.page_length)
+            page = self._pages.get(index)
+            if page is None:
+                raise NeedData(position, end - position)
+            data = page[page_offset: page_offset + end - position]
+            if not data:
+                break
+            data_list.append(data)
+            position += len(data)
+        return b''.join(data_list)
+
+    async def fetch(self, position: int, num_of_byte: int) -> None:
+        """Fetch the pages covering [position, position + max(num_of_byte, READAHEAD_LENGTH))"""
+        start = position - position % self.page_length
+        # a quarter of the page store at most, the readahead of a miss must not evict the pages of the others
+        readahead = min(READAHEAD_LENGTH, max(1, self._pages.max_pages // 4) * self.page_length)
+        end = position + max(num_of_byte, readahead if self.total_bytes >= 0 else self.page_length)
+        end += -end % self.page_length
+        if self.total_bytes >= 0:
+            end = min(end, self.total_bytes)
+            if start >= end:
+                return
+        headers = dict(FAKE_HEADERS, Range='bytes={}-{}'.format(start, end - 1))
+        status, response_headers, body = await self.pool.get(self.video_loc, headers)
+        if status == 200:
+            logging.debug('Range requests not supported, fetched the whole {}'.format(self.video_loc))
+            self._full_body = body
+            self.total_bytes = len(body)
+            return
+        if status == 416:  # out of the file
+            return
+        if status != 206:
+            raise Exception('Can not fetch range of the remote video, _response status code: %s' % status)
+        self.total_bytes = parse_content_range_total(response_headers.get('content-range'))
+        for offset in range(0, len(body), self.page_length):
+            self._pages.put((start + offset) // self.page_length, body[offset: offset + self.page_length])
+
+    def replay(self) -> ReplayReader:
+        return ReplayReader(self)
+
+    def _store_too_small(self) -> Exception:
+        return Exception('Parsing {} needs more than the {} bytes of the page store, raise max_buffer_length'.format(
+            self.video_loc, self._pages.max_pages * self.page_length))
+
+    async def drive(self, func, *args, **kwargs):
+        """Run func(replay_reader, *args, **kwargs) until all the data it reads is fetched
+
+        The data read by func must fit the page store: a page missing again after being fetched
+        in this drive was evicted, the parser would never finish.
+        Every run replays the same reads, so the budget counters restart while its deadline runs
+        across the runs and the fetches.
+        """
+        loop = asyncio.get_running_loop()
+        fetched = set()  # pages needed and fetched in this drive
+        for _ in range(MAX_DRIVE_ROUNDS):
+            replay = self.replay()
+            if self.budget is not None:
+                self.budget.restart()
+                replay.budget = self.budget
+            try:
+                return await loop.run_in_executor(None, functools.partial(func, replay, *args, **kwargs))
+            except NeedData as e:
+                indexes = range(e.position // self.page_length, (e.position + e.length - 1) // self.page_length + 1)
+                if len(indexes) > self._pages.max_pages or e.position // self.page_length in fetched:
+                    raise self._store_too_small()
+                await self.fetch(e.position, e.length)
+                fetched.update(indexes)
+                if self.budget is not None:
+                    self.budget.check_time()
+        raise Exception('Too many fetches while parsing {}'.format(self.video_loc))
+
+    async def _retry(self, method, *args):
+        while True:
+            try:
+                return method(*args)
+            except NeedData as e:  # the reader position is unchanged, fetch and read again
+                if e.length > self._pages.max_pages * self.page_length:
+                    raise self._store_too_small()
+                await self.fetch(e.position, e.length)
+
+    async def read(self, num_of_byte: int=1) -> bytes:
+        return await self._retry(self._reader.read, num_of_byte)
+
+    async def read_int(self, num_of_byte: int=1, byteorder: str='big') -> int:
+        return await self._retry(self._reader.read_int, num_of_byte, byteorder)
+
+    async def read_str(self, num_of_byte: int=1, charset='utf8') -> str:
+        return await self._retry(self._reader.read_str, num_of_byte, charset)
+
+    def tell(self) -> int:
+        return self._reader.tell()
+
+    def seek(self, offset: int, whence: int=0) -> int:
+        return self._reader.seek(offset, whence)
+
+    def skip(self, num_of_byte: int) -> int:
+        return self._reader.skip(num_of_byte)
+
+    def refresh(self) -> None:
+        self._reader.refresh()
+
+    @property
+    def extend(self):
+        return self._reader.extend
+
+    def close(self):
+        self._pages.clear()
+        self._full_body = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
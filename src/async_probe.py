@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Async Probe
+
+    info = await probe(loc)
+    async for result in probe_many(locations, concurrency=N):
+        ...
+
+Remote videos are read by AsyncRemoteReader, so thousands of them can be in
+flight on one event loop. Local videos are probed by the blocking 'probe.probe'
+in the default executor. Both are charged to a ProbeBudget of the given limits,
+as the sync probes are.
+"""
+
+import asyncio
+import functools
+import logging
+
+import probe as _probe
+from async_input import AsyncRemoteReader
+from excptions import ProbeLimitExceeded
+from limits import ProbeBudget, ProbeLimits
+from type_checker import check_video_type, type_to_parser, VideoTypeEnum
+
+__all__ = ('probe', 'probe_many')
+
+DEFAULT_CONCURRENCY = 64
+
+
+def _is_remote(loc: str) -> bool:
+    return loc.startswith('http://') or loc.startswith('https://')
+
+
+async def probe(loc: str, pool=None, limits: ProbeLimits=None) -> dict:
+    """Type check and parse the video at loc, the same result as probe.probe
+
+    :param pool: AsyncHTTPPool, default the one shared by the running event loop
+    :param limits: ref probe.probe, the time limit covers the fetches too
+    """
+    if not _is_remote(loc):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(_probe.probe, loc, limits=limits))
+    budget = ProbeBudget(limits)
+    async with AsyncRemoteReader(loc, pool) as reader:
+        reader.budget = budget
+        extend = reader.extend  # potential extend
+        video_type = await reader.drive(
+            check_video_type, potential=VideoTypeEnum.get_type_from_extend(extend or ''))
+        parser = type_to_parser(video_type)  # one proper parse in parsers
+        video_info = await reader.drive(parser.parse)
+    return {'location': loc, 'type': video_type.split('.')[-1].lower(), 'info': video_info}
+
+
+async def _safe_probe(loc: str, pool=None, limits: ProbeLimits=None) -> dict:
+    # noinspection PyBroadException
+    try:
+        return await probe(loc, pool, limits)
+    except ProbeLimitExceeded as e:
+        logging.debug("Probe '{}' limit exceeded".format(loc), exc_info=True)
+        return {'location': loc, 'error': repr(e), 'limit_exceeded': e.json()}
+    except Exception as e:  # noqa
+        logging.debug("Probe '{}' error".format(loc), exc_info=True)
+        return {'location': loc, 'error': repr(e)}
+
+
+async def probe_many(locations, concurrency: int=DEFAULT_CONCURRENCY, pool=None, limits: ProbeLimits=None):
+    """Probe locations with at most 'concurrency' in flight, yield results in completion order
+
+    Errors are yielded as {'location': loc, 'error': repr(e)}, with 'limit_exceeded' if one of limits is.
+    locations: iterable or async iterable
+    """
+    if hasattr(locations, '__aiter__'):
+        iterator = locations.__aiter__()
+
+        async def next_location():
+            try:
+                return await iterator.__anext__()
+            except StopAsyncIteration:
+                return None
+    else:
+        iterator = iter(locations)
+
+        async def next_location():
+            return next(iterator, None)
+
+    pending = set()
+    exhausted = False
+    while pending or not exhausted:
+        while not exhausted and len(pending) < max(1, concurrency):
+            loc = await next_location()
+            if loc is None:
+                exhausted = True
+            else:
+                pending.add(asyncio.ensure_future(_safe_probe(loc, pool, limits)))
+        if not pending:
+            break
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
@@ -1,3 +1,17 @@
 # -*- coding: utf-8 -*-
 
 TYPE_CHECK_MAX_BYTES = 4 * 32
+
+# brands following 'ftyp' of mp4 files, see: http://www.ftyps.com/
+MP4_FTYP_BRANDS = (
+    b'avc1', b'iso2', b'isom', b'mmp4', b'mp41',
+    b'mp42', b'NDSC', b'NDSH', b'NDSM', b'NDSP',
+    b'NDSS', b'NDXC', b'NDXH', b'NDXM', b'NDXP',
+    b'NDXS', b'M4V ', b'iso4', b'iso5', b'iso6',
+    b'dash', b'msdh', b'msix', b'cmfc',  # fragmented
+)
+MOV_FTYP_BRAND = b'qt  '
+# atoms an old QuickTime file (without ftyp) may start with
+MOV_FIRST_ATOM_TYPES = (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')
+
+ASF_HEADER_GUID = b'\x30\x26\xB2\x75\x8E\x66\xCF\x11\xA6\xD9\x00\xAA\x00\x62\xCE\x6C'
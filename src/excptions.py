@@ -1,3 +1,16 @@
 # -*- coding: utf-8 -*-
 
 EOF = type('EOF', (Exception, ), {})
+
+
+class ProbeLimitExceeded(Exception):
+    """A probe went over one of its limits (ref: limits.ProbeLimits), e.g. a crafted or broken file"""
+
+    def __init__(self, limit: str, value, maximum):
+        super().__init__('Probe limit {} exceeded: {} > {}'.format(limit, value, maximum))
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+
+    def json(self) -> dict:
+        return {'limit': self.limit, 'value': self.value, 'maximum': self.maximum}
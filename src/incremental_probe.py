@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental Probe
+
+Probe a video while its bytes are still arriving (e.g. an upload), without
+writing it anywhere:
+
+    p = IncrementalProbe()
+    for chunk in upload:
+        if p.feed(chunk):  # True once nothing more is needed
+            break
+    p.close()
+    p.video_type  # 'mp4', known as soon as the magic bytes are in
+    p.result  # {'type': 'mp4', 'info': ...}, info is None until moov is complete
+
+MP4 (and MOV) streams are split into top level boxes by their headers: ftyp and
+moov are kept and parsed by the mp4 box engine, the other boxes (mdat) are
+counted and dropped, so memory is bounded by the headers instead of the payload.
+For the other types only the type is reported.
+"""
+
+from consts import TYPE_CHECK_MAX_BYTES
+from type_checker import VideoTypeEnum, match_video_type
+
+__all__ = ('IncrementalProbe', )
+
+MAX_HEADER_BYTES = 64 * 1024 * 1024  # largest moov kept
+BOX_TYPES_KEPT = ('ftyp', 'moov')
+BOX_ENGINE_TYPES = ('mp4', 'mov')
+
+
+class IncrementalProbe:
+
+    def __init__(self, potential=VideoTypeEnum.UNKNOWN, max_header_bytes: int=MAX_HEADER_BYTES):
+        """
+        :param potential: VideoTypeEnum.? guessed from the extend, tells rm from rmvb
+        :param max_header_bytes: an Exception is raised by feed if moov is larger
+        """
+        self.potential = potential
+        self.max_header_bytes = max_header_bytes
+        self.video_type = None  # 'mp4', 'avi', ...
+        self.info = None
+        self.done = False
+        self.bytes_received = 0
+        self._head = bytearray()  # the first bytes, for the type check
+        self._header = bytearray()  # header of the current top level box
+        self._box_type = None
+        self._remaining = 0  # payload bytes of the current box not received yet, -1: to the end of stream
+        self._kept = None  # the current box if it is kept
+        self._boxes = {}  # box type -> bytes of kept boxes
+
+    @property
+    def result(self):
+        """{'type': video type, 'info': video info or None}, None until the type is known"""
+        if self.video_type is None:
+            return None
+        return {'type': self.video_type, 'info': self.info}
+
+    @property
+    def kept_bytes(self) -> int:
+        return sum(map(len, self._boxes.values())) + (len(self._kept) if self._kept is not None else 0)
+
+    def feed(self, chunk: bytes) -> bool:
+        """Consume the next chunk of the stream, return whether the probe is done"""
+        self.bytes_received += len(chunk)
+        if self.done:
+            return True
+        data = memoryview(chunk)
+        if self.video_type is None:
+            head_length = TYPE_CHECK_MAX_BYTES - len(self._head)
+            self._head += data[:head_length]
+            video_type = match_video_type(self._head, self.potential)
+            if video_type == VideoTypeEnum.UNKNOWN:
+                if len(self._head) >= TYPE_CHECK_MAX_BYTES:
+                    raise Exception('Unrecognized video type!')
+                return False  # the whole chunk is in self._head, wait for more
+            self.video_type = video_type.split('.')[-1].lower()
+            if self.video_type not in BOX_ENGINE_TYPES:
+                self.done = True
+                return True
+            data = memoryview(bytes(self._head) + data[head_length:])  # boxes from the beginning
+            self._head = bytearray()
+        self._feed_boxes(data)
+        return self.done
+
+    def _feed_boxes(self, data: memoryview) -> None:
+        while data and not self.done:
+            if self._box_type is None:
+                data = self._feed_header(data)
+                continue
+            if self._remaining < 0:
+                taken = len(data)
+            else:
+                taken = min(self._remaining, len(data))
+                self._remaining -= taken
+            if self._kept is not None:
+                self._kept += data[:taken]
+                self._check_kept()
+            data = data[taken:]
+            if self._remaining == 0:
+                self._end_box()
+
+    def _feed_header(self, data: memoryview) -> memoryview:
+        header_size = 16 if len(self._header) >= 8 and self._header[:4] == b'\x00\x00\x00\x01' else 8
+        taken = min(header_size - len(self._header), len(data))
+        self._header += data[:taken]
+        data = data[taken:]
+        if len(self._header) < 8 or (len(self._header) < 16 and self._header[:4] == b'\x00\x00\x00\x01'):
+            return data
+        box_size = int.from_bytes(self._header[:4], byteorder='big')
+        box_type = self._header[4:8].decode('latin-1')
+        if box_size == 1:
+            box_size = int.from_bytes(self._header[8:16], byteorder='big')
+        if box_size != 0 and box_size < len(self._header):
+            raise Exception('Invalid size {} of box {}'.format(box_size, box_type))
+        self._box_type = box_type
+        self._remaining = box_size - len(self._header) if box_size else -1
+        self._kept = bytearray(self._header) if box_type in BOX_TYPES_KEPT else None
+        self._check_kept(box_size)
+        self._header = bytearray()
+        if self._remaining == 0:
+            self._end_box()
+        return data
+
+    def _check_kept(self, box_size: int=0) -> None:
+        if self._kept is not None and max(box_size, len(self._kept)) > self.max_header_bytes:
+            raise Exception('{} box is larger than {} bytes'.format(self._box_type, self.max_header_bytes))
+
+    def _end_box(self) -> None:
+        if self._kept is not None:
+            self._boxes.setdefault(self._box_type, bytes(self._kept))
+        box_type = self._box_type
+        self._box_type = self._kept = None
+        if box_type == 'moov':
+            self._parse_boxes()
+
+    def _parse_boxes(self) -> None:
+        from input import BytesVideoReader
+        from parsers import mp4
+        info = {}
+        if 'ftyp' in self._boxes:
+            info['ftyp'] = mp4.FTYPBox(BytesVideoReader(self._boxes['ftyp'])).json()
+        info['moov'] = [mp4.MOOVBox(BytesVideoReader(self._boxes['moov'])).json()]
+        self.info = info
+        self._boxes.clear()  # parsed, not needed any more
+        self.done = True
+
+    def close(self) -> None:
+        """End of stream: a moov extending to the end of stream is complete now"""
+        if not self.done and self._box_type == 'moov' and self._remaining < 0:
+            self._end_box()
+        self._boxes.clear()
+        self._kept = None
+        self.done = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
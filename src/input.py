@@ -7,6 +7,8 @@ Open a file data stream with 'refresh' operation based on memory buffer.
 
 The 'refresh' operation performs like re-open the data stream.
 However in this implement, after 'refresh' data is read from buffer.
+The buffer is a LRU cache of fixed-size aligned pages bounded by
+'max_buffer_length', so backward jumps hit memory as well.
 
 This is especially useful when the video is located at remote host, for
 the reason that a new request for remote resources is a bit 'expensive'.
@@ -17,34 +19,83 @@ After type-checking the pointer to the data stream has an offset, and we
 neither want to pass both the stream and offset between two modules，
 nor 'really' re-open the data stream.
 
+Besides, readers support 'seek', 'skip' and 'tell'. Seeking only moves the
+reader 'pointer', the underlying stream is moved by the next read, so parsers
+can jump over large payloads (e.g. mp4 'mdat' box) without reading them.
+
 """
 
+import io
 import logging
+import mmap
 import os
 import sys
-
-import requests
+import threading
+from collections import OrderedDict
 
 
-__all__ = ('VideoReader', 'FileVideoReader', 'RemoteFileReader')
+__all__ = ('VideoReader', 'BytesVideoReader', 'FileVideoReader', 'MmapFileVideoReader', 'RemoteFileReader',
+           'get_session', 'configure_session', 'reserve_session_pool')
 
 MAX_BUFFER_LENGTH = 1024 * 1024  # 1 Mb
+PAGE_LENGTH = 64 * 1024
+SKIP_CHUNK_LENGTH = 64 * 1024  # used when a stream can not seek
+STREAM_CHUNK_LENGTH = 8 * 1024
+REMOTE_BLOCK_LENGTH = 64 * 1024  # bytes fetched by each 'Range' request
+REMOTE_TIMEOUT = 10
+POOL_CONNECTIONS = 10  # hosts whose connections are pooled by the shared session
+POOL_MAXSIZE = 10  # keep-alive connections per host
 COMMON_VIDEO_EXTENDS = ('asf', 'avi', 'flv', 'mkv', 'mov', 'mp4', 'rm', 'rmvb',)
 
 
+class PageCache:
+    """LRU cache of fixed-size aligned pages, holding at most max_bytes (and at least one page)"""
+
+    def __init__(self, page_length: int=PAGE_LENGTH, max_bytes: int=MAX_BUFFER_LENGTH):
+        self.page_length = page_length
+        self.max_pages = max(1, max_bytes // page_length)
+        self._pages = OrderedDict()
+
+    def get(self, index: int):
+        page = self._pages.get(index)
+        if page is not None:
+            self._pages.move_to_end(index)
+        return page
+
+    def put(self, index: int, page: bytes) -> None:
+        self._pages[index] = page
+        self._pages.move_to_end(index)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._pages
+
+    def clear(self) -> None:
+        self._pages.clear()
+
+    @property
+    def cached_bytes(self) -> int:
+        return sum(len(page) for page in self._pages.values())
+
+
 class VideoReader:
 
-    def __init__(self, video_loc: str, max_buffer_length: int=MAX_BUFFER_LENGTH):
+    budget = None  # limits.ProbeBudget charged by reads and parsers, None: no limit
+
+    def __init__(self, video_loc: str, max_buffer_length: int=MAX_BUFFER_LENGTH, page_length: int=PAGE_LENGTH):
         self.video_loc = video_loc
         self.max_buffer_length = max_buffer_length
+        self.page_length = page_length
         self.stream = None  # self.stream object should support read and close, ref: StreamAdapter
         self._open_stream()
         assert hasattr(self.stream, 'read') and callable(self.stream.read), "self.stream does not has 'read' method"
         assert hasattr(self.stream, 'close') and callable(self.stream.close), "self.stream does not has 'close' method"
         self.total_bytes = -1
         self._init_total_bytes()
-        self._buffer = bytearray()
-        self._buffer_pointer = -1
+        self._cache = PageCache(page_length, max_buffer_length)
+        self._position = 0  # offset of the next byte returned by read
+        self._stream_position = 0  # offset of the next byte returned by self.stream.read
         logging.debug("Location: {}".format(self.video_loc))
         logging.debug("Bytes: {}".format(self.total_bytes))
 
@@ -56,8 +107,28 @@ class VideoReader:
         """Initial self.stream"""
         raise NotImplementedError()
 
-    def _is_buffer_full(self):
-        return len(self._buffer) > self.max_buffer_length
+    def _seek_stream(self, position: int) -> None:
+        """Move self.stream to position
+
+        Seekable streams jump directly, the others are re-opened when moving
+        backward and read-and-discarded when moving forward.
+        """
+        if position == self._stream_position:
+            return
+        seekable = getattr(self.stream, 'seekable', None)
+        if seekable is not None and seekable():
+            self.stream.seek(position)
+            self._stream_position = position
+            return
+        if position < self._stream_position:
+            self.stream.close()
+            self._open_stream()  # re-initial self.stream
+            self._stream_position = 0
+        while self._stream_position < position:
+            data = self.stream.read(min(position - self._stream_position, SKIP_CHUNK_LENGTH))
+            if not data:
+                break
+            self._stream_position += len(data)
 
     def read_int(self, num_of_byte: int=1, byteorder: str='big') -> int:
         return int.from_bytes(self.read(num_of_byte), byteorder=byteorder)
@@ -71,53 +142,109 @@ class VideoReader:
             b'\x05\x80' (1, 1)-> 5.5
         """
         before_point_num = int.from_bytes(self.read(before_point_num_of_byte), byteorder=byteorder)
-        after_point_bits = bin(
-            int.from_bytes(self.read(after_point_num_of_byte), byteorder=byteorder)
-        ).lstrip('0b').zfill(after_point_num_of_byte * 8)  # for example: b'\x11' -> '00010001'
-        after_point_num = sum(float(after_point_bits[i]) * 2**(-1 - i) for i in range(after_point_num_of_byte * 8))
-        return before_point_num + after_point_num
+        after_point_num = int.from_bytes(self.read(after_point_num_of_byte), byteorder=byteorder)
+        return before_point_num + after_point_num / (1 << (after_point_num_of_byte * 8))
 
     def read_str(self, num_of_byte: int=1, charset='utf8') -> str:
         return self.read(num_of_byte).decode(charset)
 
+    def read_view(self, num_of_byte: int=1) -> memoryview:
+        """The same as read, but returns a memoryview for zero-copy decoding (e.g. struct.unpack_from)"""
+        return memoryview(self.read(num_of_byte))
+
+    def _load_page(self, index: int, last_index: int) -> bytes:
+        """Page index from the cache, missing pages up to last_index are read from the stream at once"""
+        page = self._cache.get(index)
+        if page is not None:
+            return page
+        count = 1
+        while count < self._cache.max_pages and index + count <= last_index and index + count not in self._cache:
+            count += 1
+        self._seek_stream(index * self.page_length)
+        data = self.stream.read(count * self.page_length)
+        self._stream_position += len(data)
+        for i in range(count):
+            self._cache.put(index + i, data[i * self.page_length: (i + 1) * self.page_length])
+        return data[:self.page_length]
+
+    def prefetch(self, start: int, end: int) -> None:
+        """Load bytes [start, end) into the page cache by as few stream reads as the cache allows
+
+        e.g. the ranges of a read plan, fetched before a parser reads them piece by piece.
+        A range larger than the page cache is not prefetched: its first pages would be evicted before
+        being read, and read again from the stream.
+        """
+        if self.total_bytes >= 0:
+            end = min(end, self.total_bytes)
+        if end <= start:
+            return
+        last_index = (end - 1) // self.page_length
+        if last_index - start // self.page_length >= self._cache.max_pages:
+            return
+        for index in range(start // self.page_length, last_index + 1):
+            self._load_page(index, last_index)
+
     def read(self, num_of_byte: int=1) -> bytes:
         """Read and return num_of_byte bytes of the video
         if num_of_byte >= 0, read num_of_byte bytes data
         else, read to the end
         """
         if num_of_byte < 0:
-            return self.stream.read()
-        if self._is_buffer_full():
-            return self.stream.read(num_of_byte)
-
-        buffer_len = len(self._buffer)
-        if buffer_len == self._buffer_pointer + 1:  # all real read
-            data = self.stream.read(num_of_byte)
-            self._buffer += data
-            self._buffer_pointer = self._buffer_pointer + num_of_byte
-            return data
-        elif buffer_len - (self._buffer_pointer + 1) >= num_of_byte:  # all from buffer
-            self._buffer_pointer += num_of_byte
-            return bytes(self._buffer[self._buffer_pointer - num_of_byte + 1: self._buffer_pointer + 1])
-        elif buffer_len - (self._buffer_pointer + 1) < num_of_byte:  # one part from buffer and the other real read
-            data_buffer_part = self._buffer[self._buffer_pointer + 1:]
-            remained_not_read_num = num_of_byte - (buffer_len - (self._buffer_pointer + 1))
-            data_read_part = self.stream.read(remained_not_read_num)
-            self._buffer += data_read_part
-            self._buffer_pointer += num_of_byte
-            return bytes(data_buffer_part + data_read_part)
+            num_of_byte = self.total_bytes - self._position if self.total_bytes >= 0 else sys.maxsize
+        if self.budget is not None:
+            self.budget.count_bytes(
+                min(num_of_byte, max(0, self.total_bytes - self._position)) if self.total_bytes >= 0 else num_of_byte)
+        position, end = self._position, self._position + num_of_byte
+        last_index = (end - 1) // self.page_length
+        data_list = []
+        while position < end:
+            index, page_offset = divmod(position, self.page_length)
+            page = self._load_page(index, last_index)
+            data = page[page_offset: page_offset + end - position]
+            if data:
+                data_list.append(data)
+                position += len(data)
+            if len(page) < self.page_length:  # the last page
+                break
+        self._position = max(self._position, position)
+        return data_list[0] if len(data_list) == 1 else b''.join(data_list)
+
+    def tell(self) -> int:
+        """Offset of the reader 'pointer' from the head"""
+        return self._position
+
+    def seek(self, offset: int, whence: int=os.SEEK_SET) -> int:
+        """Move the reader 'pointer' without reading the data in between
+
+        Nothing is read here, the underlying stream is moved lazily by the next read.
+        whence: os.SEEK_SET, os.SEEK_CUR or os.SEEK_END (the latter needs total_bytes)
+        """
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            if self.total_bytes < 0:
+                raise ValueError('Can not seek from the end, total bytes of {} is unknown'.format(self.video_loc))
+            position = self.total_bytes + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+        if position < 0:
+            raise ValueError('Negative seek position: {}'.format(position))
+        self._position = position
+        return self._position
+
+    def skip(self, num_of_byte: int) -> int:
+        """Jump over num_of_byte bytes, the same as seek(num_of_byte, os.SEEK_CUR)"""
+        return self.seek(num_of_byte, os.SEEK_CUR)
 
     def refresh(self) -> None:
         """Move the reader 'pointer' back to the head"""
-        if self._is_buffer_full():
-            self.stream.close()
-            self._open_stream()  # re-initial self.stream
-            self._buffer = bytearray()
-        self._buffer_pointer = -1
+        self.seek(0)
 
     def close(self):
         self.stream.close()
-        self._buffer = None
+        self._cache.clear()
 
     def __enter__(self):
         return self
@@ -141,16 +268,22 @@ class StreamAdapter:
     def read(self, num_of_byte: int=1) -> bytes:
         raise NotImplementedError()
 
+    def seekable(self) -> bool:
+        return False
+
+    def seek(self, offset: int) -> int:
+        raise NotImplementedError()
+
     def close(self):
         raise NotImplementedError()
 
 
 class FileVideoReader(VideoReader):
 
-    def __init__(self, video_loc: str, max_buffer_length: int=MAX_BUFFER_LENGTH):
+    def __init__(self, video_loc: str, max_buffer_length: int=MAX_BUFFER_LENGTH, page_length: int=PAGE_LENGTH):
         if not os.path.exists(video_loc) or not os.path.getsize(video_loc) > 0:
             raise Exception('File {} not exist.'.format(video_loc))
-        super().__init__(video_loc, max_buffer_length)
+        super().__init__(video_loc, max_buffer_length, page_length)
 
     def _open_stream(self):
         self.stream = open(self.video_loc, 'rb')
@@ -159,54 +292,254 @@ class FileVideoReader(VideoReader):
         self.total_bytes = os.path.getsize(self.video_loc)
 
 
+class BytesVideoReader(VideoReader):
+    """Reader of video bytes already in memory, e.g. a header received by an upload"""
+
+    def __init__(self, data: bytes, video_loc: str='<bytes>'):
+        self._data = data
+        super().__init__(video_loc, max_buffer_length=0, page_length=max(1, len(data)))
+
+    def _open_stream(self):
+        self.stream = io.BytesIO(self._data)
+
+    def _init_total_bytes(self):
+        self.total_bytes = len(self._data)
+
+
+class MmapFileVideoReader(FileVideoReader):
+    """Local reader working on a read-only memory map of the file
+
+    There is no stream buffer at all: reads are slices of the mapping, read_int and
+    read_str decode memoryview slices in place and 'refresh' just resets an offset.
+    """
+
+    def _open_stream(self):
+        self.stream = open(self.video_loc, 'rb')
+        self._mmap = mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def _next_slice(self, num_of_byte: int) -> slice:
+        start = min(self._position, len(self._mmap))
+        end = len(self._mmap) if num_of_byte < 0 else min(start + num_of_byte, len(self._mmap))
+        if self.budget is not None:
+            self.budget.count_bytes(end - start)
+        self._position = max(self._position, end)
+        return slice(start, end)
+
+    def prefetch(self, start: int, end: int) -> None:
+        pass  # all mapped
+
+    def read(self, num_of_byte: int=1) -> bytes:
+        return self._mmap[self._next_slice(num_of_byte)]
+
+    def read_view(self, num_of_byte: int=1) -> memoryview:
+        return self._view[self._next_slice(num_of_byte)]
+
+    def read_int(self, num_of_byte: int=1, byteorder: str='big') -> int:
+        return int.from_bytes(self._view[self._next_slice(num_of_byte)], byteorder=byteorder)
+
+    def read_str(self, num_of_byte: int=1, charset='utf8') -> str:
+        return str(self._view[self._next_slice(num_of_byte)], charset)
+
+    def close(self):
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:  # views returned by read_view are still alive, the mapping goes with them
+            logging.debug('Memory map of {} is still referenced'.format(self.video_loc))
+        self.stream.close()
+
+
+_session = None
+_session_pool_maxsize = POOL_MAXSIZE
+_session_lock = threading.Lock()
+
+
+def _new_session(pool_connections: int, pool_maxsize: int):
+    import requests  # imported on demand, local videos never need the networking stack
+    import requests.adapters
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def configure_session(pool_connections: int=POOL_CONNECTIONS, pool_maxsize: int=POOL_MAXSIZE):
+    """(Re)create the session shared by remote readers
+
+    :param pool_connections: number of hosts whose connections are pooled
+    :param pool_maxsize: keep-alive connections kept per host, set it to the number of workers
+    :return: the new shared session
+    """
+    global _session, _session_pool_maxsize
+    session = _new_session(pool_connections, pool_maxsize)
+    with _session_lock:
+        old_session, _session, _session_pool_maxsize = _session, session, pool_maxsize
+    if old_session is not None:
+        old_session.close()
+    return session
+
+
+def reserve_session_pool(pool_maxsize: int) -> None:
+    """Keep at least pool_maxsize keep-alive connections per host in the shared session, e.g. one per worker
+
+    The session is still created on first use, so local videos never import the networking stack.
+    """
+    global _session, _session_pool_maxsize
+    with _session_lock:
+        if pool_maxsize <= _session_pool_maxsize:
+            return
+        old_session, _session, _session_pool_maxsize = _session, None, pool_maxsize
+    if old_session is not None:
+        old_session.close()
+
+
+def get_session():
+    """Session shared by remote readers, so connections are kept alive across videos"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _new_session(POOL_CONNECTIONS, _session_pool_maxsize)
+        return _session
+
+
 FAKE_HEADERS = {
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
     'Accept-Charset': 'UTF-8,*;q=0.5',
-    'Accept-Encoding': 'gzip,deflate,sdch',
+    'Accept-Encoding': 'identity',  # byte ranges must address the raw file
     'Accept-Language': 'en-US,en;q=0.8',
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; WOW64; rv:51.0) Gecko/20100101 Firefox/51.0'
 }
 
 
 class RemoteFileStreamAdapter(StreamAdapter):
+    """Sequential stream of a plain (200) response, used when the server ignores 'Range'"""
 
     def __init__(self, response):
         self.response = response
-        self.iter = response.iter_content(chunk_size=1, decode_unicode=False)
+        self.iter = response.iter_content(chunk_size=STREAM_CHUNK_LENGTH, decode_unicode=False)
+        self._remained = b''
 
     def read(self, num_of_byte: int = 1) -> bytes:
-        if num_of_byte >= 0:
-            b_list = [next(self.iter) for _ in range(num_of_byte)]
-        else:
-            b_list = list(self.iter)
-        return b''.join(b_list)
+        if num_of_byte < 0:
+            data = self._remained + b''.join(self.iter)
+            self._remained = b''
+            return data
+        b_list = [self._remained]
+        got = len(self._remained)
+        while got < num_of_byte:
+            chunk = next(self.iter, b'')
+            if not chunk:
+                break
+            b_list.append(chunk)
+            got += len(chunk)
+        data = b''.join(b_list)
+        self._remained = data[num_of_byte:]
+        return data[:num_of_byte]
 
     def close(self):
         self.response.close()
 
 
+class RemoteRangeStreamAdapter(StreamAdapter):
+    """Seekable stream fetching fixed-size blocks by HTTP 'Range' requests
+
+    The first block comes from the (206) response which opened the stream.
+    """
+
+    def __init__(self, video_loc: str, response, block_length: int=REMOTE_BLOCK_LENGTH, session=None):
+        self.video_loc = video_loc
+        self.session = session if session is not None else get_session()
+        self.block_length = block_length
+        self.total_bytes = parse_content_range_total(response.headers.get('Content-Range'))
+        self._block_start = 0
+        self._block = response.content
+        self._position = 0
+
+    def _fetch(self, start: int, end: int=None) -> bytes:
+        """Fetch bytes [start, end], or [start, EOF) if end is None"""
+        if self.total_bytes >= 0 and start >= self.total_bytes:
+            return b''
+        headers = dict(FAKE_HEADERS, Range='bytes={}-{}'.format(start, '' if end is None else end))
+        response = self.session.get(self.video_loc, headers=headers, timeout=REMOTE_TIMEOUT)
+        if response.status_code == 416:  # range not satisfiable, out of the file
+            return b''
+        if response.status_code != 206:
+            raise Exception(
+                'Can not fetch range of the remote video, _response status code: %s' % response.status_code)
+        return response.content
+
+    def read(self, num_of_byte: int = 1) -> bytes:
+        block_offset = self._position - self._block_start
+        if 0 <= block_offset and num_of_byte >= 0 and block_offset + num_of_byte <= len(self._block):
+            data = self._block[block_offset: block_offset + num_of_byte]
+        elif num_of_byte < 0:
+            data = self._fetch(self._position)
+        else:
+            fetch_length = max(num_of_byte, self.block_length)
+            self._block_start = self._position
+            self._block = self._fetch(self._position, self._position + fetch_length - 1)
+            data = self._block[:num_of_byte]
+        self._position += len(data)
+        return data
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int) -> int:
+        self._position = offset
+        return self._position
+
+    def close(self):
+        self._block = b''
+
+
+def parse_content_range_total(content_range: str) -> int:
+    """'bytes 0-65535/1234567' -> 1234567, -1 if unknown"""
+    try:
+        return int(content_range.rsplit('/', 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        return -1
+
+
 class RemoteFileReader(VideoReader):
 
-    def __init__(self, video_loc: str, max_buffer_length: int=MAX_BUFFER_LENGTH):
+    def __init__(self, video_loc: str, max_buffer_length: int=MAX_BUFFER_LENGTH,
+                 block_length: int=REMOTE_BLOCK_LENGTH, session=None):
+        """
+        :param session: requests.Session to send requests, default the shared one, ref: get_session
+        """
         if not video_loc.startswith('http') and not video_loc.startswith('ftp'):
-            logging.error('Add a proper schema to your remote location: \n'
-                          'https://{0} or\n'
-                          'http://{0} or\n'
-                          'ftp://{0}'.format(video_loc))
-            sys.exit(-1)
+            raise Exception('Add a proper schema to your remote location: \n'
+                            'https://{0} or\n'
+                            'http://{0} or\n'
+                            'ftp://{0}'.format(video_loc))
         self.response = None
-        super().__init__(video_loc, max_buffer_length)
+        self.block_length = block_length
+        self.session = session if session is not None else get_session()
+        super().__init__(video_loc, max_buffer_length, page_length=block_length)
 
     def _open_stream(self):
-        self.response = requests.get(self.video_loc, headers=FAKE_HEADERS, stream=True, timeout=10)
-        if self.response.status_code != 200:
+        """Ask for the first block by 'Range', fall back to streaming if the server ignores it"""
+        headers = dict(FAKE_HEADERS, Range='bytes=0-{}'.format(self.block_length - 1))
+        self.response = self.session.get(self.video_loc, headers=headers, stream=True, timeout=REMOTE_TIMEOUT)
+        if self.response.status_code == 206:
+            self.stream = RemoteRangeStreamAdapter(self.video_loc, self.response, self.block_length, self.session)
+        elif self.response.status_code == 200:
+            logging.debug('Range requests not supported, streaming {}'.format(self.video_loc))
+            self.stream = RemoteFileStreamAdapter(self.response)
+        else:
             raise Exception(
                 'Can not open the remote video, _response status code: %s' % self.response.status_code)
-        self.stream = RemoteFileStreamAdapter(self.response)
 
     def _init_total_bytes(self):
+        if isinstance(self.stream, RemoteRangeStreamAdapter):
+            self.total_bytes = self.stream.total_bytes
+            return
         # noinspection PyBroadException
         try:
-            self.total_bytes = int(self.response.headers.get['Content-Length'])
+            self.total_bytes = int(self.response.headers['Content-Length'])
         except:  # noqa
             pass
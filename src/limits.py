@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Probe Limits
+
+Sizes and counts in a video file are not trusted: a ProbeBudget attached to a
+reader (reader.budget) is charged by the parsers for every box, nesting level,
+byte read and table entry, and raises ProbeLimitExceeded as soon as one of the
+ProbeLimits (or the wall-clock budget) is exceeded.
+
+    reader.budget = ProbeBudget(ProbeLimits(max_seconds=2))
+"""
+
+import time
+
+from excptions import ProbeLimitExceeded
+
+__all__ = ('ProbeLimits', 'ProbeBudget', 'ProbeLimitExceeded', 'parse_limits')
+
+
+class ProbeLimits:
+    """Per probe limits, None for no limit"""
+
+    __slots__ = ('max_boxes', 'max_depth', 'max_bytes', 'max_entries', 'max_seconds')
+
+    def __init__(self, max_boxes: int=1000000, max_depth: int=32, max_bytes: int=512 * 1024 * 1024,
+                 max_entries: int=16 * 1024 * 1024, max_seconds: float=60):
+        """
+        :param max_boxes: boxes (atoms, elements, chunks) created or walked
+        :param max_depth: nesting level of boxes
+        :param max_bytes: bytes read, skipped bytes are not counted
+        :param max_entries: entries of one table (samples, chunks, descriptions, ...)
+        :param max_seconds: wall-clock time of the probe
+        """
+        self.max_boxes = max_boxes
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_seconds = max_seconds
+
+    def json(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+def parse_limits(limits: str) -> ProbeLimits:
+    """'boxes=1000,seconds=2.5' -> ProbeLimits(max_boxes=1000, max_seconds=2.5), others default"""
+    kwargs = {}
+    for item in limits.split(','):
+        if not item.strip():
+            continue
+        key, _, value = item.partition('=')
+        key = 'max_' + key.strip()
+        if key not in ProbeLimits.__slots__:
+            raise Exception('Unknown limit: {}, supported: {}'.format(
+                item, ', '.join(k[len('max_'):] for k in ProbeLimits.__slots__)))
+        kwargs[key] = float(value) if key == 'max_seconds' else int(value)
+    return ProbeLimits(**kwargs)
+
+
+class ProbeBudget:
+    """Work done by one probe, checked against ProbeLimits"""
+
+    __slots__ = ('limits', 'boxes', 'depth', 'max_depth_seen', 'bytes', 'max_entries_seen', '_deadline')
+
+    def __init__(self, limits: ProbeLimits=None):
+        self.limits = limits or ProbeLimits()
+        self.boxes = 0
+        self.depth = 0
+        self.max_depth_seen = 0
+        self.bytes = 0
+        self.max_entries_seen = 0
+        max_seconds = self.limits.max_seconds
+        self._deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+
+    def restart(self) -> None:
+        """Reset the counters before a replay of the same reads (ref: AsyncRemoteReader.drive), the deadline is kept"""
+        self.boxes = 0
+        self.depth = 0
+        self.max_depth_seen = 0
+        self.bytes = 0
+        self.max_entries_seen = 0
+
+    def check_time(self) -> None:
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            raise ProbeLimitExceeded('seconds', round(time.monotonic() - self._deadline + self.limits.max_seconds, 3),
+                                     self.limits.max_seconds)
+
+    def count_box(self) -> None:
+        self.boxes += 1
+        if self.limits.max_boxes is not None and self.boxes > self.limits.max_boxes:
+            raise ProbeLimitExceeded('boxes', self.boxes, self.limits.max_boxes)
+        self.check_time()
+
+    def enter(self) -> None:
+        """One level deeper, paired with leave"""
+        self.depth += 1
+        self.max_depth_seen = max(self.max_depth_seen, self.depth)
+        if self.limits.max_depth is not None and self.depth > self.limits.max_depth:
+            raise ProbeLimitExceeded('depth', self.depth, self.limits.max_depth)
+
+    def leave(self) -> None:
+        self.depth -= 1
+
+    def count_bytes(self, num_of_byte: int) -> None:
+        """Charged before the read, so a huge read fails without allocating"""
+        self.bytes += num_of_byte
+        if self.limits.max_bytes is not None and self.bytes > self.limits.max_bytes:
+            raise ProbeLimitExceeded('bytes', self.bytes, self.limits.max_bytes)
+        self.check_time()
+
+    def count_entries(self, count: int) -> None:
+        self.max_entries_seen = max(self.max_entries_seen, count)
+        if self.limits.max_entries is not None and count > self.limits.max_entries:
+            raise ProbeLimitExceeded('entries', count, self.limits.max_entries)
+
+    def json(self) -> dict:
+        return {'boxes': self.boxes, 'depth': self.max_depth_seen, 'bytes': self.bytes,
+                'entries': self.max_entries_seen}
@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import json
 import logging
 import os
 import sys
 
-from input import FileVideoReader, RemoteFileReader
-from type_checker import check_video_type, VideoTypeEnum, type_to_parser
+from probe import DEFAULT_WORKERS, GLOB_CHARS, iter_locations, probe, probe_many
 from utils import format_video_info, set_logging
 
 __git_url__ = 'https://github.com/ZhenningLang/python-video-info'
@@ -20,47 +20,167 @@ def format_help(formatted_help):
 def read_args():
     parser = argparse.ArgumentParser(description='Get video info by PURE python codes')
     parser.add_argument(
-        'video_location', nargs='?', default='', help='the location of video (local path or url)')
+        'video_location', nargs='*', default=[],
+        help='the location of video (local path or url), directories and glob patterns are expanded')
     parser.add_argument(
         '--debug', action='store_const', const=True, default=False, help='using debug mode')
     parser.add_argument(
         '--json', action='store_const', const=True, default=False, help='json format output')
+    parser.add_argument(
+        '--jsonl', action='store_const', const=True, default=False,
+        help='batch mode: one json line per video, printed as soon as the video is probed')
+    parser.add_argument(
+        '-i', '--input-file', default=None, help='a file of video locations, one per line, - for stdin')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=DEFAULT_WORKERS,
+        help='number of workers in batch mode, and of keep-alive connections per host')
+    parser.add_argument(
+        '--processes', action='store_const', const=True, default=False,
+        help='use worker processes instead of threads in batch mode (for cpu bound local probing)')
+    parser.add_argument(
+        '--fields', default=None,
+        help='comma separated fields to parse only, e.g. duration,video.width,tracks[*].codec (mp4 and mov)')
+    parser.add_argument(
+        '--limits', default=None,
+        help='comma separated limits of the work spent on each video, e.g. boxes=10000,depth=16,bytes=1048576,'
+             'entries=100000,seconds=2 (others default)')
+    parser.add_argument(
+        '--cache', default=None, help='sqlite file caching probe results of unchanged videos')
+    parser.add_argument(
+        '--cache-max-bytes', type=int, default=None, help='size limit of cached results')
+    parser.add_argument(
+        '--cache-invalidate', action='store_const', const=True, default=False,
+        help='remove cached results of the given locations (all results if no location) and exit')
+    parser.add_argument(
+        '--boxes', action='store_const', const=True, default=False,
+        help='print every box of a mp4 (mov) video as one json line: depth, path, type, offset, size, header')
+    parser.add_argument(
+        '--layout', action='store_const', const=True, default=False,
+        help='print the top level boxes of a mp4 (mov) video, whether it is faststart and a read plan')
+    parser.add_argument(
+        '--seek-index', action='store_const', const=True, default=False,
+        help='print the key frame index of a mp4 (mov) video, saved into a sidecar file for later lookups')
+    parser.add_argument(
+        '--seek', type=float, default=None, metavar='SECONDS',
+        help='print the offset and size of the nearest key frame at or before SECONDS (mp4 and mov)')
+    parser.add_argument(
+        '--track', type=int, default=None, help='track id of --seek, default the first video track')
+    parser.add_argument(
+        '--index-file', default=None, help='sidecar file of --seek-index and --seek, default <video>.seekidx')
     return format_help(parser.format_help()), parser.parse_args()
 
 
-def get_file_reader(loc):
+def parse_fields(fields: str):
+    return [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+
+
+def is_batch(args) -> bool:
+    if args.jsonl or args.input_file or len(args.video_location) != 1:
+        return True
+    loc = args.video_location[0]
+    return '://' not in loc and (any(c in loc for c in GLOB_CHARS) or os.path.isdir(loc))
+
+
+def batch_main(args, cache=None) -> int:
+    """Probe all locations, print one json line per video, return the number of failures"""
+    failures = 0
+    locations = iter_locations(args.video_location, args.input_file)
+    for result in probe_many(locations, workers=args.workers, use_processes=args.processes, cache=cache,
+                             fields=parse_fields(args.fields), limits=args.limits):
+        failures += 'error' in result
+        print(json.dumps(result, default=str, ensure_ascii=False), flush=True)
+    return failures
+
+
+def boxes_main(args) -> None:
+    """--boxes and --layout"""
+    from parsers import mp4
+    from probe import open_reader
+    loc = args.video_location[0]
     try:
-        if os.path.isfile(loc):
-            file_reader = FileVideoReader(loc)
-        else:
-            file_reader = RemoteFileReader(loc)
+        with open_reader(loc) as reader:
+            if args.layout:
+                print(json.dumps(mp4.scan_layout(reader)))
+                return
+            for event in mp4.iter_box_events(reader):
+                print(json.dumps(event._asdict(), default=str, ensure_ascii=False))
+    except BrokenPipeError:  # e.g. piped into head
+        sys.stderr.close()
     except Exception as e:
-        logging.error("Open video location '{}' error: {}".format(loc, repr(e)), exc_info=True)
+        logging.error("Walk boxes of video location '{}' error: {}".format(loc, repr(e)), exc_info=True)
         sys.exit(-1)
 
-    if isinstance(file_reader, FileVideoReader):
-        logging.debug('Local File')
-    else:
-        logging.debug('Remote File')
-    return file_reader
+
+def seek_main(args) -> None:
+    from seek_index import SeekIndex  # only when seeking
+    loc = args.video_location[0]
+    try:
+        index = SeekIndex.load_or_build(loc, args.index_file)
+    except Exception as e:
+        logging.error("Index video location '{}' error: {}".format(loc, repr(e)), exc_info=True)
+        sys.exit(-1)
+    if args.seek is None:
+        print(json.dumps(index.json()))
+        return
+    entry = index.lookup(args.seek, args.track)
+    if entry is None:
+        logging.error('Track {} is not indexed, only video tracks and tracks with sync samples are'.format(
+            args.track))
+        sys.exit(-1)
+    print(json.dumps(entry._asdict()))
 
 
 def main() -> None:
     formatted_help, args = read_args()
     set_logging(logging.DEBUG if args.debug else logging.INFO)
 
-    if not args.video_location:
+    if not args.video_location and not args.input_file and not args.cache_invalidate:
         logging.info(formatted_help)
         sys.exit(-1)
-    loc = args.video_location
-    file_reader = get_file_reader(loc)
-    extend = file_reader.extend  # potential extend
-    logging.debug('Potential extend: {}'.format(extend))
-    # type checking
-    video_type = check_video_type(file_reader, potential=VideoTypeEnum.get_type_from_extend(extend))
-    parser = type_to_parser(video_type)  # one proper parse in parsers
-    # raw video info, always json
-    video_info = parser.parse(file_reader)
+    if args.limits is not None:
+        from limits import parse_limits
+        try:
+            args.limits = parse_limits(args.limits)
+        except Exception as e:
+            logging.error('Invalid --limits {}: {}'.format(args.limits, e))
+            sys.exit(-1)
+    cache = None
+    if args.cache:
+        from probe_cache import DEFAULT_MAX_BYTES, ProbeCache  # sqlite3 only when needed
+        cache = ProbeCache(args.cache, args.cache_max_bytes or DEFAULT_MAX_BYTES)
+    if args.cache_invalidate:
+        if cache is None:
+            logging.error('--cache is required by --cache-invalidate')
+            sys.exit(-1)
+        locations = iter_locations(args.video_location, args.input_file)
+        if args.video_location or args.input_file:
+            count = cache.invalidate(locations)
+        else:
+            count = cache.invalidate()
+        logging.info('{} cached results removed'.format(count))
+        cache.close()
+        return
+    if args.boxes or args.layout or args.seek_index or args.seek is not None:
+        if len(args.video_location) != 1:
+            logging.error('--boxes, --layout, --seek-index and --seek take exactly one video location')
+            sys.exit(-1)
+        return boxes_main(args) if args.boxes or args.layout else seek_main(args)
+    if is_batch(args):
+        failures = batch_main(args, cache)
+        if cache is not None:
+            cache.close()
+        sys.exit(1 if failures else 0)
+
+    loc = args.video_location[0]
+    try:
+        # raw video info, always json
+        video_info = probe(loc, cache, parse_fields(args.fields), args.limits)['info']
+    except Exception as e:
+        logging.error("Probe video location '{}' error: {}".format(loc, repr(e)), exc_info=True)
+        sys.exit(-1)
+    finally:
+        if cache is not None:
+            cache.close()
     # format video info indicated by fmt
     formatted_video_info = format_video_info(video_info, fmt='json' if args.json else 'text')
     print(formatted_video_info)
@@ -1,11 +1,269 @@
 # -*- coding: utf-8 -*-
 
+"""
+Main Reference:
+Advanced Systems Format (ASF) Specification, Revision 01.20.05
 
-def type_checking_passed(reader):
-    # first 16 bytes are header object uuid
-    # b'\x30\x26\xB2\x75\x8E\x66\xCF\x11\xA6\xD9\x00\xAA\x00\x62\xCE\x6C'
-    return reader.read(16) == b'\x30\x26\xB2\x75\x8E\x66\xCF\x11\xA6\xD9\x00\xAA\x00\x62\xCE\x6C'
+ASF (wma, wmv) is objects of a GUID, a 64 bit little endian size and a payload.
+The file is the Header Object, the Data Object and optionally index objects.
 
+The Header Object is read at once and its children are decoded from memory by
+the handler of their GUID in HEADER_OBJECT_HANDLERS (unknown ones are skipped).
+The Data Object is only located by its size and never read, so a probe reads
+the header alone whatever the size of the file.
+"""
 
-def parse(reader):
-    return "In asf parser.parse"
+import datetime
+import logging
+import struct
+
+from consts import ASF_HEADER_GUID
+from excptions import EOF
+from parsers.wintypes import BITMAPINFOHEADER, WAVEFORMATEX, decode_bitmap_info_header, decode_wave_format
+
+__all__ = ('parse', 'guid', 'decode_header_objects', 'HEADER_OBJECT_HANDLERS')
+
+OBJECT_HEADER = struct.Struct('<16sQ')  # GUID, size
+HEADER_OBJECT_HEADER = struct.Struct('<16sQIBB')  # GUID, size, number of header objects, reserved 1 and 2
+# file id, file size, creation date, data packets count, play duration, send duration, preroll, flags,
+# minimum data packet size, maximum data packet size, maximum bitrate
+FILE_PROPERTIES = struct.Struct('<16sQQQQQQIIII')
+# stream type, error correction type, time offset, type specific data length, error correction data length,
+# flags, reserved
+STREAM_PROPERTIES = struct.Struct('<16s16sQIIHI')
+VIDEO_MEDIA_HEADER = struct.Struct('<IIBH')  # encoded image width, height, reserved flags, format data size
+# start time, end time, data bitrate, buffer size, initial buffer fullness, alternate data bitrate, alternate buffer
+# size, alternate initial buffer fullness, maximum object size, flags, stream number, language id index,
+# average time per frame, stream name count, payload extension system count
+EXTENDED_STREAM_PROPERTIES = struct.Struct('<QQIIIIIIIIHHQHH')
+HEADER_EXTENSION = struct.Struct('<16sHI')  # reserved field 1, reserved field 2, header extension data size
+
+FILE_TIME_EPOCH = datetime.datetime(1601, 1, 1)
+FLAG_BROADCAST = 0x01
+FLAG_SEEKABLE = 0x02
+MAX_HEADER_SIZE = 64 * 1024 * 1024
+
+
+def guid(text: str) -> bytes:
+    """Bytes in the file of a GUID text, e.g. '75B22630-668E-11CF-A6D9-00AA0062CE6C'"""
+    parts = text.split('-')
+    return (int(parts[0], 16).to_bytes(4, byteorder='little') + int(parts[1], 16).to_bytes(2, byteorder='little') +
+            int(parts[2], 16).to_bytes(2, byteorder='little') + bytes.fromhex(parts[3] + parts[4]))
+
+
+DATA_OBJECT_GUID = guid('75B22636-668E-11CF-A6D9-00AA0062CE6C')
+FILE_PROPERTIES_GUID = guid('8CABDCA1-A947-11CF-8EE4-00C00C205365')
+STREAM_PROPERTIES_GUID = guid('B7DC0791-A9B7-11CF-8EE6-00C00C205365')
+HEADER_EXTENSION_GUID = guid('5FBF03B5-A92E-11CF-8EE3-00C00C205365')
+CODEC_LIST_GUID = guid('86D15240-311D-11D0-A3A4-00A0C90348F6')
+CONTENT_DESCRIPTION_GUID = guid('75B22633-668E-11CF-A6D9-00AA0062CE6C')
+EXTENDED_CONTENT_DESCRIPTION_GUID = guid('D2D0A440-E307-11D2-97F0-00A0C95EA850')
+STREAM_BITRATE_PROPERTIES_GUID = guid('7BF875CE-468D-11D1-8D82-006097C9A2B2')
+EXTENDED_STREAM_PROPERTIES_GUID = guid('14E6A5CB-C672-4332-8399-A96952065B5A')
+
+STREAM_TYPES = {
+    guid('F8699E40-5B4D-11CF-A8FD-00805F5C442B'): 'audio',
+    guid('BC19EFC0-5B4D-11CF-A8FD-00805F5C442B'): 'video',
+    guid('59DACFC0-59E6-11D0-A3AC-00A0C90348F6'): 'command',
+    guid('B61BE100-5B4E-11CF-A8FD-00805F5C442B'): 'jfif',
+    guid('35907DE0-E415-11CF-A917-00805F5C442B'): 'degradable_jpeg',
+    guid('91BD222C-F21C-497A-8B6D-5AA86BFC0185'): 'file_transfer',
+    guid('3AFB65E2-47EF-40F2-AC2C-70A90D71D343'): 'binary',
+}
+CODEC_TYPES = {1: 'video', 2: 'audio', 0xffff: 'unknown'}
+
+
+def _utf16(data: memoryview) -> str:
+    return bytes(data).decode('utf-16-le', errors='replace').split('\x00', 1)[0]
+
+
+def _stream(asf_info: dict, stream_number: int) -> dict:
+    for stream in asf_info['streams']:
+        if stream['stream_number'] == stream_number:
+            return stream
+    stream = {'stream_number': stream_number}
+    asf_info['streams'].append(stream)
+    return stream
+
+
+def decode_file_properties(data: memoryview, asf_info: dict) -> None:
+    (_, file_size, creation_date, data_packets_count, play_duration, send_duration, preroll, flags,
+     min_data_packet_size, max_data_packet_size, max_bitrate) = FILE_PROPERTIES.unpack_from(data)
+    asf_info['file_properties'] = {
+        'file_size': file_size,
+        'creation_date': FILE_TIME_EPOCH + datetime.timedelta(microseconds=creation_date // 10),
+        'data_packets_count': data_packets_count,
+        'play_duration': play_duration / 1e7,  # 100 nanoseconds
+        'send_duration': send_duration / 1e7,
+        'preroll': preroll,  # milliseconds
+        'broadcast': bool(flags & FLAG_BROADCAST),
+        'seekable': bool(flags & FLAG_SEEKABLE),
+        'min_data_packet_size': min_data_packet_size,
+        'max_data_packet_size': max_data_packet_size,
+        'max_bitrate': max_bitrate,
+    }
+
+
+def decode_stream_properties(data: memoryview, asf_info: dict) -> None:
+    stream_type, _, time_offset, type_specific_length, _, flags, _ = STREAM_PROPERTIES.unpack_from(data)
+    type_specific = data[STREAM_PROPERTIES.size: STREAM_PROPERTIES.size + type_specific_length]
+    stream = _stream(asf_info, flags & 0x7f)
+    stream.update({'type': STREAM_TYPES.get(stream_type, 'unknown'), 'encrypted': bool(flags & 0x8000),
+                   'time_offset': time_offset})
+    if stream['type'] == 'audio' and len(type_specific) >= WAVEFORMATEX.size:
+        stream.update(decode_wave_format(type_specific))
+    elif stream['type'] == 'video' and len(type_specific) >= VIDEO_MEDIA_HEADER.size + BITMAPINFOHEADER.size:
+        width, height, _, _ = VIDEO_MEDIA_HEADER.unpack_from(type_specific)
+        stream.update(decode_bitmap_info_header(type_specific, VIDEO_MEDIA_HEADER.size))
+        stream.update({'width': width, 'height': height})  # of the media header, as the BITMAPINFOHEADER may be 0
+
+
+def decode_extended_stream_properties(data: memoryview, asf_info: dict) -> None:
+    (_, _, data_bitrate, _, _, _, _, _, max_object_size, _, stream_number, _, average_time_per_frame, _,
+     _) = EXTENDED_STREAM_PROPERTIES.unpack_from(data)
+    stream = _stream(asf_info, stream_number)
+    stream.update({'data_bitrate': data_bitrate, 'max_object_size': max_object_size})
+    if average_time_per_frame:
+        stream['frame_rate'] = round(1e7 / average_time_per_frame, 3)
+
+
+def decode_stream_bitrate_properties(data: memoryview, asf_info: dict) -> None:
+    count, = struct.unpack_from('<H', data)
+    for flags, average_bitrate in struct.iter_unpack('<HI', data[2: 2 + count * 6]):
+        _stream(asf_info, flags & 0x7f)['average_bitrate'] = average_bitrate
+
+
+def decode_codec_list(data: memoryview, asf_info: dict) -> None:
+    count, = struct.unpack_from('<I', data, 16)
+    position = 20
+    codecs = []
+    for _ in range(count):
+        codec_type, name_length = struct.unpack_from('<HH', data, position)
+        position += 4
+        name = _utf16(data[position: position + name_length * 2])
+        position += name_length * 2
+        description_length, = struct.unpack_from('<H', data, position)
+        position += 2
+        description = _utf16(data[position: position + description_length * 2])
+        position += description_length * 2
+        information_length, = struct.unpack_from('<H', data, position)
+        position += 2 + information_length
+        codecs.append({'type': CODEC_TYPES.get(codec_type, codec_type), 'name': name, 'description': description})
+    asf_info['codecs'] = codecs
+
+
+def decode_content_description(data: memoryview, asf_info: dict) -> None:
+    lengths = struct.unpack_from('<5H', data)
+    position = 10
+    description = {}
+    for name, length in zip(('title', 'author', 'copyright', 'description', 'rating'), lengths):
+        description[name] = _utf16(data[position: position + length])
+        position += length
+    asf_info['content_description'] = description
+
+
+def decode_extended_content_description(data: memoryview, asf_info: dict) -> None:
+    count, = struct.unpack_from('<H', data)
+    position = 2
+    descriptors = {}
+    for _ in range(count):
+        name_length, = struct.unpack_from('<H', data, position)
+        name = _utf16(data[position + 2: position + 2 + name_length])
+        position += 2 + name_length
+        value_type, value_length = struct.unpack_from('<HH', data, position)
+        value = data[position + 4: position + 4 + value_length]
+        position += 4 + value_length
+        if value_type == 0:
+            descriptors[name] = _utf16(value)
+        elif value_type in (2, 3, 4, 5) and len(value) in (2, 4, 8):
+            value = int.from_bytes(value, byteorder='little')
+            descriptors[name] = bool(value) if value_type == 2 else value
+        else:
+            descriptors[name] = bytes(value).hex()
+    asf_info['extended_content_description'] = descriptors
+
+
+def decode_header_extension(data: memoryview, asf_info: dict, budget=None, offset: int=0) -> None:
+    _, _, data_size = HEADER_EXTENSION.unpack_from(data)
+    start = HEADER_EXTENSION.size
+    decode_header_objects(data[start: start + data_size], asf_info, budget, offset + start)
+
+
+# object GUID -> handler(payload, asf info), the payload excludes the GUID and size
+HEADER_OBJECT_HANDLERS = {
+    FILE_PROPERTIES_GUID: decode_file_properties,
+    STREAM_PROPERTIES_GUID: decode_stream_properties,
+    EXTENDED_STREAM_PROPERTIES_GUID: decode_extended_stream_properties,
+    STREAM_BITRATE_PROPERTIES_GUID: decode_stream_bitrate_properties,
+    CODEC_LIST_GUID: decode_codec_list,
+    CONTENT_DESCRIPTION_GUID: decode_content_description,
+    EXTENDED_CONTENT_DESCRIPTION_GUID: decode_extended_content_description,
+    HEADER_EXTENSION_GUID: decode_header_extension,
+}
+
+
+def decode_header_objects(data: memoryview, asf_info: dict, budget=None, offset: int=0) -> None:
+    """
+    Decode the objects in data (at offset of the file) by HEADER_OBJECT_HANDLERS into asf_info.
+    An object too short for its fields is recorded in asf_info['skipped_objects'] and the others are still decoded.
+    """
+    position = 0
+    if budget is not None:
+        budget.enter()
+    try:
+        while position + OBJECT_HEADER.size <= len(data):
+            object_guid, size = OBJECT_HEADER.unpack_from(data, position)
+            if size < OBJECT_HEADER.size:
+                raise Exception('Invalid size {} of ASF object at {}'.format(size, offset + position))
+            if budget is not None:
+                budget.count_box()
+            handler = HEADER_OBJECT_HANDLERS.get(object_guid)
+            if handler is not None:
+                payload = data[position + OBJECT_HEADER.size: position + size]
+                try:
+                    if handler is decode_header_extension:
+                        handler(payload, asf_info, budget, offset + position + OBJECT_HEADER.size)
+                    else:
+                        handler(payload, asf_info)
+                except struct.error as e:
+                    logging.debug('Skip ASF object {} at {}: {}'.format(object_guid.hex(), offset + position, e))
+                    asf_info['skipped_objects'].append(
+                        {'guid': object_guid.hex(), 'offset': offset + position, 'error': str(e)})
+            position += size
+    finally:
+        if budget is not None:
+            budget.leave()
+
+
+def parse(reader) -> dict:
+    """Parse the Header Object, and locate the Data Object after it without reading its packets"""
+    head = reader.read(HEADER_OBJECT_HEADER.size)
+    if len(head) < HEADER_OBJECT_HEADER.size:
+        raise EOF
+    header_guid, header_size, _, _, _ = HEADER_OBJECT_HEADER.unpack(head)
+    if header_guid != ASF_HEADER_GUID:
+        raise Exception('Not an ASF file')
+    if not HEADER_OBJECT_HEADER.size <= header_size <= MAX_HEADER_SIZE:
+        raise Exception('Invalid size {} of ASF Header Object'.format(header_size))
+    if reader.budget is not None:
+        reader.budget.count_box()
+    # the header objects and the GUID and size of the Data Object after them, in one read
+    data = memoryview(reader.read(header_size - HEADER_OBJECT_HEADER.size + OBJECT_HEADER.size))
+    objects_size = header_size - HEADER_OBJECT_HEADER.size
+    if len(data) < objects_size:
+        raise EOF
+    asf_info = {'duration': None, 'streams': [], 'skipped_objects': []}
+    decode_header_objects(data[:objects_size], asf_info, reader.budget, HEADER_OBJECT_HEADER.size)
+    asf_info['streams'].sort(key=lambda s: s['stream_number'])
+
+    file_properties = asf_info.get('file_properties')
+    if file_properties is not None:
+        duration = file_properties['play_duration'] - file_properties['preroll'] / 1000
+        # play duration is not valid while broadcasting
+        asf_info['duration'] = None if file_properties['broadcast'] else round(max(0.0, duration), 3)
+    asf_info['data_object'] = {'offset': header_size, 'size': None}
+    if len(data) == objects_size + OBJECT_HEADER.size:
+        object_guid, size = OBJECT_HEADER.unpack_from(data, objects_size)
+        if object_guid == DATA_OBJECT_GUID:
+            asf_info['data_object']['size'] = size  # skipped by size, the packets are never read
+    return asf_info
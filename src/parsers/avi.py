@@ -1,15 +1,220 @@
 # -*- coding: utf-8 -*-
 
+"""
+Main Reference:
+https://learn.microsoft.com/en-us/windows/win32/directshow/avi-riff-file-reference
+OpenDML AVI File Format Extensions 1.02
 
-def type_checking_passed(reader):
-    # first four bytes are 'RIFF'
-    # 5th to 8th bytes are 'AVI '
-    first_four_bytes = reader.read(4)
-    _ = reader.read(4)
-    third_four_bytes = reader.read(4)
+AVI is RIFF: chunks of a four character id, a little endian size and a payload
+padded to an even length. RIFF and LIST chunks start their payload with a four
+character type and hold chunks.
 
-    return first_four_bytes == b'RIFF' and third_four_bytes == b'AVI '
+Only the head is parsed: the 'hdrl' list (avih, strl/strh/strf, odml/dmlh) is read
+at once and decoded from memory, 'movi' and 'idx1' are skipped by size. Large
+OpenDML files chain further 'RIFF AVIX' chunks (more 'movi'), only their 12 byte
+headers are read, so the cost of a probe does not depend on the size of the file.
+"""
 
+import struct
 
-def parse(reader):
-    return "In avi parser.parse"
+from excptions import EOF
+from parsers.wintypes import BITMAPINFOHEADER, WAVEFORMATEX, decode_bitmap_info_header, decode_wave_format
+
+__all__ = ('parse', 'read_chunk_header', 'decode_list')
+
+CHUNK_HEADER = struct.Struct('<4sI')
+LIST_HEADER_SIZE = 12
+LIST_IDS = ('RIFF', 'LIST')
+HEAD_LIST_TYPES = ('hdrl', 'INFO')  # lists read and decoded, the others (movi) are skipped
+
+# dwMicroSecPerFrame, dwMaxBytesPerSec, dwPaddingGranularity, dwFlags, dwTotalFrames, dwInitialFrames,
+# dwStreams, dwSuggestedBufferSize, dwWidth, dwHeight
+AVIH = struct.Struct('<10I')
+# fccType, fccHandler, dwFlags, wPriority, wLanguage, dwInitialFrames, dwScale, dwRate, dwStart, dwLength,
+# dwSuggestedBufferSize, dwQuality, dwSampleSize, rcFrame
+STRH = struct.Struct('<4s4sIHHIIIIIIIIhhhh')
+
+AVIF_HASINDEX = 0x10
+STREAM_TYPES = {'vids': 'video', 'auds': 'audio', 'txts': 'subtitle', 'mids': 'midi'}
+
+
+def read_chunk_header(reader) -> (str, int, str):
+    """
+    Side effect: reader offset change, to the payload of the chunk (after the type of a list)
+    :return: chunk id, payload size (the type of a list excluded), list type or None
+    """
+    start = reader.tell()
+    head = reader.read(LIST_HEADER_SIZE)
+    if len(head) < CHUNK_HEADER.size:
+        raise EOF
+    chunk_id, size = CHUNK_HEADER.unpack_from(head)
+    chunk_id = chunk_id.decode('latin-1')
+    if reader.budget is not None:
+        reader.budget.count_box()
+    if chunk_id in LIST_IDS and len(head) == LIST_HEADER_SIZE:
+        return chunk_id, max(size - 4, 0), head[8:12].decode('latin-1')
+    reader.seek(start + CHUNK_HEADER.size)
+    return chunk_id, size, None
+
+
+def decode_list(data: memoryview, budget=None) -> list:
+    """Chunks of a list payload: [(chunk id, list type or None, payload or children list)]"""
+    chunks = []
+    position = 0
+    if budget is not None:
+        budget.enter()
+    try:
+        while position + CHUNK_HEADER.size <= len(data):
+            chunk_id, size = CHUNK_HEADER.unpack_from(data, position)
+            chunk_id = chunk_id.decode('latin-1')
+            if budget is not None:
+                budget.count_box()
+            start = position + CHUNK_HEADER.size
+            end = min(start + size, len(data))
+            if chunk_id == 'LIST' and end - start >= 4:
+                list_type = bytes(data[start: start + 4]).decode('latin-1')
+                chunks.append((chunk_id, list_type, decode_list(data[start + 4: end], budget)))
+            else:
+                chunks.append((chunk_id, None, data[start: end]))
+            position = end + (size & 1)  # padded to an even length
+    finally:
+        if budget is not None:
+            budget.leave()
+    return chunks
+
+
+def _string(data: memoryview) -> str:
+    return bytes(data).split(b'\x00', 1)[0].decode('latin-1').strip()
+
+
+def _fourcc(data: bytes) -> str:
+    return data.decode('latin-1').rstrip('\x00 ')
+
+
+def decode_avih(data: memoryview) -> dict:
+    if len(data) < AVIH.size:
+        raise Exception('Invalid avih of {} bytes'.format(len(data)))
+    (micro_sec_per_frame, max_bytes_per_sec, _, flags, total_frames, initial_frames, streams, suggested_buffer_size,
+     width, height) = AVIH.unpack_from(data)
+    return {
+        'micro_sec_per_frame': micro_sec_per_frame,
+        'max_bytes_per_sec': max_bytes_per_sec,
+        'flags': flags,
+        'has_index': bool(flags & AVIF_HASINDEX),
+        'total_frames': total_frames,
+        'initial_frames': initial_frames,
+        'streams': streams,
+        'suggested_buffer_size': suggested_buffer_size,
+        'width': width,
+        'height': height,
+    }
+
+
+def decode_strl(chunks: list) -> dict:
+    """A stream of its strh, strf (BITMAPINFOHEADER or WAVEFORMATEX) and strn"""
+    stream = {}
+    for chunk_id, _, data in chunks:
+        if chunk_id == 'strh' and len(data) >= STRH.size:
+            fcc_type, fcc_handler, _, _, _, _, scale, rate, start, length, _, _, sample_size = \
+                STRH.unpack_from(data)[:13]
+            stream.update({
+                'type': STREAM_TYPES.get(_fourcc(fcc_type), _fourcc(fcc_type)),
+                'handler': _fourcc(fcc_handler),
+                'scale': scale,
+                'rate': rate,
+                'start': start,
+                'length': length,
+                'sample_size': sample_size,
+                'duration': round((start + length) * scale / rate, 3) if rate else None,
+            })
+            if stream['type'] == 'video' and scale:
+                stream['frame_rate'] = round(rate / scale, 3)
+        elif chunk_id == 'strf':
+            stream['format'] = data
+        elif chunk_id == 'strn':
+            stream['name'] = _string(data)
+    data = stream.pop('format', b'')
+    if stream.get('type') == 'video' and len(data) >= BITMAPINFOHEADER.size:
+        stream.update(decode_bitmap_info_header(data))
+    elif stream.get('type') == 'audio' and len(data) >= WAVEFORMATEX.size:
+        stream.update(decode_wave_format(data))
+    return stream
+
+
+def decode_hdrl(chunks: list) -> dict:
+    head = {'avih': None, 'streams': [], 'odml': None}
+    for chunk_id, list_type, data in chunks:
+        if chunk_id == 'avih':
+            head['avih'] = decode_avih(data)
+        elif list_type == 'strl':
+            head['streams'].append(decode_strl(data))
+        elif list_type == 'odml':
+            for child_id, _, child_data in data:
+                if child_id == 'dmlh' and len(child_data) >= 4:
+                    head['odml'] = {'total_frames': struct.unpack_from('<I', child_data)[0]}
+    return head
+
+
+def parse(reader) -> dict:
+    """Parse the head of an AVI: hdrl, INFO, and the layout of the RIFF chunks (AVI, AVIX...)"""
+    head, info = None, {}
+    riff_chunks = []
+    has_idx1 = False
+    position = 0
+    while reader.total_bytes < 0 or position + CHUNK_HEADER.size <= reader.total_bytes:
+        reader.seek(position)
+        try:
+            chunk_id, size, riff_type = read_chunk_header(reader)
+        except EOF:
+            break
+        if chunk_id != 'RIFF':
+            if not riff_chunks:
+                raise Exception('Not a RIFF file')
+            break  # junk after the last RIFF chunk
+        riff_chunks.append({'type': riff_type, 'offset': position, 'size': size + 4})
+        end = position + LIST_HEADER_SIZE + size
+        if reader.total_bytes >= 0:
+            end = min(end, reader.total_bytes)  # truncated captures
+        if riff_type == 'AVI ':
+            child_position = position + LIST_HEADER_SIZE
+            while child_position + CHUNK_HEADER.size <= end:
+                reader.seek(child_position)
+                try:
+                    child_id, child_size, list_type = read_chunk_header(reader)
+                except EOF:
+                    break
+                payload_position = reader.tell()
+                if list_type in HEAD_LIST_TYPES:
+                    payload = memoryview(reader.read(min(child_size, end - payload_position)))
+                    chunks = decode_list(payload, reader.budget)
+                    if list_type == 'hdrl' and head is None:
+                        head = decode_hdrl(chunks)
+                    elif list_type == 'INFO':
+                        info.update((i, _string(data)) for i, _, data in chunks if not isinstance(data, list))
+                elif child_id == 'idx1':
+                    has_idx1 = True
+                child_position = payload_position + child_size + (child_size & 1)
+        position = end + ((end - position) & 1)
+
+    if head is None or head['avih'] is None:
+        raise Exception('No avih found in {}'.format(reader.video_loc))
+    avih = head['avih']
+    total_frames = head['odml']['total_frames'] if head['odml'] else avih['total_frames']
+    video_streams = [s for s in head['streams'] if s.get('type') == 'video']
+    if video_streams and video_streams[0].get('scale') and video_streams[0].get('rate'):
+        # exact frame duration of the strh (e.g. 1001 / 30000 s), frame_rate is rounded for display only
+        duration = total_frames * video_streams[0]['scale'] / video_streams[0]['rate']
+    else:
+        duration = total_frames * avih['micro_sec_per_frame'] / 1e6
+    return {
+        'duration': round(duration, 3),
+        'total_frames': total_frames,
+        'width': avih['width'],
+        'height': avih['height'],
+        'avih': avih,
+        'streams': head['streams'],
+        'odml': head['odml'],
+        'info': info,
+        'riff_chunks': riff_chunks,
+        'has_idx1': has_idx1,
+    }
@@ -1,10 +1,289 @@
 # -*- coding: utf-8 -*-
 
+"""
+Main Reference:
+Adobe Flash Video File Format Specification Version 10.1 (Annex E)
+Action Message Format -- AMF 0
 
-def type_checking_passed(reader):
-    # first three bytes are 'FLV'
-    return reader.read(3) == b'FLV'
+FLV is a 9 byte header and tags, each tag followed by a 4 byte PreviousTagSize.
+Tags are 11 byte headers (type, data size, timestamp, stream id) and data.
 
+The head tags are read: the script data tag 'onMetaData' (AMF0) tells the
+duration, dimensions, rates and the key frame index, the first audio and video
+tags tell the codecs. Live recorded files often have no (or a zero) duration in
+onMetaData, then the tail of the file is read at once and the tags are walked
+back through PreviousTagSize to the last timestamp. Both take a constant number
+of reads whatever the length of the file.
+"""
 
-def parse(reader):
-    return "In flv parser.parse"
+import struct
+
+from excptions import EOF
+
+__all__ = ('parse', 'decode_amf0', 'read_tag_header')
+
+FILE_HEADER = struct.Struct('>3sBBI')  # signature, version, flags, data offset
+TAG_HEADER = struct.Struct('>BHBHBBHB')  # type, data size (24 bits), timestamp (24 + 8 bits), stream id
+TAG_HEADER_SIZE = 11
+PREVIOUS_TAG_SIZE_LENGTH = 4
+
+TAG_AUDIO = 8
+TAG_VIDEO = 9
+TAG_SCRIPT = 18
+TAG_TYPES = (TAG_AUDIO, TAG_VIDEO, TAG_SCRIPT)
+FLAG_AUDIO = 0x04
+FLAG_VIDEO = 0x01
+
+MAX_HEAD_TAGS = 8  # tags read at the beginning for onMetaData and the codecs
+TAIL_LENGTH = 64 * 1024  # bytes read at the end for the last timestamp
+MAX_SCRIPT_DATA_SIZE = 16 * 1024 * 1024
+
+VIDEO_CODECS = {2: 'h263', 3: 'screen', 4: 'vp6', 5: 'vp6a', 6: 'screen2', 7: 'h264', 12: 'hevc', 13: 'av1'}
+AUDIO_CODECS = {
+    0: 'pcm', 1: 'adpcm', 2: 'mp3', 3: 'pcm_le', 4: 'nellymoser_16k', 5: 'nellymoser_8k', 6: 'nellymoser',
+    7: 'alaw', 8: 'mulaw', 10: 'aac', 11: 'speex', 14: 'mp3_8k',
+}
+AUDIO_RATES = (5512, 11025, 22050, 44100)
+
+# AMF0 markers
+AMF_NUMBER = 0x00
+AMF_BOOLEAN = 0x01
+AMF_STRING = 0x02
+AMF_OBJECT = 0x03
+AMF_NULL = 0x05
+AMF_UNDEFINED = 0x06
+AMF_REFERENCE = 0x07
+AMF_ECMA_ARRAY = 0x08
+AMF_OBJECT_END = 0x09
+AMF_STRICT_ARRAY = 0x0A
+AMF_DATE = 0x0B
+AMF_LONG_STRING = 0x0C
+
+
+class AMF0Decoder:
+    """Decode AMF0 values from a buffer, nesting and entries charged to budget"""
+
+    __slots__ = ('data', 'position', 'budget')
+
+    def __init__(self, data: memoryview, budget=None):
+        self.data = data
+        self.position = 0
+        self.budget = budget
+
+    def _take(self, length: int) -> memoryview:
+        if self.position + length > len(self.data):
+            raise EOF
+        view = self.data[self.position: self.position + length]
+        self.position += length
+        return view
+
+    def _unpack(self, fmt: str):
+        return struct.unpack(fmt, self._take(struct.calcsize(fmt)))[0]
+
+    def _string(self, length_format: str='>H') -> str:
+        return bytes(self._take(self._unpack(length_format))).decode('utf8', errors='replace')
+
+    def _properties(self) -> dict:
+        values = {}
+        while True:
+            name = self._string()
+            if not name and self.position < len(self.data) and self.data[self.position] == AMF_OBJECT_END:
+                self.position += 1
+                return values
+            values[name] = self.value()
+            if self.position >= len(self.data):  # end marker missing, seen in the wild
+                return values
+
+    def value(self):
+        marker = self._take(1)[0]
+        if marker == AMF_NUMBER:
+            return self._unpack('>d')
+        if marker == AMF_BOOLEAN:
+            return self._take(1)[0] != 0
+        if marker == AMF_STRING:
+            return self._string()
+        if marker == AMF_LONG_STRING:
+            return self._string('>I')
+        if marker in (AMF_NULL, AMF_UNDEFINED):
+            return None
+        if marker == AMF_REFERENCE:
+            return self._unpack('>H')
+        if marker == AMF_DATE:
+            milliseconds = self._unpack('>d')
+            self._take(2)  # time zone, reserved
+            return milliseconds
+        if marker not in (AMF_OBJECT, AMF_ECMA_ARRAY, AMF_STRICT_ARRAY):
+            raise Exception('Unsupported AMF0 marker 0x{:02x} at {}'.format(marker, self.position - 1))
+        if self.budget is not None:
+            self.budget.enter()
+        try:
+            if marker == AMF_OBJECT:
+                return self._properties()
+            count = self._unpack('>I')
+            if self.budget is not None:
+                self.budget.count_entries(count)
+            if marker == AMF_ECMA_ARRAY:
+                return self._properties()  # the count is only a hint
+            if count > len(self.data) - self.position:  # each value takes a byte at least
+                raise EOF
+            return [self.value() for _ in range(count)]
+        finally:
+            if self.budget is not None:
+                self.budget.leave()
+
+
+def decode_amf0(data: memoryview, budget=None) -> list:
+    """All the AMF0 values in data, e.g. ['onMetaData', {...}] of a script data tag"""
+    decoder = AMF0Decoder(data, budget)
+    values = []
+    while decoder.position < len(data):
+        values.append(decoder.value())
+    return values
+
+
+def unpack_tag_header(data, offset: int=0) -> (int, int, int):
+    """tag type, data size, timestamp (milliseconds) of the tag header at offset of data"""
+    tag_type, size_high, size_low, timestamp_high, timestamp_low, timestamp_extended, _, _ = \
+        TAG_HEADER.unpack_from(data, offset)
+    return (tag_type & 0x1f, (size_high << 8) | size_low,
+            (timestamp_extended << 24) | (timestamp_high << 8) | timestamp_low)
+
+
+def read_tag_header(reader) -> (int, int, int, int):
+    """
+    Side effect: reader offset change, to the data of the tag
+    :return: tag type, data size, timestamp (milliseconds), the first byte of the data (-1 if none)
+    """
+    head = reader.read(TAG_HEADER_SIZE + 1)
+    if len(head) < TAG_HEADER_SIZE:
+        raise EOF
+    if reader.budget is not None:
+        reader.budget.count_box()
+    reader.seek(reader.tell() - len(head) + TAG_HEADER_SIZE)
+    return unpack_tag_header(head) + (head[TAG_HEADER_SIZE] if len(head) > TAG_HEADER_SIZE else -1, )
+
+
+def _is_tag_end(data: memoryview, end: int) -> bool:
+    """Whether the PreviousTagSize ending at end of data points to a valid tag"""
+    if end < PREVIOUS_TAG_SIZE_LENGTH:
+        return False
+    tag_size = struct.unpack_from('>I', data, end - PREVIOUS_TAG_SIZE_LENGTH)[0]
+    start = end - PREVIOUS_TAG_SIZE_LENGTH - tag_size
+    if tag_size < TAG_HEADER_SIZE or start < 0:
+        return False
+    tag_type, data_size, _ = unpack_tag_header(data, start)
+    return tag_type in TAG_TYPES and data_size + TAG_HEADER_SIZE == tag_size
+
+
+def last_timestamp(reader, data_offset: int):
+    """Timestamp (milliseconds) of the last audio or video tag, from one read of the tail, None if not found
+
+    The tags are walked back through PreviousTagSize. A truncated tail (a live
+    recording cut short) is searched backwards for the end of the last whole tag.
+    """
+    if reader.total_bytes < 0:
+        return None
+    start = max(data_offset, reader.total_bytes - TAIL_LENGTH)
+    reader.seek(start)
+    data = memoryview(reader.read(reader.total_bytes - start))
+    end = len(data)
+    while end >= PREVIOUS_TAG_SIZE_LENGTH and not _is_tag_end(data, end):
+        end -= 1
+    timestamp = None
+    while _is_tag_end(data, end):
+        if reader.budget is not None:
+            reader.budget.count_box()
+        tag_start = end - PREVIOUS_TAG_SIZE_LENGTH - struct.unpack_from('>I', data, end - PREVIOUS_TAG_SIZE_LENGTH)[0]
+        tag_type, _, tag_timestamp = unpack_tag_header(data, tag_start)
+        if tag_type in (TAG_AUDIO, TAG_VIDEO):
+            timestamp = tag_timestamp if timestamp is None else max(timestamp, tag_timestamp)
+            if tag_type == TAG_VIDEO:  # audio may be interleaved a little ahead of video
+                break
+        end = tag_start
+    return timestamp
+
+
+def _video_info(first_byte: int) -> dict:
+    codec_id = first_byte & 0x0f
+    if first_byte & 0x80:  # enhanced rtmp: a FourCC follows, not read here
+        return {'video_codec': 'enhanced'}
+    return {'video_codec': VIDEO_CODECS.get(codec_id, codec_id)}
+
+
+def _audio_info(first_byte: int) -> dict:
+    sound_format = first_byte >> 4
+    return {
+        'audio_codec': AUDIO_CODECS.get(sound_format, sound_format),
+        'audio_sample_rate': AUDIO_RATES[(first_byte >> 2) & 0x03],
+        'audio_sample_size': 16 if first_byte & 0x02 else 8,
+        'stereo': bool(first_byte & 0x01),
+    }
+
+
+def parse(reader) -> dict:
+    """Parse the FLV header, onMetaData and the first audio and video tags, duration from the tail if needed"""
+    head = reader.read(FILE_HEADER.size)
+    if len(head) < FILE_HEADER.size:
+        raise EOF
+    signature, version, flags, data_offset = FILE_HEADER.unpack(head)
+    if signature != b'FLV':
+        raise Exception('Not a FLV file')
+    video_info = {
+        'version': version,
+        'has_audio': bool(flags & FLAG_AUDIO),
+        'has_video': bool(flags & FLAG_VIDEO),
+        'duration': None,
+        'duration_source': None,
+        'metadata': {},
+        'keyframes': None,
+    }
+    metadata = None
+    first_timestamp = None
+    position = data_offset + PREVIOUS_TAG_SIZE_LENGTH
+    for _ in range(MAX_HEAD_TAGS):
+        reader.seek(position)
+        try:
+            tag_type, data_size, timestamp, first_byte = read_tag_header(reader)
+        except EOF:
+            break
+        if tag_type not in TAG_TYPES:
+            break  # garbage, the head tags are over
+        if tag_type == TAG_SCRIPT and metadata is None and data_size <= MAX_SCRIPT_DATA_SIZE:
+            try:
+                values = decode_amf0(memoryview(reader.read(data_size)), reader.budget)
+            except EOF:  # cut short, the duration is taken from the tail
+                values = []
+            if len(values) >= 2 and values[0] == 'onMetaData' and isinstance(values[1], dict):
+                metadata = values[1]
+        elif tag_type == TAG_VIDEO and 'video_codec' not in video_info and first_byte >= 0:
+            video_info.update(_video_info(first_byte))
+        elif tag_type == TAG_AUDIO and 'audio_codec' not in video_info and first_byte >= 0:
+            video_info.update(_audio_info(first_byte))
+        if tag_type != TAG_SCRIPT and first_timestamp is None:
+            first_timestamp = timestamp
+        position += TAG_HEADER_SIZE + data_size + PREVIOUS_TAG_SIZE_LENGTH
+        if metadata is not None and (not video_info['has_video'] or 'video_codec' in video_info) and (
+                not video_info['has_audio'] or 'audio_codec' in video_info):
+            break
+
+    if metadata is not None:
+        keyframes = metadata.pop('keyframes', None)
+        if isinstance(keyframes, dict):
+            video_info['keyframes'] = {
+                'times': [t for t in keyframes.get('times', []) if isinstance(t, float)],
+                'filepositions': [int(p) for p in keyframes.get('filepositions', []) if isinstance(p, float)],
+            }
+        video_info['metadata'] = metadata
+        for name, key in (('width', 'width'), ('height', 'height'), ('framerate', 'frame_rate'),
+                          ('videodatarate', 'video_data_rate'), ('audiodatarate', 'audio_data_rate')):
+            if isinstance(metadata.get(name), float):
+                video_info[key] = metadata[name]
+        if isinstance(metadata.get('duration'), float) and metadata['duration'] > 0:
+            video_info['duration'] = round(metadata['duration'], 3)
+            video_info['duration_source'] = 'metadata'
+    if video_info['duration'] is None:
+        timestamp = last_timestamp(reader, data_offset)
+        if timestamp is not None:
+            video_info['duration'] = round((timestamp - (first_timestamp or 0)) / 1000, 3)
+            video_info['duration_source'] = 'tail'
+    return video_info
@@ -1,10 +1,362 @@
 # -*- coding: utf-8 -*-
 
+"""
+Main Reference:
+https://www.matroska.org/technical/elements.html
+https://github.com/ietf-wg-cellar/ebml-specification
 
-def type_checking_passed(reader):
-    # first four bytes are '\x1A\x45\xDF\xA3'
-    return reader.read(4) == b'\x1A\x45\xDF\xA3'
+Matroska (and WebM) is EBML: elements of a variable length id, a variable length
+size and a payload, big endian.
 
+Only the head is parsed: the SeekHead of the Segment tells where Info, Tracks
+(and Cues) are, each of them is read at once and decoded from memory by SCHEMA.
+Cluster elements (the media data) are skipped by size and never read, so the
+cost of a probe does not depend on the size of the file.
+"""
 
-def parse(reader):
-    return "In mkv parser.parse"
+import datetime
+import logging
+import struct
+from array import array
+
+from excptions import EOF
+
+__all__ = ('parse', 'read_element_header', 'decode_master', 'CueIndex')
+
+EBML_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+SEEK_HEAD_ID = 0x114D9B74
+INFO_ID = 0x1549A966
+TRACKS_ID = 0x1654AE6B
+CUES_ID = 0x1C53BB6B
+CLUSTER_ID = 0x1F43B675
+
+MAX_HEADER_LENGTH = 12  # id (4 bytes at most) and size (8 bytes at most)
+UNKNOWN_SIZE = -1
+MATROSKA_EPOCH = datetime.datetime(2001, 1, 1)
+TRACK_TYPES = {1: 'video', 2: 'audio', 3: 'complex', 16: 'logo', 17: 'subtitle', 18: 'buttons', 32: 'control'}
+
+# element id -> (name, type, is a list), elements not in SCHEMA are skipped
+# types: uint, int, float, string (ascii), utf8, date, binary, master
+SCHEMA = {
+    # EBML header
+    0x4286: ('ebml_version', 'uint', False),
+    0x4282: ('doc_type', 'string', False),
+    0x4287: ('doc_type_version', 'uint', False),
+    0x4285: ('doc_type_read_version', 'uint', False),
+    # SeekHead
+    0x4DBB: ('seek', 'master', True),
+    0x53AB: ('seek_id', 'binary', False),
+    0x53AC: ('seek_position', 'uint', False),
+    # Info
+    0x2AD7B1: ('timecode_scale', 'uint', False),
+    0x4489: ('duration', 'float', False),
+    0x4461: ('date_utc', 'date', False),
+    0x7BA9: ('title', 'utf8', False),
+    0x4D80: ('muxing_app', 'utf8', False),
+    0x5741: ('writing_app', 'utf8', False),
+    # Tracks
+    0xAE: ('track_entry', 'master', True),
+    0xD7: ('track_number', 'uint', False),
+    0x73C5: ('track_uid', 'uint', False),
+    0x83: ('track_type', 'uint', False),
+    0xB9: ('flag_enabled', 'uint', False),
+    0x88: ('flag_default', 'uint', False),
+    0x23E383: ('default_duration', 'uint', False),
+    0x536E: ('name', 'utf8', False),
+    0x22B59C: ('language', 'string', False),
+    0x86: ('codec_id', 'string', False),
+    0x258688: ('codec_name', 'utf8', False),
+    0xE0: ('video', 'master', False),
+    0xB0: ('pixel_width', 'uint', False),
+    0xBA: ('pixel_height', 'uint', False),
+    0x54B0: ('display_width', 'uint', False),
+    0x54BA: ('display_height', 'uint', False),
+    0x9A: ('flag_interlaced', 'uint', False),
+    0xE1: ('audio', 'master', False),
+    0xB5: ('sampling_frequency', 'float', False),
+    0x78B5: ('output_sampling_frequency', 'float', False),
+    0x9F: ('channels', 'uint', False),
+    0x6264: ('bit_depth', 'uint', False),
+    # Cues
+    0xBB: ('cue_point', 'master', True),
+    0xB3: ('cue_time', 'uint', False),
+    0xB7: ('cue_track_positions', 'master', True),
+    0xF7: ('cue_track', 'uint', False),
+    0xF1: ('cue_cluster_position', 'uint', False),
+    0xF0: ('cue_relative_position', 'uint', False),
+}
+
+
+def vint_length(first_byte: int) -> int:
+    """Length of a variable length integer from its first byte, 0 if invalid"""
+    for length in range(1, 9):
+        if first_byte & (0x100 >> length):
+            return length
+    return 0
+
+
+def read_vint(data: memoryview, position: int, keep_marker: bool) -> (int, int):
+    """Variable length integer at position of data: (value, length)
+
+    Ids keep the length marker bit, sizes do not. A size of all ones is UNKNOWN_SIZE.
+    """
+    if position >= len(data):
+        raise EOF
+    length = vint_length(data[position])
+    if length == 0:
+        raise Exception('Invalid EBML variable length integer 0x{:02x}'.format(data[position]))
+    if position + length > len(data):
+        raise EOF
+    value = int.from_bytes(data[position: position + length], byteorder='big')
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return UNKNOWN_SIZE, length
+    return value, length
+
+
+def read_element_header(reader) -> (int, int, int):
+    """
+    Side effect: reader offset change, to the payload of the element
+    :return: element id, payload size (UNKNOWN_SIZE if unknown), header size
+    """
+    start = reader.tell()
+    head = memoryview(reader.read(MAX_HEADER_LENGTH))
+    if not head:
+        raise EOF
+    element_id, id_length = read_vint(head, 0, keep_marker=True)
+    size, size_length = read_vint(head, id_length, keep_marker=False)
+    reader.seek(start + id_length + size_length)
+    if reader.budget is not None:
+        reader.budget.count_box()
+    return element_id, size, id_length + size_length
+
+
+def decode_value(value_type: str, data: memoryview):
+    if value_type == 'uint':
+        return int.from_bytes(data, byteorder='big')
+    if value_type == 'int':
+        return int.from_bytes(data, byteorder='big', signed=True)
+    if value_type == 'float':
+        if len(data) == 4:
+            return struct.unpack('>f', data)[0]
+        if len(data) == 8:
+            return struct.unpack('>d', data)[0]
+        return 0.0
+    if value_type == 'string':
+        return bytes(data).split(b'\x00', 1)[0].decode('ascii', errors='replace')
+    if value_type == 'utf8':
+        return bytes(data).split(b'\x00', 1)[0].decode('utf8', errors='replace')
+    if value_type == 'date':
+        nanoseconds = int.from_bytes(data, byteorder='big', signed=True)
+        return MATROSKA_EPOCH + datetime.timedelta(microseconds=nanoseconds // 1000)
+    return bytes(data)
+
+
+def decode_master(data: memoryview, budget=None) -> dict:
+    """Decode the children of a master element payload by SCHEMA, unknown ones are skipped"""
+    values = {}
+    position = 0
+    if budget is not None:
+        budget.enter()
+    try:
+        while position < len(data):
+            try:
+                element_id, id_length = read_vint(data, position, keep_marker=True)
+                size, size_length = read_vint(data, position + id_length, keep_marker=False)
+            except EOF:  # truncated or padding
+                break
+            if budget is not None:
+                budget.count_box()
+            start = position + id_length + size_length
+            end = len(data) if size == UNKNOWN_SIZE else min(start + size, len(data))
+            element = SCHEMA.get(element_id)
+            if element is not None:
+                name, value_type, is_list = element
+                if value_type == 'master':
+                    value = decode_master(data[start: end], budget)
+                else:
+                    value = decode_value(value_type, data[start: end])
+                if is_list:
+                    values.setdefault(name, []).append(value)
+                else:
+                    values.setdefault(name, value)
+            position = end
+    finally:
+        if budget is not None:
+            budget.leave()
+    return values
+
+
+def read_master(reader, size: int) -> dict:
+    """Read the payload of a master element at once and decode it
+
+    Side effect: reader offset change
+    """
+    if size == UNKNOWN_SIZE:
+        raise Exception('Master element of unknown size at {}'.format(reader.tell()))
+    return decode_master(memoryview(reader.read(size)), reader.budget)
+
+
+class CueIndex:
+    """Cue points as compact arrays: time (seconds x timecode scale) and cluster position of each"""
+
+    __slots__ = ('timecode_scale', 'times', 'tracks', 'cluster_positions')
+
+    def __init__(self, cues: dict, timecode_scale: int, segment_data_start: int, budget=None):
+        self.timecode_scale = timecode_scale
+        self.times, self.tracks, self.cluster_positions = array('Q'), array('I'), array('Q')
+        cue_points = cues.get('cue_point', [])
+        if budget is not None:
+            budget.count_entries(len(cue_points))
+        for cue_point in cue_points:
+            for positions in cue_point.get('cue_track_positions', [])[:1]:
+                self.times.append(cue_point.get('cue_time', 0))
+                self.tracks.append(positions.get('cue_track', 0))
+                self.cluster_positions.append(segment_data_start + positions.get('cue_cluster_position', 0))
+
+    def __len__(self):
+        return len(self.times)
+
+    def json(self) -> dict:
+        scale = self.timecode_scale / 1e9
+        return {'count': len(self),
+                'times': [round(t * scale, 3) for t in self.times],
+                'tracks': list(self.tracks),
+                'cluster_positions': list(self.cluster_positions)}
+
+
+def _track_json(track_entry: dict) -> dict:
+    track = {
+        'number': track_entry.get('track_number'),
+        'uid': track_entry.get('track_uid'),
+        'type': TRACK_TYPES.get(track_entry.get('track_type'), track_entry.get('track_type')),
+        'codec_id': track_entry.get('codec_id'),
+        'codec_name': track_entry.get('codec_name'),
+        'name': track_entry.get('name'),
+        'language': track_entry.get('language', 'eng'),  # default of the spec
+    }
+    default_duration = track_entry.get('default_duration')
+    if default_duration:
+        track['default_duration'] = default_duration
+        track['frame_rate'] = round(1e9 / default_duration, 3)
+    video = track_entry.get('video')
+    if video is not None:
+        track.update({
+            'width': video.get('pixel_width'), 'height': video.get('pixel_height'),
+            'display_width': video.get('display_width', video.get('pixel_width')),
+            'display_height': video.get('display_height', video.get('pixel_height')),
+            'interlaced': video.get('flag_interlaced') == 1,
+        })
+    audio = track_entry.get('audio')
+    if audio is not None:
+        track.update({
+            'sampling_frequency': audio.get('sampling_frequency', 8000.0),
+            'channels': audio.get('channels', 1),
+            'bit_depth': audio.get('bit_depth'),
+        })
+    return track
+
+
+def _read_seek_heads(reader, segment_data_start: int, size: int) -> dict:
+    """element id -> absolute position, from the SeekHead at the reader (and the SeekHeads it points to)"""
+    positions = {}
+    seek_heads = [(reader.tell(), size)]
+    visited = set()
+    while seek_heads:
+        position, size = seek_heads.pop()
+        if position in visited or len(visited) >= 4:
+            continue
+        visited.add(position)
+        reader.seek(position)
+        for seek in read_master(reader, size).get('seek', []):
+            element_id = int.from_bytes(seek.get('seek_id', b''), byteorder='big')
+            if 'seek_position' not in seek:
+                continue
+            target = segment_data_start + seek['seek_position']
+            if element_id == SEEK_HEAD_ID and target not in visited:
+                reader.seek(target)
+                try:
+                    seek_id, seek_size, _ = read_element_header(reader)
+                except EOF:
+                    continue
+                if seek_id == SEEK_HEAD_ID:
+                    seek_heads.append((reader.tell(), seek_size))
+            else:
+                positions.setdefault(element_id, target)
+    return positions
+
+
+def parse(reader, cues: bool=False) -> dict:
+    """Parse the EBML header, Info and Tracks (and Cues if cues) of the first Segment
+
+    Elements are located by the SeekHead, or by walking the Segment children
+    (Clusters skipped by size) when there is no SeekHead or it misses some.
+    """
+    element_id, size, _ = read_element_header(reader)
+    if element_id != EBML_ID:
+        raise Exception('Not an EBML file')
+    ebml = read_master(reader, size)
+    while True:  # the Segment, after the EBML header and maybe Void elements
+        element_id, segment_size, _ = read_element_header(reader)
+        if element_id == SEGMENT_ID:
+            break
+        if segment_size == UNKNOWN_SIZE:
+            raise Exception('No Segment found')
+        reader.skip(segment_size)
+    segment_data_start = reader.tell()
+    segment_end = segment_data_start + segment_size if segment_size != UNKNOWN_SIZE else reader.total_bytes
+    wanted = {INFO_ID, TRACKS_ID} | ({CUES_ID} if cues else set())
+    found = {}  # element id -> decoded
+
+    positions = {}
+    element_id, size, _ = read_element_header(reader)
+    if element_id == SEEK_HEAD_ID:
+        positions = _read_seek_heads(reader, segment_data_start, size)
+    for element_id in sorted(wanted, key=lambda i: positions.get(i, 0)):
+        if element_id not in positions:
+            continue
+        reader.seek(positions[element_id])
+        try:
+            found_id, size, _ = read_element_header(reader)
+        except EOF:
+            continue
+        if found_id == element_id:
+            found[element_id] = read_master(reader, size)
+        else:
+            logging.debug('SeekHead entry of 0x{:X} points to 0x{:X}'.format(element_id, found_id))
+
+    # walk the Segment children for the elements SeekHead does not tell
+    position = segment_data_start
+    while wanted - found.keys() and (segment_end < 0 or position < segment_end):
+        reader.seek(position)
+        try:
+            element_id, size, header_size = read_element_header(reader)
+        except EOF:
+            break
+        if element_id in wanted and element_id not in found:
+            found[element_id] = read_master(reader, size)
+        if size == UNKNOWN_SIZE:  # e.g. a live Cluster, nothing after it can be located
+            break
+        position += header_size + size
+
+    info = found.get(INFO_ID, {})
+    timecode_scale = info.get('timecode_scale', 1000000)
+    video_info = {
+        'ebml': {'doc_type': ebml.get('doc_type', 'matroska'), 'doc_type_version': ebml.get('doc_type_version')},
+        'info': {
+            'timecode_scale': timecode_scale,
+            'duration': round(info['duration'] * timecode_scale / 1e9, 3) if 'duration' in info else None,
+            'date_utc': info.get('date_utc'),
+            'title': info.get('title'),
+            'muxing_app': info.get('muxing_app'),
+            'writing_app': info.get('writing_app'),
+        },
+        'tracks': [_track_json(track_entry) for track_entry in found.get(TRACKS_ID, {}).get('track_entry', [])],
+    }
+    if cues:
+        cue_index = CueIndex(found.get(CUES_ID, {}), timecode_scale, segment_data_start, reader.budget)
+        video_info['cues'] = cue_index.json()
+    return video_info
@@ -1,19 +1,16 @@
 # -*- coding: utf-8 -*-
 
-from consts import TYPE_CHECK_MAX_BYTES
+"""
+MOV (QuickTime) is made of the same atoms (boxes) as MP4, it is parsed by the box
+engine of parsers.mp4: mdat is skipped by size and 'query' parses selected fields only.
 
+QuickTime atoms handled there:
+    wide: placeholder before mdat, skipped as any unknown top level atom
+    udta: user data, '\xa9' text items, e.g. {'\xa9swr': 'Lavf57.19.100'}
+    tmcd: timecode tracks, the start timecode is read from their first sample
+    tapt: clef, prof and enof track aperture dimensions
+    hdlr: component type (mhlr, dhlr) and pascal string names
+Files without ftyp (old QuickTime) are parsed too, with 'ftyp': None.
+"""
 
-def type_checking_passed(reader):
-    # search 'ftypqt  '
-    for _ in range(TYPE_CHECK_MAX_BYTES // 4):
-        four_bytes_data = reader.read(4)
-        if four_bytes_data == b'ftyp':
-            if reader.read(4) == b'qt  ':
-                return True
-            else:
-                return False
-    return False
-
-
-def parse(reader):
-    return "In mov parser.parse"
+from parsers.mp4 import parse, query  # noqa
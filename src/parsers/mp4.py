@@ -8,36 +8,44 @@ https://www.cnblogs.com/qq260250932/p/4282304.html
 http://www.onlinemp4parser.com/
 
 MP4 is big endian
+
+Each (full) box reads its whole payload once and decodes it by a precompiled
+struct layout, version 0 (32 bits times and durations) or version 1 (64 bits).
+Container boxes create the children they know and skip the others by size.
 """
 
 import datetime
 import logging
+import operator
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import accumulate, chain, repeat
 from pprint import pprint
+from typing import Optional
 
-from consts import TYPE_CHECK_MAX_BYTES
-from excptions import EOF
-
-FTYP_CONSEQUENCE_TYPES = (
-    b'avc1', b'iso2', b'isom', b'mmp4', b'mp41',
-    b'mp42', b'NDSC', b'NDSH', b'NDSM', b'NDSP',
-    b'NDSS', b'NDXC', b'NDXH', b'NDXM', b'NDXP',
-    b'NDXS', b'M4V '
-)
+from excptions import EOF, ProbeLimitExceeded
 
 BASE_DATETIME = datetime.datetime.strptime('1904-01-01 00:00:00', '%Y-%m-%d %H:%M:%S')
 
+BOX_HEADER = struct.Struct('>I4s')
+LARGE_SIZE = struct.Struct('>Q')
+# samples of a track without a budget attached to the reader, as the default ProbeLimits.max_entries
+MAX_SAMPLE_COUNT = 16 * 1024 * 1024
+UINT32 = struct.Struct('>I')
 
-def type_checking_passed(reader):
-    # search ftyp and consequence type
-    # see: http://www.ftyps.com/
-    for _ in range(TYPE_CHECK_MAX_BYTES // 4):
-        four_bytes_data = reader.read(4)
-        if four_bytes_data == b'ftyp':
-            if reader.read(4) in FTYP_CONSEQUENCE_TYPES:
-                return True
-            else:
-                return False
-    return False
+# sample entry types whose fields are decoded in STSDBox, other entries keep the common fields only
+VISUAL_SAMPLE_ENTRY_TYPES = frozenset((
+    'avc1', 'avc2', 'avc3', 'avc4', 'hvc1', 'hev1', 'dvh1', 'dvhe', 'mp4v', 'vp08', 'vp09', 'av01',
+    's263', 'h263', 'jpeg', 'mjpa', 'mjpb', 'encv', 'apch', 'apcn', 'apcs', 'apco', 'ap4h', 'ap4x',
+))
+AUDIO_SAMPLE_ENTRY_TYPES = frozenset((
+    'mp4a', 'ac-3', 'ec-3', 'ac-4', 'Opus', 'fLaC', 'alac', 'samr', 'sawb', 'enca', 'mp3 ', '.mp3',
+    'sowt', 'twos', 'lpcm', 'ulaw', 'alaw', 'ima4', 'raw ', 'in24', 'in32', 'fl32', 'fl64',
+))
 
 
 def read_box_size_and_type(reader) -> (int, str, int):
@@ -46,27 +54,71 @@ def read_box_size_and_type(reader) -> (int, str, int):
     """
     # if box_size == 1, find size in largesize
     # if box_size == 0, this is the last box
-    box_size = reader.read_int(4)
-    box_type = reader.read_str(4)
+    header = reader.read(8)
+    if len(header) < 8:
+        raise EOF
+    box_size, box_type = BOX_HEADER.unpack(header)
+    box_type = box_type.decode('latin-1')  # types like '\xa9nam' are not utf8
     offset = 8
     if box_size == 1:
-        box_size = reader.read_int(8)
+        large_size = reader.read(8)
+        if len(large_size) < 8:
+            raise EOF
+        box_size = LARGE_SIZE.unpack(large_size)[0]
         offset = 16
-    if box_size == 0 and box_type == '':
-        raise EOF
+    if reader.budget is not None:
+        reader.budget.count_box()
     return box_size, box_type, offset
 
 
+def count_entries(reader, count: int) -> int:
+    """Charge the entry count of a table read from the file to the budget of reader"""
+    if reader.budget is not None:
+        reader.budget.count_entries(count)
+    return count
+
+
+def skip_to_end(reader) -> None:
+    if reader.total_bytes >= 0:
+        reader.seek(0, os.SEEK_END)
+    else:  # unknown length, have to read through
+        reader.read(-1)
+
+
+def fixed_point(value: int, fraction_bits: int) -> float:
+    """Fixed point number, e.g. 16.16: fixed_point(0x00018000, 16) -> 1.5"""
+    return value / (1 << fraction_bits)
+
+
+def mp4_datetime(seconds: int) -> datetime.datetime:
+    return BASE_DATETIME + datetime.timedelta(seconds=seconds)
+
+
+def mp4_language(code: int) -> str:
+    """Packed ISO-639-2/T language code: three 5 bits characters"""
+    if code < 0x400:  # QuickTime macintosh language code, or not set
+        return ''
+    return ''.join(chr(((code >> shift) & 0x1F) + 0x60) for shift in (10, 5, 0))
+
+
 class BoxMeta:
 
+    __slots__ = ('box_size', 'box_type', 'offset')
+
     def __init__(self, box_size, box_type, offset):
         self.box_size = box_size
         self.box_type = box_type
         self.offset = offset
 
 
+_json_keys_cache = {}
+
+
 class Box:
 
+    __slots__ = ('reader', 'box_size', 'box_type', 'offset')
+    NOT_JSON_KEYS = ('offset', 'reader')
+
     def __init__(self, reader, box_meta: BoxMeta=None):
         self.reader = reader
         # self.offset: total bytes from box beginning
@@ -95,40 +147,66 @@ class Box:
         self.offset += num_of_byte
         return self.reader.read(num_of_byte)
 
+    def read_view(self, num_of_byte: int = 1) -> memoryview:
+        self.offset += num_of_byte
+        return self.reader.read_view(num_of_byte)
+
+    def read_payload(self) -> memoryview:
+        """All the remained bytes of the box in one read"""
+        if self.box_size == 0:
+            view = self.reader.read_view(-1)
+            self.offset += len(view)
+            return view
+        return self.read_view(max(0, self.box_size - self.offset))
+
+    def skip(self, num_of_byte: int) -> None:
+        self.offset += num_of_byte
+        self.reader.skip(num_of_byte)
+
     def ignore_remained(self):
         if self.box_size - self.offset > 0 and self.box_size != 0:
-            self.read(self.box_size - self.offset)
+            self.skip(self.box_size - self.offset)
         elif self.box_size == 0:
-            self.read(-1)
+            skip_to_end(self.reader)
+
+    @classmethod
+    def _json_keys(cls) -> tuple:
+        keys = _json_keys_cache.get(cls)
+        if keys is None:
+            keys = []
+            for klass in reversed(cls.__mro__):
+                for key in klass.__dict__.get('__slots__', ()):
+                    if key not in cls.NOT_JSON_KEYS and key not in keys:
+                        keys.append(key)
+            keys = _json_keys_cache[cls] = tuple(keys)
+        return keys
 
     def json(self) -> dict:
-        r_val = dict(self.__dict__)
-        for key in self.__dict__.keys():
-            if isinstance(r_val[key], Box):
-                r_val[key] = r_val[key].json()
-            elif isinstance(r_val[key], list):
-                new_val = [
-                    item.json() if isinstance(item, Box) else item
-                    for item in r_val[key]
-                ]
-                r_val[key] = new_val
-            if key in ('offset', 'reader', ):  # not to json keys
-                del r_val[key]
+        r_val = {}
+        for key in self._json_keys():
+            value = getattr(self, key, None)
+            if isinstance(value, Box):
+                value = value.json()
+            elif isinstance(value, list):
+                value = [item.json() if isinstance(item, Box) else item for item in value]
+            r_val[key] = value
         return r_val
 
 
 class FTYPBox(Box):
 
+    __slots__ = ('major_brand', 'minor_version', 'compatible_brands')
+
     def __init__(self, reader, box_meta: BoxMeta=None):
         """
         Side effect: reader offset change
         """
         super().__init__(reader, box_meta)
         assert self.box_type == 'ftyp'
-        self.major_brand = self.read_str(4)
-        self.minor_version = self.read_int(4)
-        compatible_brands_size = self.box_size - self.offset
-        self.compatible_brands = [self.read_str(4) for _ in range(compatible_brands_size // 4)]
+        payload = bytes(self.read_payload())
+        self.major_brand = payload[:4].decode('latin-1')
+        self.minor_version = UINT32.unpack_from(payload, 4)[0] if len(payload) >= 8 else 0
+        self.compatible_brands = [payload[i: i + 4].decode('latin-1') for i in range(8, len(payload) - 3, 4)]
 
 
 def find_first_box_by_type(reader, wanted_box_type: str):
@@ -143,153 +221,146 @@ def find_first_box_by_type(reader, wanted_box_type: str):
     """
     ignored_size = 0
     while True:
-        # If read to file end and box is not found, read_box_size_and_type would raise an None Type error
-        # So here I do not check box_size == 0
+        # If read to file end and box is not found, read_box_size_and_type raises EOF
         box_size, box_type, offset = read_box_size_and_type(reader)
         logging.debug('Find first {} box: box_size: {} bytes, box_type: {}, offset: {}'.format(
             wanted_box_type, box_size, box_type, offset))
         if box_type == wanted_box_type:
             return box_size, box_type, offset, ignored_size
         ignored_size += box_size
-        reader.read(box_size - offset)  # skip unused data
+        if box_size == 0:  # the last box, extends to the end of file
+            skip_to_end(reader)
+            raise EOF
+        if box_size < offset:  # would move backward, for ever
+            raise Exception('Invalid size {} of box {} at {}'.format(box_size, box_type, reader.tell() - offset))
+        reader.skip(box_size - offset)  # skip unused data without reading it
 
 
 class BasicHeadBox(Box):
+    """Full box: version and flags, then a payload decoded at once by self.decode"""
+
+    __slots__ = ('version', 'flags')
 
     def __init__(self, reader, box_meta: BoxMeta=None):
         """
         Side effect: reader offset change
         """
         super().__init__(reader, box_meta)
-        self.version = self.read_int(1)
-        assert(self.version == 0)  # TODO: currently only support version=0
-        self.flags = self.read_int(3)
+        payload = self.read_payload()
+        if len(payload) < 4:
+            raise EOF
+        self.version = payload[0]
+        self.flags = int.from_bytes(payload[1:4], byteorder='big')
+        self.decode(payload[4:])
+
+    def decode(self, payload: memoryview) -> None:
+        """Decode the payload after version and flags"""
+        pass
+
+    def layout(self, layouts: tuple) -> struct.Struct:
+        """Pick the struct layout of self.version from (version 0 layout, version 1 layout)"""
+        if self.version >= len(layouts):
+            raise Exception('Unsupported {} box version: {}'.format(self.box_type, self.version))
+        return layouts[self.version]
 
 
 class HEADBox(BasicHeadBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
-        self.creation_time = BASE_DATETIME + datetime.timedelta(seconds=self.read_int(4))
-        self.modification_time = BASE_DATETIME + datetime.timedelta(seconds=self.read_int(4))
+    __slots__ = ('creation_time', 'modification_time')
 
 
 class MVHDBox(HEADBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        super().__init__(reader, box_meta)
+    __slots__ = ('time_scale', 'duration', 'scaled_duration', 'suggested_rate', 'suggested_volume')
+    # creation_time, modification_time, time_scale, duration, rate (16.16), volume (8.8)
+    # the following reserved, matrix, pre_defined and next_track_id are ignored
+    LAYOUTS = (struct.Struct('>IIIIih'), struct.Struct('>QQIQih'))
+
+    def decode(self, payload: memoryview) -> None:
         assert self.box_type == 'mvhd'
-        self.time_scale = self.read_int(4)
-        self.duration = self.read_int(4)
-        self.scaled_duration = round(self.duration / self.time_scale, 3)  # unit: s
-        self.suggested_rate = self.read_float(2, 2)  # suggested play rate
-        self.suggested_volume = self.read_float(1, 1)  # suggested play volume
-        # self.read(10)  # ignore reserved
-        # self.matrix = self.read(36)  # video transform matrix ???
-        # self.pre_defined = self.read(24)  # ???
-        # self.next_track_id = self.read(4)
-        # TODO: I have not figured out the above data structure, so they are just ignored
-        self.ignore_remained()
+        creation_time, modification_time, self.time_scale, self.duration, rate, volume = \
+            self.layout(self.LAYOUTS).unpack_from(payload)
+        self.creation_time = mp4_datetime(creation_time)
+        self.modification_time = mp4_datetime(modification_time)
+        self.scaled_duration = round(self.duration / self.time_scale, 3) if self.time_scale else 0  # unit: s
+        self.suggested_rate = fixed_point(rate, 16)  # suggested play rate
+        self.suggested_volume = fixed_point(volume, 8)  # suggested play volume
 
 
 class TKHDBox(HEADBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        super().__init__(reader, box_meta)
+    __slots__ = ('track_id', 'duration', 'layer', 'alternate_group', 'volume', 'width', 'height')
+    # creation_time, modification_time, track_id, reserved, duration, reserved, layer, alternate_group,
+    # volume (8.8), reserved, matrix, width (16.16), height (16.16)
+    LAYOUTS = (struct.Struct('>III4xI8xhhh2x36xII'), struct.Struct('>QQI4xQ8xhhh2x36xII'))
+
+    def decode(self, payload: memoryview) -> None:
         assert self.box_type == 'tkhd'
-        self.track_id = self.read(4)
-        self.read(4)  # 4 bytes reserved
-        self.duration = self.read_int(4)
-        self.read(8)  # 8 bytes reserved
-        self.layer = self.read_int(2)
-        self.alternate_group = self.read_int(2)
-        self.volume = self.read_float(1, 1)
-        self.read(2)  # 2 bytes reserved
-        self.read(36)  # video transform matrix ???
-        self.width = self.read_float(2, 2)
-        self.height = self.read_float(2, 2)
-        self.ignore_remained()
+        creation_time, modification_time, self.track_id, self.duration, self.layer, self.alternate_group, \
+            volume, width, height = self.layout(self.LAYOUTS).unpack_from(payload)
+        self.creation_time = mp4_datetime(creation_time)
+        self.modification_time = mp4_datetime(modification_time)
+        self.volume = fixed_point(volume, 8)
+        self.width = fixed_point(width, 16)
+        self.height = fixed_point(height, 16)
 
 
 class MDHDBox(HEADBox):
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
+
+    __slots__ = ('time_scale', 'duration', 'scaled_duration', 'language')
+    # creation_time, modification_time, time_scale, duration, language
+    LAYOUTS = (struct.Struct('>IIIIH'), struct.Struct('>QQIQH'))
+
+    def decode(self, payload: memoryview) -> None:
         assert self.box_type == 'mdhd'
-        self.time_scale = self.read_int(4)
-        self.duration = self.read_int(4)
-        self.scaled_duration = round(self.duration / self.time_scale, 2)
-        # self.language = self.read(2)
-        # self.pre_defined = self.read(2)
-        self.ignore_remained()
+        creation_time, modification_time, self.time_scale, self.duration, language = \
+            self.layout(self.LAYOUTS).unpack_from(payload)
+        self.creation_time = mp4_datetime(creation_time)
+        self.modification_time = mp4_datetime(modification_time)
+        self.scaled_duration = round(self.duration / self.time_scale, 2) if self.time_scale else 0
+        self.language = mp4_language(language)
 
 
 class HDLRBox(BasicHeadBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
+    __slots__ = ('component_type', 'handler_type', 'name')
+    # pre_defined (QuickTime: component type), handler_type, reserved
+    LAYOUT = struct.Struct('>4s4s12x')
+
+    def decode(self, payload: memoryview) -> None:
         assert self.box_type == 'hdlr'
-        self.read(4)  # self.pre_defined
-        self.handler_type = self.read_str(4)  # vide, soun, hint
-        self.read(12)  # reserved
-        if self.box_size - self.offset > 1 and self.box_size != 0:
-            self.name = self.read_str(self.box_size - self.offset - 1)
-        self.ignore_remained()  # reserved and name
+        component_type, handler_type = self.LAYOUT.unpack_from(payload)
+        self.component_type = component_type.decode('latin-1').strip('\x00')  # QuickTime: mhlr, dhlr
+        self.handler_type = handler_type.decode('latin-1')  # vide, soun, hint, tmcd
+        name = bytes(payload[self.LAYOUT.size:])
+        if self.component_type and name and name[0] < len(name):  # QuickTime: pascal string
+            name = name[1: 1 + name[0]]
+        self.name = name.rstrip(b'\x00').decode('utf8', errors='replace')
 
 
 class VMHDBox(BasicHeadBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
-        assert self.box_type == 'vmhd'
-        self.ignore_remained()  # graphics mode, opcolor
+    __slots__ = ()  # graphics mode, opcolor are ignored
 
 
 class SMHDBox(BasicHeadBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
-        assert self.box_type == 'smhd'
-        self.ignore_remained()  # balanced, reserved
+    __slots__ = ()  # balanced, reserved are ignored
 
 
 class HMHDBox(BasicHeadBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
-        assert self.box_type == 'hmhd'
-        self.ignore_remained()
+    __slots__ = ()
 
 
 class NMHDBox(BasicHeadBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
-        assert self.box_type == 'nmhd'
-        self.ignore_remained()
+    __slots__ = ()
 
 
-class DINFBox(BasicHeadBox):
+class DINFBox(Box):
+
+    __slots__ = ()
 
     def __init__(self, reader, box_meta: BoxMeta=None):
         """
@@ -302,135 +373,1242 @@ class DINFBox(BasicHeadBox):
 
 class STSDBox(BasicHeadBox):
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
+    __slots__ = ('sample_description_number', 'sample_descriptions')
+    ENTRY_HEADER = struct.Struct('>I4s6xH')  # size, type, reserved, data reference index
+    # pre_defined, reserved, pre_defined, width, height, horizontal and vertical resolution (16.16),
+    # reserved, frame count, compressor name (pascal string), depth
+    VISUAL_ENTRY = struct.Struct('>2x2x12xHHII4xH32sH')
+    # version (QuickTime), reserved, channel count, sample size, pre_defined, reserved, sample rate (16.16)
+    AUDIO_ENTRY = struct.Struct('>H6xHH2x2xI')
+    # reserved, flags, time scale, frame duration, number of frames (QuickTime timecode)
+    TIMECODE_ENTRY = struct.Struct('>4xIIIB')
+
+    def decode(self, payload: memoryview) -> None:
         assert self.box_type == 'stsd'
-        self.sample_description_number = self.read_int(4)
+        self.sample_description_number = count_entries(self.reader, UINT32.unpack_from(payload)[0])
         self.sample_descriptions = []
-        for _ in range(self.sample_description_number):
-            self.sample_descriptions.append({
-                'size': self.read_int(4),
-                'type': self.read_str(4),
-                'remained': self.read(6),
-                'ref_index': self.read(2),
-            })
-        self.ignore_remained()
+        position = UINT32.size
+        # the entries can not be more than the payload holds, whatever sample_description_number says
+        while len(self.sample_descriptions) < self.sample_description_number \
+                and position + self.ENTRY_HEADER.size <= len(payload):
+            size, entry_type, ref_index = self.ENTRY_HEADER.unpack_from(payload, position)
+            entry_type = entry_type.decode('latin-1')
+            description = {'size': size, 'type': entry_type, 'ref_index': ref_index}
+            body_position = position + self.ENTRY_HEADER.size
+            if entry_type in VISUAL_SAMPLE_ENTRY_TYPES and body_position + self.VISUAL_ENTRY.size <= len(payload):
+                width, height, h_resolution, v_resolution, frame_count, compressor, depth = \
+                    self.VISUAL_ENTRY.unpack_from(payload, body_position)
+                description.update({
+                    'width': width, 'height': height,
+                    'horizontal_resolution': fixed_point(h_resolution, 16),
+                    'vertical_resolution': fixed_point(v_resolution, 16),
+                    'frame_count': frame_count, 'depth': depth,
+                    'compressor_name': compressor[1: 1 + min(compressor[0], 31)].decode('utf8', errors='replace'),
+                })
+            elif entry_type in AUDIO_SAMPLE_ENTRY_TYPES and body_position + self.AUDIO_ENTRY.size <= len(payload):
+                _, channel_count, sample_size, sample_rate = self.AUDIO_ENTRY.unpack_from(payload, body_position)
+                description.update({
+                    'channel_count': channel_count, 'sample_size': sample_size,
+                    'sample_rate': fixed_point(sample_rate, 16),
+                })
+            elif entry_type == 'tmcd' and body_position + self.TIMECODE_ENTRY.size <= len(payload):
+                flags, time_scale, frame_duration, number_of_frames = \
+                    self.TIMECODE_ENTRY.unpack_from(payload, body_position)
+                description.update({
+                    'drop_frame': bool(flags & 0x1), 'time_scale': time_scale,
+                    'frame_duration': frame_duration, 'number_of_frames': number_of_frames,
+                })
+            self.sample_descriptions.append(description)
+            if size < self.ENTRY_HEADER.size:
+                break
+            position += size
+
+
+def uint_array(payload: memoryview, typecode: str, count: int) -> array:
+    """Big endian unsigned (or signed) integers of payload as an array, in one copy"""
+    values = array(typecode)
+    count = min(count, len(payload) // values.itemsize)
+    values.frombytes(payload[:count * values.itemsize])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+class SampleTableBox(BasicHeadBox):
+    """Full box holding an entry count and a table of integers, decoded in one bulk copy
+
+    The tables are kept as arrays, out of json.
+    """
 
+    __slots__ = ('entry_count', )
+    NOT_JSON_KEYS = Box.NOT_JSON_KEYS + ('entries', 'sample_counts', 'sample_deltas', 'sample_offsets',
+                                         'sample_numbers', 'sample_sizes', 'first_chunks', 'samples_per_chunk',
+                                         'sample_description_indexes', 'chunk_offsets')
 
-class STBLBox(Box):
+    def read_entries(self, payload: memoryview, typecode: str, columns: int=1) -> array:
+        self.entry_count = count_entries(self.reader, UINT32.unpack_from(payload)[0])
+        return uint_array(payload[UINT32.size:], typecode, self.entry_count * columns)
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
-        """
-        super().__init__(reader, box_meta)
-        assert self.box_type == 'stbl'
-        self.stsd_box = STSDBox(reader)
-        self.offset += self.stsd_box.offset
-        self.ignore_remained()
 
+class STTSBox(SampleTableBox):
+    """Decoding time to sample: runs of (sample count, sample delta)"""
+
+    __slots__ = ('sample_counts', 'sample_deltas')
+
+    def decode(self, payload: memoryview) -> None:
+        entries = self.read_entries(payload, 'I', 2)
+        self.sample_counts = entries[0::2]
+        self.sample_deltas = entries[1::2]
+
+
+class CTTSBox(SampleTableBox):
+    """Composition time to sample: runs of (sample count, composition offset)"""
+
+    __slots__ = ('sample_counts', 'sample_offsets')
+
+    def decode(self, payload: memoryview) -> None:
+        entries = self.read_entries(payload, 'i' if self.version == 1 else 'I', 2)
+        self.sample_counts = entries[0::2]
+        self.sample_offsets = entries[1::2]
+
+
+class STSSBox(SampleTableBox):
+    """Sync samples (key frames): 1-based sample numbers"""
+
+    __slots__ = ('sample_numbers', )
 
-class MINFBox(Box):
+    def decode(self, payload: memoryview) -> None:
+        self.sample_numbers = self.read_entries(payload, 'I')
+
+
+class STSZBox(SampleTableBox):
+    """Sample sizes: one size for all samples, or a size per sample"""
+
+    __slots__ = ('sample_size', 'sample_count', 'sample_sizes')
+    LAYOUT = struct.Struct('>II')
+
+    def decode(self, payload: memoryview) -> None:
+        self.sample_size, self.sample_count = self.LAYOUT.unpack_from(payload)
+        count_entries(self.reader, self.sample_count)
+        self.entry_count = 0 if self.sample_size else self.sample_count
+        self.sample_sizes = uint_array(payload[self.LAYOUT.size:], 'I', self.entry_count)
+
+    def total_size(self) -> int:
+        return self.sample_size * self.sample_count if self.sample_size else sum(self.sample_sizes)
+
+
+class STSCBox(SampleTableBox):
+    """Sample to chunk: runs of (first chunk, samples per chunk, sample description index)"""
+
+    __slots__ = ('first_chunks', 'samples_per_chunk', 'sample_description_indexes')
+
+    def decode(self, payload: memoryview) -> None:
+        entries = self.read_entries(payload, 'I', 3)
+        self.first_chunks = entries[0::3]
+        self.samples_per_chunk = entries[1::3]
+        self.sample_description_indexes = entries[2::3]
+
+
+class STCOBox(SampleTableBox):
+    """Chunk offsets, 32 bits"""
+
+    __slots__ = ('chunk_offsets', )
+    TYPECODE = 'I'
+
+    def decode(self, payload: memoryview) -> None:
+        self.chunk_offsets = self.read_entries(payload, self.TYPECODE)
+
+
+class CO64Box(STCOBox):
+    """Chunk offsets, 64 bits"""
+
+    __slots__ = ()
+    TYPECODE = 'Q'
+
+
+class ContainerBox(Box):
+    """Box made of child boxes
+
+    CHILD_BOXES: child box type -> (attribute name, box class, is a list)
+    Children not in CHILD_BOXES are skipped by size without being read.
+    """
+
+    __slots__ = ()
+    CHILD_BOXES = {}
 
     def __init__(self, reader, box_meta: BoxMeta=None):
         """
         Side effect: reader offset change
         """
         super().__init__(reader, box_meta)
-        assert self.box_type == 'minf'
+        for name, _, is_list in self.CHILD_BOXES.values():
+            setattr(self, name, [] if is_list else None)
+        budget = reader.budget
+        if budget is not None:
+            budget.enter()
+        try:
+            self.read_children()
+        finally:
+            if budget is not None:
+                budget.leave()
+        self.ignore_remained()
 
-        box_size, box_type, offset = read_box_size_and_type(reader)
-        if box_type == 'vmhd':
-            self.head_box = VMHDBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
-        elif box_type == 'smhd':
-            self.head_box = SMHDBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
-        elif box_type == 'hmhd':
-            self.head_box = HMHDBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
-        elif box_type == 'nmhd':
-            self.head_box = NMHDBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
-        self.offset += self.head_box.offset
-
-        self.dinf_box = DINFBox(reader)
-        self.offset += self.dinf_box.offset
-        self.stbl_box = STBLBox(reader)
-        self.offset += self.stbl_box.offset
+    def read_children(self) -> None:
+        while self.box_size == 0 or self.offset + 8 <= self.box_size:
+            start = self.reader.tell()
+            try:
+                box_size, box_type, offset = read_box_size_and_type(self.reader)
+            except EOF:
+                break
+            if box_size == 0 and self.box_size != 0:  # extends to the end of the parent
+                box_size = self.box_size - self.offset
+            if box_size < offset:
+                raise Exception('Invalid size {} of box {} in {}'.format(box_size, box_type, self.box_type))
+            child = self.CHILD_BOXES.get(box_type)
+            if child is not None:
+                name, box_class, is_list = child
+                box = box_class(self.reader, box_meta=BoxMeta(box_size, box_type, offset))
+                if is_list:
+                    getattr(self, name).append(box)
+                else:
+                    setattr(self, name, box)
+            self.reader.seek(start + box_size)  # skip unknown and remained data of the child
+            self.offset += box_size
 
-        self.ignore_remained()
 
+class STBLBox(ContainerBox):
 
-class MediaBox(Box):
+    __slots__ = ('stsd_box', 'stts_box', 'ctts_box', 'stss_box', 'stsz_box', 'stsc_box', 'stco_box', '_statistics')
+    NOT_JSON_KEYS = ContainerBox.NOT_JSON_KEYS + ('_statistics', )
+    CHILD_BOXES = {
+        'stsd': ('stsd_box', STSDBox, False),
+        'stts': ('stts_box', STTSBox, False),
+        'ctts': ('ctts_box', CTTSBox, False),
+        'stss': ('stss_box', STSSBox, False),
+        'stsz': ('stsz_box', STSZBox, False),
+        'stsc': ('stsc_box', STSCBox, False),
+        'stco': ('stco_box', STCOBox, False),
+        'co64': ('stco_box', CO64Box, False),
+    }
 
-    def __init__(self, reader, box_meta: BoxMeta=None):
-        """
-        Side effect: reader offset change
+    def decoding_times(self) -> array:
+        """Decoding time of each sample (of stsz), plus the end time at last, in media time scale
+
+        stts counts are not trusted: samples stsz does not have are dropped, missing ones last 0.
+        Each stts run is a range, so the loop runs over stts entries only.
         """
-        super().__init__(reader, box_meta)
-        assert self.box_type == 'mdia'
-        self.mdhd_box = MDHDBox(reader)
-        self.offset += self.mdhd_box.offset
-        self.hdlr_box = HDLRBox(reader)
-        self.offset += self.hdlr_box.offset
-        self.minf_box = MINFBox(reader)
-        self.offset += self.minf_box.offset
+        remaining = self.sample_count()
+        times = array('Q')
+        time = 0
+        for count, delta in zip(self.stts_box.sample_counts, self.stts_box.sample_deltas):
+            count = min(count, remaining)
+            if delta:
+                times.extend(range(time, time + count * delta, delta))
+            else:
+                times.extend(array('Q', (time, )) * count)
+            time += count * delta
+            remaining -= count
+        times.extend(array('Q', (time, )) * (remaining + 1))
+        return times
 
-        self.ignore_remained()
+    def statistics(self, time_scale: int) -> dict:
+        """Frame rate, bitrates and key frame (GOP) statistics of the track
 
+        Loops run over stts entries only, samples, key frames and windows are handled by bulk operations.
+        """
+        statistics = getattr(self, '_statistics', None)
+        if statistics is None:
+            statistics = self._statistics = self._compute_statistics(time_scale)
+        return statistics
+
+    def _compute_statistics(self, time_scale: int) -> dict:
+        if self.stts_box is None or self.stsz_box is None or not time_scale:
+            return {}
+        sample_count = self.sample_count()
+        duration = sum(map(operator.mul, self.stts_box.sample_counts, self.stts_box.sample_deltas)) / time_scale
+        total_size = self.stsz_box.sample_size * sample_count if self.stsz_box.sample_size else \
+            sum(self.stsz_box.sample_sizes)
+        statistics = {
+            'sample_count': sample_count,
+            'duration': round(duration, 3),
+            'frame_rate': round(sample_count / duration, 3) if duration else 0,
+            'average_bitrate': round(total_size * 8 / duration) if duration else 0,
+            'peak_bitrate': self.peak_bitrate(time_scale),
+        }
+        if self.stss_box is None:  # every sample is a sync sample, a GOP of one sample each
+            statistics['keyframe_count'] = sample_count
+            if sample_count:
+                statistics['gop'] = {'min': 1, 'max': 1, 'average': 1.0}
+                statistics['keyframe_interval'] = round(duration / sample_count, 3)
+            return statistics
+        key_frames = sorted(set(self.stss_box.sample_numbers))  # repeated and out of order entries are dropped
+        key_frames = key_frames[bisect_left(key_frames, 1): bisect_right(key_frames, sample_count)]
+        statistics['keyframe_count'] = len(key_frames)
+        if key_frames:
+            gops = array('I', map(operator.sub, key_frames[1:], key_frames[:-1]))
+            gops.append(sample_count - key_frames[-1] + 1)
+            average_gop = sum(gops) / len(gops)
+            statistics['gop'] = {'min': min(gops), 'max': max(gops), 'average': round(average_gop, 3)}
+            statistics['keyframe_interval'] = round(average_gop * duration / sample_count, 3)
+        return statistics
+
+    def sample_count(self) -> int:
+        """Samples of the track, checked before any per sample array is allocated
+
+        The sizes read from a truncated stsz bound its count. A single size has no table to bound it,
+        so without a budget (that charged it on decode) the count is checked against MAX_SAMPLE_COUNT.
+        """
+        if not self.stsz_box.sample_size:
+            return len(self.stsz_box.sample_sizes)
+        sample_count = self.stsz_box.sample_count
+        if self.reader.budget is None and sample_count > MAX_SAMPLE_COUNT:
+            raise ProbeLimitExceeded('entries', sample_count, MAX_SAMPLE_COUNT)
+        return sample_count
+
+    def sample_sizes(self) -> array:
+        if self.stsz_box.sample_size:
+            return array('I', (self.stsz_box.sample_size, )) * self.sample_count()
+        return self.stsz_box.sample_sizes
+
+    def chunk_first_samples(self) -> array:
+        """1-based number of the first sample of each chunk, plus the sample after the last chunk"""
+        chunk_count = len(self.stco_box.chunk_offsets)
+        samples_per_chunk = array('I')
+        first_chunks = list(self.stsc_box.first_chunks) + [chunk_count + 1]
+        for i, samples in enumerate(self.stsc_box.samples_per_chunk):
+            run = max(0, min(first_chunks[i + 1], chunk_count + 1) - first_chunks[i])
+            samples_per_chunk.extend(array('I', (samples, )) * run)
+        return array('Q', accumulate(samples_per_chunk, initial=1))
+
+    def keyframe_index(self) -> (array, array, array):
+        """Decoding time (media time scale), byte offset and size of each sync sample
+
+        Every sample is a sync sample if there is no stss. Samples out of all chunks are dropped.
+        The tables are built by bulk operations (map, slices), never by a loop over samples or key frames.
+        """
+        if None in (self.stts_box, self.stsz_box, self.stsc_box, self.stco_box):
+            return array('Q'), array('Q'), array('I')
+        sizes = self.sample_sizes()
+        total_sizes = array('Q', accumulate(sizes, initial=0))
+        times = self.decoding_times()
+        chunk_first_samples = self.chunk_first_samples()
+        sample_count = min(len(sizes), chunk_first_samples[-1] - 1)
+        # offset of the chunk minus the size of the samples before it: plus the total size before a sample
+        # of the chunk, the offset of that sample
+        chunk_bases = array('q', map(operator.sub, self.stco_box.chunk_offsets, map(
+            total_sizes.__getitem__, map(min, map(operator.sub, chunk_first_samples, repeat(1)), repeat(len(sizes))))))
+        if self.stss_box is None:
+            samples_per_chunk = map(operator.sub, chunk_first_samples[1:], chunk_first_samples[:-1])
+            sample_bases = chain.from_iterable(map(repeat, chunk_bases, samples_per_chunk))
+            key_offsets = array('Q', map(operator.add, sample_bases, total_sizes[:sample_count]))
+            return times[:sample_count], key_offsets, sizes[:sample_count]
+        key_frames = sorted(set(self.stss_box.sample_numbers))  # in order, each once
+        key_frames = key_frames[bisect_left(key_frames, 1): bisect_right(key_frames, sample_count)]
+        indexes = list(map(operator.sub, key_frames, repeat(1)))
+        chunks = map(operator.sub, map(bisect_right, repeat(chunk_first_samples), key_frames), repeat(1))
+        key_offsets = array('Q', map(operator.add, map(chunk_bases.__getitem__, chunks),
+                                     map(total_sizes.__getitem__, indexes)))
+        return (array('Q', map(times.__getitem__, indexes)), key_offsets,
+                array('I', map(sizes.__getitem__, indexes)))
+
+    def peak_bitrate(self, time_scale: int, window: float=1.0) -> int:
+        """The most bits of samples decoded in one window (seconds), per second"""
+        sizes = self.sample_sizes()
+        times = self.decoding_times()
+        total_sizes = array('Q', accumulate(sizes, initial=0))
+        window_ticks = max(1, int(window * time_scale))
+        sample_count = len(times) - 1
+        if not sample_count:
+            return 0
+        first_window = times[0] - times[0] % window_ticks
+        last_time = times[sample_count - 1]
+        if (last_time - first_window) // window_ticks <= sample_count:
+            # first sample index of each window at once, the windows are not more than the samples
+            starts = list(map(bisect_left, repeat(times), range(first_window, last_time + 1, window_ticks),
+                              repeat(0), repeat(sample_count)))
+            starts.append(sample_count)
+            totals = list(map(total_sizes.__getitem__, starts))
+            return round(max(map(operator.sub, totals[1:], totals[:-1])) * 8 / window)
+        peak, start_index = 0, 0
+        while start_index < sample_count:  # sparse samples, windows without samples are hopped over
+            window_end = times[start_index] - times[start_index] % window_ticks + window_ticks
+            end_index = bisect_left(times, window_end, start_index + 1, sample_count)
+            peak = max(peak, total_sizes[end_index] - total_sizes[start_index])
+            start_index = end_index
+        return round(peak * 8 / window)
+
+
+class MINFBox(ContainerBox):
+
+    __slots__ = ('head_box', 'dinf_box', 'stbl_box')
+    CHILD_BOXES = {
+        'vmhd': ('head_box', VMHDBox, False),
+        'smhd': ('head_box', SMHDBox, False),
+        'hmhd': ('head_box', HMHDBox, False),
+        'nmhd': ('head_box', NMHDBox, False),
+        'dinf': ('dinf_box', DINFBox, False),
+        'stbl': ('stbl_box', STBLBox, False),
+    }
+
+
+class MediaBox(ContainerBox):
+
+    __slots__ = ('mdhd_box', 'hdlr_box', 'minf_box')
+    CHILD_BOXES = {
+        'mdhd': ('mdhd_box', MDHDBox, False),
+        'hdlr': ('hdlr_box', HDLRBox, False),
+        'minf': ('minf_box', MINFBox, False),
+    }
+
+
+class ApertureBox(BasicHeadBox):
+    """QuickTime track aperture dimensions: clef (clean), prof (production), enof (encoded pixels)"""
+
+    __slots__ = ('width', 'height')
+    LAYOUT = struct.Struct('>II')  # 16.16 each
+
+    def decode(self, payload: memoryview) -> None:
+        width, height = self.LAYOUT.unpack_from(payload)
+        self.width = fixed_point(width, 16)
+        self.height = fixed_point(height, 16)
+
+
+class TAPTBox(ContainerBox):
+    """QuickTime track aperture mode dimensions"""
+
+    __slots__ = ('clef_box', 'prof_box', 'enof_box')
+    CHILD_BOXES = {
+        'clef': ('clef_box', ApertureBox, False),
+        'prof': ('prof_box', ApertureBox, False),
+        'enof': ('enof_box', ApertureBox, False),
+    }
+
+
+class UDTABox(Box):
+    """User data, QuickTime text items ('\xa9' types, e.g. '\xa9swr': 'Lavf57.19.100') are decoded
+
+    The other items (e.g. meta) are skipped.
+    """
 
-class TrackBox(Box):
+    __slots__ = ('items', )
+    ITEM_HEADER = struct.Struct('>I4s')
+    TEXT_HEADER = struct.Struct('>HH')  # text size, language
 
     def __init__(self, reader, box_meta: BoxMeta=None):
         """
         Side effect: reader offset change
         """
         super().__init__(reader, box_meta)
-        assert self.box_type == 'trak'
-        self.tkhd_box = TKHDBox(reader)
-        self.offset += self.tkhd_box.box_size
-        box_size, box_type, offset, ignored_size = find_first_box_by_type(reader, wanted_box_type='mdia')
-        self.offset += ignored_size
-        self.media_box = MediaBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
-        self.offset += self.media_box.box_size
-        assert self.media_box is not None
-        self.ignore_remained()
-
+        payload = self.read_payload()
+        self.items = {}
+        position = 0
+        while position + self.ITEM_HEADER.size <= len(payload):
+            size, item_type = self.ITEM_HEADER.unpack_from(payload, position)
+            if size < self.ITEM_HEADER.size:  # QuickTime ends user data with 4 zero bytes
+                break
+            data = payload[position + self.ITEM_HEADER.size: position + size]
+            if item_type[0] == 0xa9 and len(data) >= self.TEXT_HEADER.size:
+                text_size, _ = self.TEXT_HEADER.unpack_from(data)
+                text = bytes(data[self.TEXT_HEADER.size: self.TEXT_HEADER.size + text_size])
+                self.items.setdefault(item_type.decode('latin-1'), text.decode('utf8', errors='replace'))
+            position += size
+
+
+def timecode_string(frame_number: int, number_of_frames: int, drop_frame: bool) -> str:
+    """SMPTE timecode of a frame number, HH:MM:SS:FF (HH:MM:SS;FF if drop frame)"""
+    if number_of_frames <= 0:
+        return ''
+    frame_number = max(0, frame_number)
+    if drop_frame:  # frame numbers 0 and 1 (2 and 3 for 60) are skipped each minute, except every 10th
+        dropped = round(number_of_frames / 15)
+        frames_per_minute = number_of_frames * 60 - dropped
+        frames_per_10_minutes = frames_per_minute * 10 + dropped
+        tens, remainder = divmod(frame_number, frames_per_10_minutes)
+        frame_number += 9 * dropped * tens
+        if remainder > dropped:
+            frame_number += dropped * ((remainder - dropped) // frames_per_minute)
+    seconds, frames = divmod(frame_number, number_of_frames)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{:02d}:{:02d}:{:02d}{}{:02d}'.format(hours % 24, minutes, seconds, ';' if drop_frame else ':', frames)
+
+
+def read_timecode(reader, stbl_box) -> Optional[str]:
+    """Start timecode of a QuickTime timecode (tmcd) track, its first sample is a frame number
 
-class MOOVBox(Box):
+    Side effect: reader offset change
+    """
+    if stbl_box is None or stbl_box.stsd_box is None or stbl_box.stco_box is None \
+            or not stbl_box.stco_box.chunk_offsets:
+        return None
+    description = _first_sample_description(stbl_box.stsd_box)
+    if description.get('type') != 'tmcd' or 'number_of_frames' not in description:
+        return None
+    reader.seek(stbl_box.stco_box.chunk_offsets[0])
+    data = reader.read(4)
+    if len(data) != 4:
+        return None
+    frame_number = int.from_bytes(data, byteorder='big', signed=True)
+    return timecode_string(frame_number, description['number_of_frames'], description['drop_frame'])
+
+
+class TrackBox(ContainerBox):
+
+    __slots__ = ('tkhd_box', 'tapt_box', 'media_box', 'udta_box', 'timecode')
+    CHILD_BOXES = {
+        'tkhd': ('tkhd_box', TKHDBox, False),
+        'tapt': ('tapt_box', TAPTBox, False),
+        'mdia': ('media_box', MediaBox, False),
+        'udta': ('udta_box', UDTABox, False),
+    }
 
     def __init__(self, reader, box_meta: BoxMeta=None):
         """
         Side effect: reader offset change
         """
         super().__init__(reader, box_meta)
-        assert self.box_type == 'moov'
-        self.mvhd_box = MVHDBox(reader)
-        self.offset += self.mvhd_box.box_size
-        self.track_box_list = []
-        while self.offset < self.box_size:
+        self.timecode = None
+        media_box = self.media_box
+        if media_box is not None and media_box.minf_box is not None and media_box.minf_box.stbl_box is not None \
+                and media_box.hdlr_box is not None and media_box.hdlr_box.handler_type == 'tmcd':
+            end = reader.tell()
+            self.timecode = read_timecode(reader, media_box.minf_box.stbl_box)
+            reader.seek(end)
+
+    @property
+    def statistics(self) -> dict:
+        """Statistics of the sample tables, computed on first access (e.g. by json) and kept by the stbl box"""
+        media_box = self.media_box
+        if media_box is None or media_box.mdhd_box is None or media_box.minf_box is None \
+                or media_box.minf_box.stbl_box is None:
+            return {}
+        return media_box.minf_box.stbl_box.statistics(media_box.mdhd_box.time_scale)
+
+    def json(self) -> dict:
+        r_val = super().json()
+        r_val['statistics'] = self.statistics
+        return r_val
+
+
+class MEHDBox(BasicHeadBox):
+    """Movie extends header: duration of the whole fragmented movie, in movie time scale"""
+
+    __slots__ = ('fragment_duration', )
+    LAYOUTS = (struct.Struct('>I'), struct.Struct('>Q'))
+
+    def decode(self, payload: memoryview) -> None:
+        self.fragment_duration = self.layout(self.LAYOUTS).unpack_from(payload)[0]
+
+
+class TREXBox(BasicHeadBox):
+    """Track extends: defaults of the samples of a track in fragments"""
+
+    __slots__ = ('track_id', 'default_sample_description_index', 'default_sample_duration',
+                 'default_sample_size', 'default_sample_flags')
+    LAYOUT = struct.Struct('>IIIII')
+
+    def decode(self, payload: memoryview) -> None:
+        self.track_id, self.default_sample_description_index, self.default_sample_duration, \
+            self.default_sample_size, self.default_sample_flags = self.LAYOUT.unpack_from(payload)
+
+
+class MVEXBox(ContainerBox):
+    """Movie extends: the movie is continued in moof boxes"""
+
+    __slots__ = ('mehd_box', 'trex_box_list')
+    CHILD_BOXES = {
+        'mehd': ('mehd_box', MEHDBox, False),
+        'trex': ('trex_box_list', TREXBox, True),
+    }
+
+
+class MOOVBox(ContainerBox):
+
+    __slots__ = ('mvhd_box', 'track_box_list', 'mvex_box', 'udta_box')
+    CHILD_BOXES = {
+        'mvhd': ('mvhd_box', MVHDBox, False),
+        'trak': ('track_box_list', TrackBox, True),
+        'mvex': ('mvex_box', MVEXBox, False),
+        'udta': ('udta_box', UDTABox, False),
+    }
+
+
+class MFHDBox(BasicHeadBox):
+    """Movie fragment header"""
+
+    __slots__ = ('sequence_number', )
+
+    def decode(self, payload: memoryview) -> None:
+        self.sequence_number = UINT32.unpack_from(payload)[0]
+
+
+class TFHDBox(BasicHeadBox):
+    """Track fragment header, optional fields present by flags (None if absent)"""
+
+    __slots__ = ('track_id', 'base_data_offset', 'sample_description_index', 'default_sample_duration',
+                 'default_sample_size', 'default_sample_flags')
+    # flag -> (field, struct format)
+    OPTIONAL_FIELDS = (
+        (0x01, 'base_data_offset', 'Q'),
+        (0x02, 'sample_description_index', 'I'),
+        (0x08, 'default_sample_duration', 'I'),
+        (0x10, 'default_sample_size', 'I'),
+        (0x20, 'default_sample_flags', 'I'),
+    )
+
+    def decode(self, payload: memoryview) -> None:
+        layout = '>I' + ''.join(fmt for flag, _, fmt in self.OPTIONAL_FIELDS if self.flags & flag)
+        values = iter(struct.unpack_from(layout, payload))
+        self.track_id = next(values)
+        for flag, name, _ in self.OPTIONAL_FIELDS:
+            setattr(self, name, next(values) if self.flags & flag else None)
+
+
+class TFDTBox(BasicHeadBox):
+    """Track fragment decode time: decoding time of the first sample, in media time scale"""
+
+    __slots__ = ('base_media_decode_time', )
+    LAYOUTS = (struct.Struct('>I'), struct.Struct('>Q'))
+
+    def decode(self, payload: memoryview) -> None:
+        self.base_media_decode_time = self.layout(self.LAYOUTS).unpack_from(payload)[0]
+
+
+class TRUNBox(BasicHeadBox):
+    """Track fragment run: samples of a fragment, per sample fields present by flags
+
+    Per sample fields are decoded in one bulk copy and kept as arrays, out of json.
+    """
+
+    __slots__ = ('sample_count', 'data_offset', 'first_sample_flags', 'sample_durations', 'sample_sizes')
+    NOT_JSON_KEYS = Box.NOT_JSON_KEYS + ('sample_durations', 'sample_sizes')
+    SAMPLE_FIELDS = (0x100, 0x200, 0x400, 0x800)  # duration, size, flags, composition time offset
+
+    def decode(self, payload: memoryview) -> None:
+        self.sample_count = count_entries(self.reader, UINT32.unpack_from(payload)[0])
+        position = UINT32.size
+        self.data_offset = self.first_sample_flags = None
+        if self.flags & 0x01:
+            self.data_offset = struct.unpack_from('>i', payload, position)[0]
+            position += 4
+        if self.flags & 0x04:
+            self.first_sample_flags = UINT32.unpack_from(payload, position)[0]
+            position += 4
+        present = [flag for flag in self.SAMPLE_FIELDS if self.flags & flag]
+        entries = uint_array(payload[position:], 'I', self.sample_count * len(present))
+        columns = {flag: entries[i::len(present)] for i, flag in enumerate(present)}
+        self.sample_durations = columns.get(0x100)
+        self.sample_sizes = columns.get(0x200)
+
+    def duration(self, default_sample_duration: int) -> int:
+        if self.sample_durations is not None:
+            return sum(self.sample_durations)
+        return self.sample_count * (default_sample_duration or 0)
+
+
+class TRAFBox(ContainerBox):
+    """Track fragment"""
+
+    __slots__ = ('tfhd_box', 'tfdt_box', 'trun_box_list')
+    CHILD_BOXES = {
+        'tfhd': ('tfhd_box', TFHDBox, False),
+        'tfdt': ('tfdt_box', TFDTBox, False),
+        'trun': ('trun_box_list', TRUNBox, True),
+    }
+
+    def duration(self, default_sample_duration: int) -> int:
+        """Sum of trun durations, default_sample_duration (of trex) if neither trun nor tfhd tells"""
+        if self.tfhd_box is not None and self.tfhd_box.default_sample_duration is not None:
+            default_sample_duration = self.tfhd_box.default_sample_duration
+        return sum(trun.duration(default_sample_duration) for trun in self.trun_box_list)
+
+
+class MOOFBox(ContainerBox):
+    """Movie fragment"""
+
+    __slots__ = ('mfhd_box', 'traf_box_list')
+    CHILD_BOXES = {
+        'mfhd': ('mfhd_box', MFHDBox, False),
+        'traf': ('traf_box_list', TRAFBox, True),
+    }
+
+
+class TFRABox(BasicHeadBox):
+    """Track fragment random access: time and moof offset of random access samples of a track"""
+
+    __slots__ = ('track_id', 'number_of_entry', 'times', 'moof_offsets')
+    NOT_JSON_KEYS = Box.NOT_JSON_KEYS + ('times', 'moof_offsets')
+    LAYOUT = struct.Struct('>III')
+
+    def decode(self, payload: memoryview) -> None:
+        self.track_id, lengths, self.number_of_entry = self.LAYOUT.unpack_from(payload)
+        count_entries(self.reader, self.number_of_entry)
+        # traf, trun and sample numbers (1 to 4 bytes each) are skipped
+        skipped = sum((lengths >> shift & 0x3) + 1 for shift in (4, 2, 0))
+        entry = struct.Struct('>{0}{0}{1}x'.format('Q' if self.version == 1 else 'I', skipped))
+        entries = payload[self.LAYOUT.size:]
+        count = min(self.number_of_entry, len(entries) // entry.size)
+        values = list(entry.iter_unpack(entries[:count * entry.size]))
+        self.times = [value[0] for value in values]
+        self.moof_offsets = [value[1] for value in values]
+
+
+class MFROBox(BasicHeadBox):
+    """Movie fragment random access offset: the size of mfra, the last box of the file"""
+
+    __slots__ = ('mfra_size', )
+
+    def decode(self, payload: memoryview) -> None:
+        self.mfra_size = UINT32.unpack_from(payload)[0]
+
+
+class MFRABox(ContainerBox):
+    """Movie fragment random access"""
+
+    __slots__ = ('tfra_box_list', 'mfro_box')
+    CHILD_BOXES = {
+        'tfra': ('tfra_box_list', TFRABox, True),
+        'mfro': ('mfro_box', MFROBox, False),
+    }
+
+
+MFRO_SIZE = 16
+
+
+def read_mfra(reader):
+    """The mfra box located by the mfro box at the file tail, None if absent"""
+    if reader.total_bytes < MFRO_SIZE:
+        return None
+    reader.seek(reader.total_bytes - MFRO_SIZE)
+    tail = reader.read(MFRO_SIZE)
+    if len(tail) != MFRO_SIZE or tail[4:8] != b'mfro':
+        return None
+    mfra_size = UINT32.unpack_from(tail, 12)[0]
+    if not MFRO_SIZE <= mfra_size <= reader.total_bytes:
+        return None
+    reader.seek(reader.total_bytes - mfra_size)
+    try:
+        box_size, box_type, offset = read_box_size_and_type(reader)
+    except EOF:
+        return None
+    if box_type != 'mfra' or box_size != mfra_size:
+        return None
+    return MFRABox(reader, box_meta=BoxMeta(box_size, box_type, offset))
+
+
+def iter_moof_boxes(reader, start: int, stop: int):
+    """Decode the top level moof boxes in [start, stop), others (mdat) are skipped by size"""
+    position = start
+    while position + 8 <= stop:
+        reader.seek(position)
+        try:
             box_size, box_type, offset = read_box_size_and_type(reader)
-            logging.debug(
-                'Find track box: box_size: {} bytes, box_type: {}, offset: {}'.format(box_size, box_type, offset))
-            if box_type == 'trak':
-                self.track_box_list.append(
-                    TrackBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
-                )
+        except EOF:
+            return
+        if box_size == 0:
+            box_size = stop - position
+        if box_size < offset:
+            raise Exception('Invalid size {} of top level box {}'.format(box_size, box_type))
+        if box_type == 'moof':
+            yield MOOFBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
+        position += box_size
+
+
+class FragmentTimeline:
+    """Per track timeline of the fragments walked, in media time scale"""
+
+    def __init__(self, default_sample_durations: dict):
+        self.default_sample_durations = default_sample_durations  # track id -> trex default
+        self.start_times = {}
+        self.end_times = {}
+        self.fragment_count = 0
+        self.first_sequence_number = None
+        self.last_sequence_number = None
+        self.decode_times_known = True  # every first traf of a track has a tfdt
+
+    def add(self, moof: MOOFBox) -> None:
+        self.fragment_count += 1
+        if moof.mfhd_box is not None:
+            if self.first_sequence_number is None:
+                self.first_sequence_number = moof.mfhd_box.sequence_number
+            self.last_sequence_number = moof.mfhd_box.sequence_number
+        for traf in moof.traf_box_list:
+            if traf.tfhd_box is None:
+                continue
+            track_id = traf.tfhd_box.track_id
+            if traf.tfdt_box is not None:
+                start = traf.tfdt_box.base_media_decode_time
             else:
-                self.read(box_size - offset)
-            self.offset += box_size
+                self.decode_times_known = self.decode_times_known and track_id in self.end_times
+                start = self.end_times.get(track_id, 0)
+            self.start_times.setdefault(track_id, start)
+            self.end_times[track_id] = start + traf.duration(self.default_sample_durations.get(track_id))
+
+
+def scan_fragments(reader, moov_box: MOOVBox, moov_end: int) -> dict:
+    """Duration and fragment count of a fragmented movie
+
+    With a mfra (random access index) at the file tail, only the first moof and the
+    moofs after the last random access point are read. Otherwise the top level
+    boxes after moov are walked, reading moof boxes and skipping mdat by size.
+    """
+    time_scales = {}
+    for track_box in moov_box.track_box_list:
+        if track_box.tkhd_box is not None and track_box.media_box is not None \
+                and track_box.media_box.mdhd_box is not None:
+            time_scales[track_box.tkhd_box.track_id] = track_box.media_box.mdhd_box.time_scale
+    defaults = {trex.track_id: trex.default_sample_duration for trex in moov_box.mvex_box.trex_box_list}
+    stop = reader.total_bytes if reader.total_bytes >= 0 else float('inf')
+
+    timeline = None
+    mfra_box = read_mfra(reader)
+    moof_offsets = [offset for tfra in mfra_box.tfra_box_list for offset in tfra.moof_offsets] if mfra_box else []
+    if moof_offsets:
+        stop = reader.total_bytes - mfra_box.box_size
+        first = FragmentTimeline(defaults)
+        for moof in iter_moof_boxes(reader, moov_end, stop):
+            first.add(moof)
+            break
+        last = FragmentTimeline(defaults)
+        for moof in iter_moof_boxes(reader, max(moof_offsets), stop):
+            last.add(moof)
+        if first.fragment_count and last.fragment_count and last.decode_times_known \
+                and first.first_sequence_number is not None and last.last_sequence_number is not None:
+            timeline = last
+            timeline.start_times = first.start_times
+            timeline.fragment_count = last.last_sequence_number - first.first_sequence_number + 1
+        else:
+            logging.debug('Fragments can not be located by mfra, walking all of them')
+    if timeline is None:
+        timeline = FragmentTimeline(defaults)
+        for moof in iter_moof_boxes(reader, moov_end, stop):
+            timeline.add(moof)
+
+    tracks = []
+    for track_id, end_time in sorted(timeline.end_times.items()):
+        time_scale = time_scales.get(track_id)
+        duration = (end_time - timeline.start_times.get(track_id, 0)) / time_scale if time_scale else 0
+        tracks.append({'track_id': track_id, 'duration': round(duration, 3)})
+    return {
+        'fragment_count': timeline.fragment_count,
+        'duration': max((track['duration'] for track in tracks), default=0),
+        'random_access_index': mfra_box is not None,
+        'tracks': tracks,
+    }
+
+
+# box types whose payload is made of child boxes, for LazyBox
+CONTAINER_BOX_TYPES = frozenset((
+    'moov', 'trak', 'mdia', 'minf', 'stbl', 'dinf', 'edts', 'udta', 'mvex', 'moof', 'traf', 'mfra', 'tapt'))
+
+# box type -> class decoding it, for LazyBox
+LEAF_BOXES = {
+    'ftyp': FTYPBox,
+    'mvhd': MVHDBox,
+    'tkhd': TKHDBox,
+    'mdhd': MDHDBox,
+    'hdlr': HDLRBox,
+    'vmhd': VMHDBox,
+    'smhd': SMHDBox,
+    'hmhd': HMHDBox,
+    'nmhd': NMHDBox,
+    'stsd': STSDBox,
+    'stts': STTSBox,
+    'ctts': CTTSBox,
+    'stss': STSSBox,
+    'stsz': STSZBox,
+    'stsc': STSCBox,
+    'stco': STCOBox,
+    'co64': CO64Box,
+    'stbl': STBLBox,  # decoded as a whole, its tables are read together anyway
+    'mehd': MEHDBox,
+    'trex': TREXBox,
+    'mfhd': MFHDBox,
+    'tfhd': TFHDBox,
+    'tfdt': TFDTBox,
+    'trun': TRUNBox,
+    'tfra': TFRABox,
+    'mfro': MFROBox,
+    'clef': ApertureBox,
+    'prof': ApertureBox,
+    'enof': ApertureBox,
+}
+
+
+class LazyBox:
+    """A box known by its header only
+
+    Children headers are read (and the payload between them skipped) when first
+    needed, and just as far as needed. The box itself is decoded when one of its
+    fields is accessed:
+        root = LazyBox.root(reader)
+        root.moov.mvhd.duration  # reads ftyp, moov and mvhd headers and mvhd payload
+    """
+
+    __slots__ = ('reader', 'box_type', 'start', 'box_size', 'header_size', '_children', '_scan_position', '_box')
+
+    def __init__(self, reader, box_type: str, start: int, box_size: int, header_size: int):
+        self.reader = reader
+        self.box_type = box_type
+        self.start = start
+        self.box_size = box_size
+        self.header_size = header_size
+        self._children = []
+        self._scan_position = start + header_size
+        self._box = None
+
+    @classmethod
+    def root(cls, reader):
+        """The whole file as a box, its children are the top level boxes"""
+        return cls(reader, '', 0, reader.total_bytes, 0)
+
+    @property
+    def end(self) -> int:
+        return self.start + self.box_size if self.box_size >= 0 else -1
+
+    def _is_container(self) -> bool:
+        return self.box_type == '' or self.box_type in CONTAINER_BOX_TYPES
+
+    def _scan_next(self):
+        """Read the next child header, None if no more child"""
+        if not self._is_container() or self._scan_position is None:
+            return None
+        if 0 <= self.end < self._scan_position + 8:
+            self._scan_position = None
+            return None
+        self.reader.seek(self._scan_position)
+        try:
+            box_size, box_type, header_size = read_box_size_and_type(self.reader)
+        except EOF:
+            self._scan_position = None
+            return None
+        if box_size == 0:  # extends to the end of the parent
+            box_size = self.end - self._scan_position if self.end >= 0 else -1
+        elif box_size < header_size:
+            raise Exception('Invalid size {} of box {} in {}'.format(box_size, box_type, self.box_type or 'file'))
+        child = LazyBox(self.reader, box_type, self._scan_position, box_size, header_size)
+        self._children.append(child)
+        self._scan_position = child.end if box_size >= 0 else None
+        return child
+
+    def iter_children(self, box_type: str=None):
+        """Children (of box_type), scanned as far as the iteration goes"""
+        index = 0
+        while True:
+            if index < len(self._children):
+                child = self._children[index]
+            else:
+                child = self._scan_next()
+                if child is None:
+                    return
+            index += 1
+            if box_type is None or child.box_type == box_type:
+                yield child
+
+    def child(self, box_type: str):
+        """First child of box_type, None if not found"""
+        return next(self.iter_children(box_type), None)
+
+    def find(self, *path: str):
+        """Descendant by box types, e.g. find('mdia', 'minf', 'stbl'), None if not found"""
+        box = self
+        for box_type in path:
+            box = box.child(box_type)
+            if box is None:
+                return None
+        return box
+
+    @property
+    def box(self):
+        """The decoded box, None for containers and unknown types"""
+        if self._box is None and self.box_type in LEAF_BOXES:
+            self.reader.seek(self.start + self.header_size)
+            self._box = LEAF_BOXES[self.box_type](
+                self.reader, box_meta=BoxMeta(self.box_size, self.box_type, self.header_size))
+        return self._box
+
+    def __getattr__(self, name: str):
+        # only called for names which are not slots: a child box type, or a field of the decoded box
+        if name.startswith('_'):
+            raise AttributeError(name)
+        child = self.child(name)
+        if child is not None:
+            return child
+        box = self.box
+        if box is None:
+            raise AttributeError("'{}' box has no child or field '{}'".format(self.box_type, name))
+        return getattr(box, name)
+
+    def __repr__(self):
+        return 'LazyBox({!r}, start={}, size={})'.format(self.box_type, self.start, self.box_size)
+
+
+# one box met by iter_box_events
+# path: box types from the top level joined by '/', e.g. 'moov/trak/mdia/mdhd'
+# header: decoded fields of a box in LEAF_BOXES (without box_size and box_type), None for others
+BoxEvent = namedtuple('BoxEvent', ('depth', 'path', 'type', 'offset', 'size', 'header'))
+
+
+def iter_box_events(reader, max_depth: int=None, decode: bool=True):
+    """Yield a BoxEvent for every box of an ISO-BMFF file, in file order
+
+    Nothing but the current chain of parents is kept, consumers may stop at any
+    event. Containers are entered (down to max_depth), the payload of the other
+    boxes is skipped by size, and decoded first if decode and the type is known.
+    """
+    stack = [(reader.total_bytes, '')]  # (end of the parent, path of the parent), -1: unknown end
+    position = 0
+    while stack:
+        parent_end, parent_path = stack[-1]
+        if 0 <= parent_end < position + 8:  # the parent is over, less than a header may remain
+            stack.pop()
+            position = parent_end
+            if reader.budget is not None and stack:
+                reader.budget.leave()
+            continue
+        reader.seek(position)
+        try:
+            box_size, box_type, header_size = read_box_size_and_type(reader)
+        except EOF:
+            return
+        if box_size == 0:  # extends to the end of the parent
+            box_size = parent_end - position if parent_end >= 0 else -1
+        elif box_size < header_size:
+            raise Exception('Invalid size {} of box {} at {}'.format(box_size, box_type, position))
+        depth = len(stack) - 1
+        path = '{}/{}'.format(parent_path, box_type) if parent_path else box_type
+        is_container = box_type in CONTAINER_BOX_TYPES
+        header = None
+        if decode and not is_container and box_type in LEAF_BOXES:
+            box = LEAF_BOXES[box_type](reader, box_meta=BoxMeta(max(box_size, 0), box_type, header_size))
+            header = box.json()
+            del header['box_size'], header['box_type']
+        yield BoxEvent(depth, path, box_type, position, box_size, header)
+        end = position + box_size if box_size >= 0 else -1
+        if is_container and (max_depth is None or depth < max_depth):
+            if reader.budget is not None:
+                reader.budget.enter()
+            stack.append((end, path))
+            position += header_size
+        elif end < 0:  # the rest of the file
+            return
+        else:
+            position = end
 
 
-def parse(reader):
-    # parse ftyp box
-    ftyp_box = FTYPBox(reader)
-    logging.debug('ftyp: {}'.format(ftyp_box.json()))
+def scan_layout(reader, max_boxes: int=None) -> dict:
+    """Byte map of the top level boxes and a plan of the reads a parse needs
+
+    Only top level headers are read, hopping from one to the next by seeks.
+    return:
+        boxes: [{'type': 'ftyp', 'offset': 0, 'size': 24}, ...], size -1: to the end of an unknown length
+        faststart: moov before the first mdat, None if either is missing
+        fragmented: moof boxes found
+        read_plan: strategy 'head' (the ranges needed are at the head of the file) or 'tail'
+                   (some are after media data, e.g. a moov to fetch from the tail),
+                   ranges: merged [start, end) ranges of ftyp, moov and mfra
+        truncated: max_boxes top level boxes are scanned before the end
+    """
+    boxes = []
+    truncated = False
+    for event in iter_box_events(reader, max_depth=0, decode=False):
+        if max_boxes is not None and len(boxes) >= max_boxes:
+            truncated = True
+            break
+        boxes.append({'type': event.type, 'offset': event.offset, 'size': event.size})
+    first = {}
+    for box in boxes:
+        first.setdefault(box['type'], box)
+    faststart = None
+    if 'moov' in first and 'mdat' in first:
+        faststart = first['moov']['offset'] < first['mdat']['offset']
+    ranges = []
+    for box in boxes:
+        if box['type'] in ('ftyp', 'moov', 'mfra'):
+            end = box['offset'] + box['size'] if box['size'] >= 0 else reader.total_bytes
+            if ranges and ranges[-1][1] == box['offset']:
+                ranges[-1][1] = end
+            else:
+                ranges.append([box['offset'], end])
+    head = not ranges or (len(ranges) == 1 and ranges[0][0] == 0)
+    return {
+        'boxes': boxes,
+        'faststart': faststart,
+        'fragmented': 'moof' in first,
+        'read_plan': {'strategy': 'head' if head else 'tail', 'ranges': ranges},
+        'truncated': truncated,
+    }
+
+
+def _first_sample_description(stsd_box) -> dict:
+    return stsd_box.sample_descriptions[0] if stsd_box.sample_descriptions else {}
+
+
+def _decoded(lazy_box, box_class):
+    """Decode a LazyBox of a container type (not in LEAF_BOXES) by box_class"""
+    lazy_box.reader.seek(lazy_box.start + lazy_box.header_size)
+    return box_class(lazy_box.reader, box_meta=BoxMeta(lazy_box.box_size, lazy_box.box_type, lazy_box.header_size))
+
+
+def _track_timecode(trak):
+    hdlr, stbl = trak.find('mdia', 'hdlr'), trak.find('mdia', 'minf', 'stbl')
+    if hdlr is None or stbl is None or hdlr.box.handler_type != 'tmcd':
+        return None
+    return read_timecode(trak.reader, stbl.box)
+
+
+# movie field -> (box path from moov, getter of the decoded box)
+MOVIE_FIELDS = {
+    'user_data': (('udta', ), lambda udta: _decoded(udta, UDTABox).items),
+    'duration': (('mvhd', ), lambda box: box.scaled_duration),
+    'time_scale': (('mvhd', ), lambda box: box.time_scale),
+    'creation_time': (('mvhd', ), lambda box: box.creation_time),
+    'modification_time': (('mvhd', ), lambda box: box.modification_time),
+}
+
+# track field -> (box path from trak, getter of the decoded box)
+TRACK_FIELDS = {
+    'track_id': (('tkhd', ), lambda box: box.track_id),
+    'width': (('tkhd', ), lambda box: box.width),
+    'height': (('tkhd', ), lambda box: box.height),
+    'volume': (('tkhd', ), lambda box: box.volume),
+    'handler_type': (('mdia', 'hdlr'), lambda box: box.handler_type),
+    'duration': (('mdia', 'mdhd'), lambda box: box.scaled_duration),
+    'time_scale': (('mdia', 'mdhd'), lambda box: box.time_scale),
+    'language': (('mdia', 'mdhd'), lambda box: box.language),
+    'codec': (('mdia', 'minf', 'stbl', 'stsd'), lambda box: _first_sample_description(box).get('type')),
+    'sample_rate': (('mdia', 'minf', 'stbl', 'stsd'), lambda box: _first_sample_description(box).get('sample_rate')),
+    'channel_count': (('mdia', 'minf', 'stbl', 'stsd'),
+                      lambda box: _first_sample_description(box).get('channel_count')),
+    'timecode': ((), _track_timecode),
+    'clean_aperture': (('tapt', 'clef'), lambda box: [box.width, box.height]),
+    'production_aperture': (('tapt', 'prof'), lambda box: [box.width, box.height]),
+    'encoded_pixels': (('tapt', 'enof'), lambda box: [box.width, box.height]),
+}
+
+
+def _media_statistics(mdia) -> dict:
+    stbl, mdhd = mdia.find('minf', 'stbl'), mdia.child('mdhd')
+    if stbl is None or mdhd is None or stbl.box is None or mdhd.box is None:
+        return {}
+    return stbl.box.statistics(mdhd.box.time_scale)
+
+
+for _name in ('sample_count', 'frame_rate', 'average_bitrate', 'peak_bitrate',
+              'keyframe_count', 'keyframe_interval', 'gop'):
+    # a getter of a container path gets the LazyBox itself
+    TRACK_FIELDS[_name] = (('mdia', ), lambda mdia, _name=_name: _media_statistics(mdia).get(_name))
+del _name
+
+# 'video.x' and 'audio.x' select the first track of the handler type
+TRACK_SELECTORS = {'video': 'vide', 'audio': 'soun', 'subtitle': 'sbtl', 'text': 'text', 'timecode': 'tmcd'}
+
+
+def _box_field(lazy_box, fields: dict, name: str):
+    if name not in fields:
+        raise Exception('Unknown field: {}, supported: {}'.format(name, ', '.join(sorted(fields))))
+    path, getter = fields[name]
+    lazy_box = lazy_box.find(*path) if lazy_box is not None else None
+    if lazy_box is not None and lazy_box.box_type not in LEAF_BOXES:
+        return getter(lazy_box)
+    box = lazy_box.box if lazy_box is not None else None
+    return getter(box) if box is not None else None
+
+
+def _track_field(trak, name: str):
+    return _box_field(trak, TRACK_FIELDS, name)
+
+
+def query_box(moov, field: str):
+    """Resolve one field against a LazyBox of moov
+
+    fields:
+        'duration', 'time_scale', ...: ref MOVIE_FIELDS
+        'track_count': number of tracks
+        'tracks[*].x': list of the x of all tracks, ref TRACK_FIELDS
+        'tracks[N].x': x of the N-th track
+        'video.x', 'audio.x': x of the first video (audio) track, ref TRACK_SELECTORS
+    """
+    if moov is None:
+        return None
+    if field == 'track_count':
+        return sum(1 for _ in moov.iter_children('trak'))
+    head, _, name = field.partition('.')
+    if not name:
+        return _box_field(moov, MOVIE_FIELDS, field)
+    if head.startswith('tracks[') and head.endswith(']'):
+        index = head[len('tracks['): -1]
+        if index == '*':
+            return [_track_field(trak, name) for trak in moov.iter_children('trak')]
+        for i, trak in enumerate(moov.iter_children('trak')):
+            if i == int(index):
+                return _track_field(trak, name)
+        return None
+    if head in TRACK_SELECTORS:
+        for trak in moov.iter_children('trak'):
+            if _track_field(trak, 'handler_type') == TRACK_SELECTORS[head]:
+                return _track_field(trak, name)
+        return None
+    raise Exception('Unknown field: {}'.format(field))
+
+
+# fragmented movie field -> key of scan_fragments result
+FRAGMENT_FIELDS = {'fragment_count': 'fragment_count', 'fragment_duration': 'duration'}
+
+
+def query_fragments(moov) -> dict:
+    """scan_fragments of a LazyBox of moov, {} if the movie is not fragmented"""
+    if moov is None or moov.child('mvex') is None:
+        return {}
+    moov.reader.seek(moov.start + moov.header_size)
+    moov_box = MOOVBox(moov.reader, box_meta=BoxMeta(moov.box_size, moov.box_type, moov.header_size))
+    return scan_fragments(moov.reader, moov_box, moov.end)
+
+
+def query(reader, fields) -> dict:
+    """Parse only the boxes needed by fields, e.g. query(reader, ['duration', 'video.width'])
+
+    Boxes are reached through LazyBox, everything else is skipped by size:
+    'duration' alone stops reading right after mvhd.
+    'duration' of a fragmented movie without one in mvhd is the 'fragment_duration'.
+    """
+    moov = LazyBox.root(reader).child('moov')
+    video_info, fragments = {}, None
+    for field in fields:
+        value = None if field in FRAGMENT_FIELDS else query_box(moov, field)
+        if field in FRAGMENT_FIELDS or (field == 'duration' and not value and moov is not None
+                                        and moov.child('mvex') is not None):
+            if fragments is None:
+                fragments = query_fragments(moov)
+            value = fragments.get(FRAGMENT_FIELDS.get(field, 'duration'))
+        video_info[field] = value
+    return video_info
+
+
+def parse(reader, fields=None):
+    """Parse the whole moov, or only the fields if given, ref: query"""
+    if fields:
+        return query(reader, fields)
+    # parse ftyp box, old QuickTime files start with another atom (e.g. wide, mdat or moov)
+    box_size, box_type, offset = read_box_size_and_type(reader)
+    ftyp_box = None
+    if box_type == 'ftyp':
+        ftyp_box = FTYPBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
+    else:
+        reader.refresh()
+    logging.debug('ftyp: {}'.format(ftyp_box.json() if ftyp_box else None))
     moov_box_list = []
+    fragments = None
     try:
-        while True:
+        while reader.total_bytes < 0 or reader.tell() + 8 <= reader.total_bytes:  # no read at the end of file
             box_size, box_type, offset, _ = find_first_box_by_type(reader, wanted_box_type='moov')
+            start = reader.tell() - offset
+            reader.prefetch(start, start + box_size if box_size else reader.total_bytes)  # in one read
             moov_box = MOOVBox(reader, box_meta=BoxMeta(box_size, box_type, offset))
             moov_box_list.append(moov_box)
+            if moov_box.mvex_box is not None:  # fragmented, the rest of the file is moof and mdat
+                fragments = scan_fragments(reader, moov_box, reader.tell())
+                break
     except EOF:
         pass
 
@@ -439,3 +1617,8 @@ def parse(reader):
         time.sleep(1)
         for moov_box in moov_box_list:
             pprint(moov_box.json(), indent=2)
+    video_info = {'ftyp': ftyp_box.json() if ftyp_box else None,
+                  'moov': [moov_box.json() for moov_box in moov_box_list]}
+    if fragments is not None:
+        video_info['fragments'] = fragments
+    return video_info
@@ -1,10 +1,274 @@
 # -*- coding: utf-8 -*-
 
+"""
+Main Reference:
+https://wiki.multimedia.cx/index.php/RealMedia
+https://github.com/FFmpeg/FFmpeg/blob/master/libavformat/rmdec.c
 
-def type_checking_passed(reader):
-    # first foure bytes are '.RMF'
-    return reader.read(4) == b'.RMF'
+RealMedia (rm, rmvb) is chunks of a four character id, a 32 bit big endian size
+and a 16 bit object version: '.RMF', then the headers (PROP, MDPR per stream,
+CONT), then DATA (the packets) and INDX chunks at the end.
 
+The headers are read chunk by chunk up to DATA, whose packets are never read.
+With index=True the INDX chunks are read by following the index offset of PROP
+and the next index header of each INDX, no scanning over the packets.
+"""
 
-def parse(reader):
-    return "In rmvb or rm parser.parse"
+import logging
+import struct
+
+from excptions import EOF
+
+__all__ = ('parse', 'read_chunk_header')
+
+CHUNK_HEADER = struct.Struct('>4sIH')  # id, size (header included), object version
+# max bitrate, average bitrate, max packet size, average packet size, packets count, duration (ms), preroll (ms),
+# index offset, data offset, streams count, flags
+PROP = struct.Struct('>IIIIIIIIIHH')
+# stream number, max bitrate, average bitrate, max packet size, average packet size, start time, preroll, duration
+MDPR = struct.Struct('>HIIIIIII')
+INDX = struct.Struct('>IHI')  # entries count, stream number, next index header offset
+INDEX_ENTRY = struct.Struct('>HIII')  # version, timestamp (ms), packet offset, packet number
+# size, 'VIDO', codec, width, height, bits per pixel, unknown, frame rate (16.16)
+VIDEO_TYPE_SPECIFIC = struct.Struct('>I4s4sHHH4xI')
+# '.ra\xfd' version 4 and 5: version, unused, '.ra4' or '.ra5', data size, version2, header size, codec flavor,
+# coded frame size, unknown, sub packet h, frame size, sub packet size, unknown
+AUDIO_TYPE_SPECIFIC = struct.Struct('>4sH2x4sIHIHI12xHHHH')
+AUDIO_FORMAT_V4 = struct.Struct('>H2xHH')  # sample rate, unknown, sample size, channels
+AUDIO_FORMAT_V5 = struct.Struct('>6xH2xHH4s4s')  # ..., interleaver, codec
+
+PROP_FLAGS = {'save_enabled': 0x01, 'perfect_play': 0x02, 'live_broadcast': 0x04, 'allow_download': 0x08}
+MAX_HEADER_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_INDX_CHUNKS = 64
+
+
+def read_chunk_header(reader) -> (str, int, int):
+    """
+    Side effect: reader offset change, to the payload of the chunk
+    :return: chunk id, payload size, object version
+    """
+    head = reader.read(CHUNK_HEADER.size)
+    if len(head) < CHUNK_HEADER.size:
+        raise EOF
+    chunk_id, size, version = CHUNK_HEADER.unpack(head)
+    if reader.budget is not None:
+        reader.budget.count_box()
+    if size < CHUNK_HEADER.size and chunk_id != b'DATA':
+        raise Exception('Invalid size {} of chunk {}'.format(size, chunk_id))
+    return chunk_id.decode('latin-1'), max(size - CHUNK_HEADER.size, 0), version
+
+
+def _text(data, charset: str=None):
+    """utf8 text, or text in charset (the local code page of the producer), None if not decodable"""
+    data = bytes(data).rstrip(b'\x00')
+    try:
+        return data.decode('utf8')
+    except UnicodeDecodeError:
+        return data.decode(charset, errors='replace') if charset else None
+
+
+def _pascal_bytes(data: memoryview, position: int, length_format: str='>B') -> (memoryview, int):
+    """(bytes, position after them) of a string prefixed by its length"""
+    length, = struct.unpack_from(length_format, data, position)
+    position += struct.calcsize(length_format)
+    if position + length > len(data):
+        raise struct.error('string of {} bytes at {} is past the end of {}'.format(length, position, len(data)))
+    return data[position: position + length], position + length
+
+
+def _pascal_string(data: memoryview, position: int, length_format: str='>B', charset: str=None) -> (str, int):
+    """(string, position after it) of a string prefixed by its length"""
+    value, position = _pascal_bytes(data, position, length_format)
+    return _text(value, charset), position
+
+
+def decode_prop(data: memoryview) -> dict:
+    (max_bitrate, avg_bitrate, max_packet_size, avg_packet_size, packets_count, duration, preroll, index_offset,
+     data_offset, streams_count, flags) = PROP.unpack_from(data)
+    prop = {
+        'max_bitrate': max_bitrate,
+        'avg_bitrate': avg_bitrate,
+        'max_packet_size': max_packet_size,
+        'avg_packet_size': avg_packet_size,
+        'packets_count': packets_count,
+        'duration': duration / 1000,
+        'preroll': preroll,  # milliseconds
+        'index_offset': index_offset,
+        'data_offset': data_offset,
+        'streams_count': streams_count,
+    }
+    prop.update((name, bool(flags & flag)) for name, flag in PROP_FLAGS.items())
+    return prop
+
+
+def decode_video_type_specific(data: memoryview) -> dict:
+    if len(data) < VIDEO_TYPE_SPECIFIC.size:
+        return {}
+    _, tag, codec, width, height, bits_per_pixel, frame_rate = VIDEO_TYPE_SPECIFIC.unpack_from(data)
+    if tag != b'VIDO':
+        return {}
+    return {'codec': codec.decode('latin-1'), 'width': width, 'height': height, 'bits_per_pixel': bits_per_pixel,
+            'frame_rate': round(frame_rate / 65536, 3)}
+
+
+def decode_audio_type_specific(data: memoryview) -> dict:
+    if len(data) < 6 or bytes(data[:4]) != b'.ra\xfd':
+        return {}
+    version, = struct.unpack_from('>H', data, 4)
+    if version == 3:
+        return {'version': 3, 'codec': 'lpcJ', 'sample_rate': 8000, 'channels': 1}
+    if version not in (4, 5) or len(data) < AUDIO_TYPE_SPECIFIC.size:
+        return {'version': version}
+    audio = {'version': version}
+    _, _, _, _, _, _, flavor, coded_frame_size, _, frame_size, sub_packet_size, _ = \
+        AUDIO_TYPE_SPECIFIC.unpack_from(data)
+    audio.update({'flavor': flavor, 'coded_frame_size': coded_frame_size, 'frame_size': frame_size,
+                  'sub_packet_size': sub_packet_size})
+    position = AUDIO_TYPE_SPECIFIC.size
+    if version == 4:
+        sample_rate, sample_size, channels = AUDIO_FORMAT_V4.unpack_from(data, position)
+        _, position = _pascal_string(data, position + AUDIO_FORMAT_V4.size)
+        codec, _ = _pascal_string(data, position)
+    else:
+        sample_rate, sample_size, channels, _, codec = AUDIO_FORMAT_V5.unpack_from(data, position)
+        codec = codec.decode('latin-1')
+    audio.update({'codec': codec, 'sample_rate': sample_rate, 'sample_size': sample_size, 'channels': channels})
+    return audio
+
+
+def decode_logical_fileinfo(data: memoryview, charset: str=None) -> dict:
+    """Name -> value of the properties in the type specific data of a 'logical-fileinfo' MDPR"""
+    position = 6  # size, version
+    physical_streams_count, = struct.unpack_from('>H', data, position)
+    position += 2 + physical_streams_count * 6  # stream numbers, data offsets
+    rules_count, = struct.unpack_from('>H', data, position)
+    position += 2 + rules_count * 2
+    properties_count, = struct.unpack_from('>H', data, position)
+    position += 2
+    properties = {}
+    for _ in range(properties_count):
+        size, = struct.unpack_from('>I', data, position)
+        name, value_position = _pascal_string(data, position + 6, charset=charset)
+        value_type, value_length = struct.unpack_from('>IH', data, value_position)
+        value = data[value_position + 6: value_position + 6 + value_length]
+        properties[name] = int.from_bytes(value, byteorder='big') if value_type == 0 else _text(value, charset)
+        position += max(size, 1)
+    return properties
+
+
+def decode_mdpr(data: memoryview, charset: str=None) -> dict:
+    (stream_number, max_bitrate, avg_bitrate, max_packet_size, avg_packet_size, start_time, preroll,
+     duration) = MDPR.unpack_from(data)
+    name, position = _pascal_string(data, MDPR.size)
+    mime_type, position = _pascal_bytes(data, position)
+    mime_type = bytes(mime_type).decode('ascii', errors='replace')  # not None like _text
+    type_specific_length, = struct.unpack_from('>I', data, position)
+    type_specific = data[position + 4: position + 4 + type_specific_length]
+    stream = {
+        'stream_number': stream_number,
+        'name': name,
+        'mime_type': mime_type,
+        'max_bitrate': max_bitrate,
+        'avg_bitrate': avg_bitrate,
+        'max_packet_size': max_packet_size,
+        'avg_packet_size': avg_packet_size,
+        'start_time': start_time / 1000,
+        'preroll': preroll,
+        'duration': duration / 1000,
+    }
+    if mime_type.startswith('video/'):
+        stream['type'] = 'video'
+        stream.update(decode_video_type_specific(type_specific))
+    elif mime_type.startswith('audio/'):
+        stream['type'] = 'audio'
+        stream.update(decode_audio_type_specific(type_specific))
+    elif mime_type == 'logical-fileinfo':
+        stream['type'] = 'logical'
+        stream['properties'] = decode_logical_fileinfo(type_specific, charset)
+    return stream
+
+
+def decode_cont(data: memoryview, charset: str=None) -> dict:
+    """Title, author, copyright and comment, the hex of the ones not decodable in 'raw'"""
+    content = {}
+    position = 0
+    for name in ('title', 'author', 'copyright', 'comment'):
+        value, position = _pascal_bytes(data, position, '>H')
+        content[name] = _text(value, charset)
+        if content[name] is None:
+            content.setdefault('raw', {})[name] = bytes(value).hex()
+    return content
+
+
+def read_index(reader, index_offset: int) -> list:
+    """Key frame index of each stream, by following the INDX chain from index_offset
+
+    Side effect: reader offset change
+    """
+    indexes = []
+    visited = set()
+    while index_offset and index_offset not in visited and len(visited) < MAX_INDX_CHUNKS:
+        visited.add(index_offset)
+        reader.seek(index_offset)
+        chunk_id, size, _ = read_chunk_header(reader)
+        if chunk_id != 'INDX' or size < INDX.size:
+            raise Exception('No INDX chunk at {}'.format(index_offset))
+        data = memoryview(reader.read(size))
+        entries_count, stream_number, index_offset = INDX.unpack_from(data)
+        entries_count = min(entries_count, (len(data) - INDX.size) // INDEX_ENTRY.size)
+        if reader.budget is not None:
+            reader.budget.count_entries(entries_count)
+        entries = list(INDEX_ENTRY.iter_unpack(data[INDX.size: INDX.size + entries_count * INDEX_ENTRY.size]))
+        indexes.append({'stream_number': stream_number, 'count': entries_count,
+                        'times': [entry[1] / 1000 for entry in entries], 'offsets': [entry[2] for entry in entries]})
+    return indexes
+
+
+def parse(reader, index: bool=False, charset: str=None) -> dict:
+    """Parse the header chunks up to DATA, and the INDX chunks if index
+
+    A header chunk which can not be decoded is skipped and listed in 'skipped_chunks'.
+    :param charset: of the texts which are not utf8 (the local code page of the producer, e.g. 'cp1251')
+    """
+    chunk_id, size, _ = read_chunk_header(reader)
+    if chunk_id != '.RMF':
+        raise Exception('Not a RealMedia file')
+    file_version, = struct.unpack('>I', reader.read(4)) if size >= 4 else (0, )
+    rm_info = {'file_version': file_version, 'duration': None, 'prop': None, 'streams': [], 'content': None,
+               'logical_properties': {}, 'data_offset': None, 'skipped_chunks': []}
+    position = CHUNK_HEADER.size + size
+    while True:
+        reader.seek(position)
+        try:
+            chunk_id, size, _ = read_chunk_header(reader)
+        except EOF:
+            break
+        if chunk_id == 'DATA':
+            rm_info['data_offset'] = position
+            break  # the packets, and INDX at the end of the file is located by PROP
+        if chunk_id in ('PROP', 'MDPR', 'CONT') and size <= MAX_HEADER_CHUNK_SIZE:
+            data = memoryview(reader.read(size))
+            try:
+                if chunk_id == 'PROP':
+                    rm_info['prop'] = decode_prop(data)
+                elif chunk_id == 'MDPR':
+                    stream = decode_mdpr(data, charset)
+                    if stream.get('type') == 'logical':
+                        rm_info['logical_properties'].update(stream['properties'])
+                    else:
+                        rm_info['streams'].append(stream)
+                else:
+                    rm_info['content'] = decode_cont(data, charset)
+            except struct.error as e:  # truncated or malformed, the next chunks may still be fine
+                logging.debug('Skip chunk {} at {}: {}'.format(chunk_id, position, e))
+                rm_info['skipped_chunks'].append({'id': chunk_id, 'offset': position, 'error': str(e)})
+        position += CHUNK_HEADER.size + size
+
+    prop = rm_info['prop']
+    if prop is not None:
+        rm_info['duration'] = prop['duration']
+        if rm_info['data_offset'] is None and prop['data_offset']:
+            rm_info['data_offset'] = prop['data_offset']
+        if index:
+            rm_info['index'] = read_index(reader, prop['index_offset'])
+    return rm_info
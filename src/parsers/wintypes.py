@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""
+Windows multimedia structures shared by the AVI and ASF parsers
+
+Main Reference:
+https://learn.microsoft.com/en-us/windows/win32/api/wingdi/ns-wingdi-bitmapinfoheader
+https://learn.microsoft.com/en-us/windows/win32/api/mmeapi/ns-mmeapi-waveformatex
+"""
+
+import struct
+
+__all__ = ('BITMAPINFOHEADER', 'WAVEFORMATEX', 'AUDIO_FORMATS', 'decode_bitmap_info_header', 'decode_wave_format')
+
+# biSize, biWidth, biHeight, biPlanes, biBitCount, biCompression, biSizeImage
+BITMAPINFOHEADER = struct.Struct('<IiiHH4sI')
+# wFormatTag, nChannels, nSamplesPerSec, nAvgBytesPerSec, nBlockAlign, wBitsPerSample
+WAVEFORMATEX = struct.Struct('<HHIIHH')
+
+AUDIO_FORMATS = {
+    0x0001: 'pcm', 0x0003: 'pcm_float', 0x0006: 'alaw', 0x0007: 'mulaw', 0x0011: 'adpcm_ima', 0x0050: 'mp2',
+    0x0055: 'mp3', 0x00ff: 'aac', 0x0161: 'wmav2', 0x0162: 'wmapro', 0x2000: 'ac3', 0x2001: 'dts',
+    0x1610: 'aac', 0xfffe: 'extensible',
+}
+
+
+def decode_bitmap_info_header(data: memoryview, offset: int=0) -> dict:
+    """codec (FourCC), width, height and bit count of a BITMAPINFOHEADER, {} if too short"""
+    if len(data) < offset + BITMAPINFOHEADER.size:
+        return {}
+    _, width, height, _, bit_count, compression, _ = BITMAPINFOHEADER.unpack_from(data, offset)
+    return {'codec': compression.decode('latin-1').rstrip('\x00 ') or 'raw', 'width': width, 'height': abs(height),
+            'bit_count': bit_count}
+
+
+def decode_wave_format(data: memoryview, offset: int=0) -> dict:
+    """codec, channels, sample rate, bitrate... of a WAVEFORMATEX, {} if too short"""
+    if len(data) < offset + WAVEFORMATEX.size:
+        return {}
+    format_tag, channels, samples_per_sec, avg_bytes_per_sec, block_align, bits_per_sample = \
+        WAVEFORMATEX.unpack_from(data, offset)
+    return {
+        'codec': AUDIO_FORMATS.get(format_tag, '0x{:04x}'.format(format_tag)),
+        'channels': channels,
+        'sample_rate': samples_per_sec,
+        'bitrate': avg_bytes_per_sec * 8,
+        'block_align': block_align,
+        'bits_per_sample': bits_per_sample,
+    }
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+Probe videos
+
+Open a video location (local path or url), check its type and parse it.
+'probe_many' probes locations on a worker pool and yields results as soon as
+each one finishes, errors are returned as results instead of being raised.
+"""
+
+import glob
+import logging
+import os
+import sys
+from urllib.parse import urlsplit
+
+from excptions import ProbeLimitExceeded
+from input import COMMON_VIDEO_EXTENDS, MmapFileVideoReader, RemoteFileReader, reserve_session_pool
+from limits import ProbeBudget
+from type_checker import check_video_type, type_to_parser, VideoTypeEnum
+
+__all__ = ('open_reader', 'probe', 'probe_many', 'iter_locations')
+
+DEFAULT_WORKERS = os.cpu_count() or 4
+IN_FLIGHT_PER_WORKER = 4  # bound of submitted but not finished locations
+GLOB_CHARS = ('*', '?', '[')
+REMOTE_SCHEMES = ('http', 'https')
+
+
+def open_reader(loc: str):
+    """Reader of an existing local file or of a http(s) url, other locations are rejected before opening"""
+    if os.path.isfile(loc):
+        logging.debug('Local File')
+        return MmapFileVideoReader(loc)
+    scheme = urlsplit(loc).scheme.lower()
+    if scheme in REMOTE_SCHEMES:
+        logging.debug('Remote File')
+        return RemoteFileReader(loc)
+    if len(scheme) > 1:  # a single letter is a Windows drive
+        raise Exception('Unsupported scheme {!r} of {}, only {} are supported'.format(
+            scheme, loc, ', '.join(REMOTE_SCHEMES)))
+    raise Exception('No such file: {}'.format(loc))
+
+
+def probe(loc: str, cache=None, fields=None, limits=None) -> dict:
+    """Type check and parse the video at loc
+
+    :param cache: ProbeCache, results of unchanged videos are taken from it (full parse only)
+    :param fields: only parse these fields (e.g. ['duration', 'video.width']) if the parser supports 'query'
+    :param limits: limits.ProbeLimits of the work spent on the video, default ProbeLimits(),
+                   ProbeLimitExceeded is raised once one is exceeded
+    :return: {'location': loc, 'type': 'mp4', 'info': raw video info}
+    """
+    if cache is not None and not fields:
+        identity = cache.identity(loc)
+        result = cache.get(loc, identity)
+        if result is None:
+            result = probe(loc, limits=limits)
+            cache.put(loc, identity, result)
+        return result
+
+    with open_reader(loc) as reader:
+        reader.budget = ProbeBudget(limits)
+        extend = reader.extend  # potential extend
+        logging.debug('Potential extend: {}'.format(extend))
+        video_type = check_video_type(reader, potential=VideoTypeEnum.get_type_from_extend(extend or ''))
+        parser = type_to_parser(video_type)  # one proper parse in parsers
+        if fields and hasattr(parser, 'query'):
+            video_info = parser.query(reader, fields)
+        else:
+            video_info = parser.parse(reader)
+    return {'location': loc, 'type': video_type.split('.')[-1].lower(), 'info': video_info}
+
+
+def _safe_probe(loc: str, cache=None, fields=None, limits=None) -> dict:
+    # noinspection PyBroadException
+    try:
+        return probe(loc, cache, fields, limits)
+    except ProbeLimitExceeded as e:
+        logging.debug("Probe '{}' limit exceeded".format(loc), exc_info=True)
+        return {'location': loc, 'error': repr(e), 'limit_exceeded': e.json()}
+    except Exception as e:  # noqa
+        logging.debug("Probe '{}' error".format(loc), exc_info=True)
+        return {'location': loc, 'error': repr(e)}
+
+
+def probe_many(locations, workers: int=DEFAULT_WORKERS, use_processes: bool=False, cache=None, fields=None,
+               limits=None):
+    """Probe locations on a pool of workers, yield results in completion order
+
+    At most workers * IN_FLIGHT_PER_WORKER locations are pending at a time,
+    so 'locations' may be a lazy iterator of any length.
+
+    cache: ProbeCache, used by worker threads, or by the calling thread if use_processes
+    because it can not be shared with worker processes
+    fields, limits: ref probe
+    """
+    if fields:
+        cache = None  # only full results are cached
+    if not use_processes:
+        reserve_session_pool(workers)  # worker threads share the session, a keep-alive connection each
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    local_cache = cache if use_processes else None
+    worker_cache = None if use_processes else cache
+    max_in_flight = max(1, workers) * IN_FLIGHT_PER_WORKER
+    locations = iter(locations)
+    with executor_class(max_workers=max(1, workers)) as executor:
+        pending = {}  # future -> (location, identity for local_cache)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
+                loc = next(locations, None)
+                if loc is None:
+                    exhausted = True
+                    break
+                identity = None
+                if local_cache is not None:
+                    identity = local_cache.identity(loc)
+                    result = local_cache.get(loc, identity)
+                    if result is not None:
+                        yield result
+                        continue
+                pending[executor.submit(_safe_probe, loc, worker_cache, fields, limits)] = (loc, identity)
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                loc, identity = pending.pop(future)
+                result = future.result()
+                if local_cache is not None and 'error' not in result:
+                    local_cache.put(loc, identity, result)
+                yield result
+
+
+def _is_video_file(name: str) -> bool:
+    return name.rsplit('.', 1)[-1].lower() in COMMON_VIDEO_EXTENDS
+
+
+def iter_locations(locations, input_file: str=None):
+    """Expand locations: directories are walked recursively for video files,
+    glob patterns are expanded and input_file (a file of locations, '-' for stdin)
+    is read line by line. Urls and plain paths are yielded as they are.
+    """
+    def _expand(loc):
+        if '://' in loc:
+            yield loc
+        elif os.path.isdir(loc):
+            for root, dirs, files in os.walk(loc):
+                dirs.sort()
+                for name in sorted(files):
+                    if _is_video_file(name):
+                        yield os.path.join(root, name)
+        elif any(c in loc for c in GLOB_CHARS) and not os.path.exists(loc):
+            for path in sorted(glob.iglob(loc, recursive=True)):
+                if os.path.isdir(path):
+                    yield from _expand(path)
+                elif os.path.isfile(path):
+                    yield path
+        else:
+            yield loc
+
+    for loc in locations:
+        yield from _expand(loc)
+    if input_file:
+        f = open(input_file) if input_file != '-' else sys.stdin
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield from _expand(line)
+        finally:
+            if f is not sys.stdin:
+                f.close()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Probe Result Cache
+
+An on-disk (sqlite) cache of probe results, so re-scanning unchanged videos
+costs a 'stat' (or a HEAD request for remote videos) instead of a parse.
+
+A result is valid as long as the identity of the video does not change:
+    local video: (size, mtime, inode)
+    remote video: ETag, Last-Modified and Content-Length of a HEAD request
+Remote videos without any of those headers are not cached.
+
+Least recently used results are evicted when the stored results exceed max_bytes.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+__all__ = ('ProbeCache', )
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 Mb of results
+
+
+def _is_remote(loc: str) -> bool:
+    return '://' in loc
+
+
+class ProbeCache:
+
+    def __init__(self, path: str, max_bytes: int=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS probe_result ('
+            'location TEXT PRIMARY KEY, identity TEXT NOT NULL, result TEXT NOT NULL, '
+            'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS probe_result_accessed ON probe_result (accessed)')
+        self._conn.commit()
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM probe_result').fetchone()[0]
+
+    @staticmethod
+    def key(loc: str) -> str:
+        return loc if _is_remote(loc) else os.path.abspath(loc)
+
+    @staticmethod
+    def identity(loc: str):
+        """Identity of the video at loc, None if it can not be identified (not cached)"""
+        if not _is_remote(loc):
+            try:
+                st = os.stat(loc)
+            except OSError:
+                return None
+            return '{}:{}:{}'.format(st.st_size, st.st_mtime_ns, st.st_ino)
+        from input import get_session
+        try:
+            response = get_session().head(loc, allow_redirects=True, timeout=10)
+        except Exception as e:  # noqa
+            logging.debug("HEAD '{}' error: {}".format(loc, repr(e)))
+            return None
+        headers = [response.headers.get(h) for h in ('ETag', 'Last-Modified', 'Content-Length')]
+        if response.status_code != 200 or not any(headers[:2]):
+            return None
+        return '|'.join(h or '' for h in headers)
+
+    def get(self, loc: str, identity: str):
+        """Cached result of loc, None if missed or stale"""
+        if identity is None:
+            return None
+        key = self.key(loc)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT identity, result FROM probe_result WHERE location = ?', (key, )).fetchone()
+            if row is None or row[0] != identity:
+                return None
+            # committed with the next put or close
+            self._conn.execute('UPDATE probe_result SET accessed = ? WHERE location = ?', (time.time(), key))
+        return json.loads(row[1])
+
+    def put(self, loc: str, identity: str, result: dict) -> None:
+        if identity is None:
+            return
+        key = self.key(loc)
+        data = json.dumps(result, default=str, ensure_ascii=False)
+        with self._lock:
+            row = self._conn.execute('SELECT size FROM probe_result WHERE location = ?', (key, )).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO probe_result (location, identity, result, size, accessed) '
+                'VALUES (?, ?, ?, ?, ?)', (key, identity, data, len(data), time.time()))
+            self._total_bytes += len(data) - (row[0] if row is not None else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Delete least recently used results until the total size fits max_bytes, lock held by caller"""
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                'SELECT location, size FROM probe_result ORDER BY accessed LIMIT 64').fetchall()
+            if not rows:
+                break
+            for location, size in rows:
+                self._conn.execute('DELETE FROM probe_result WHERE location = ?', (location, ))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def invalidate(self, locations=None) -> int:
+        """Remove results of locations (all results if None), return the number removed"""
+        with self._lock:
+            if locations is None:
+                count = self._conn.execute('DELETE FROM probe_result').rowcount
+            else:
+                count = sum(
+                    self._conn.execute('DELETE FROM probe_result WHERE location = ?', (self.key(loc), )).rowcount
+                    for loc in locations
+                )
+            self._conn.commit()
+            self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM probe_result').fetchone()[0]
+        return count
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM probe_result').fetchone()[0]
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
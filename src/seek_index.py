@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+Seek Index
+
+Per track key frame index of a mp4 (mov) video: (timestamp, byte offset, size)
+of every sync sample, built from stss, stts, stsz, stsc and stco (co64).
+
+    index = SeekIndex.load_or_build(loc)  # reads the sidecar file if fresh
+    entry = index.lookup(62.5)  # nearest preceding key frame of the first video track
+    reader.seek(entry.offset); reader.read(entry.size)
+
+The index is saved into a small sidecar file (loc + SIDECAR_EXTEND by default)
+together with the identity of the video, repeat lookups do not parse the moov
+again until the video changes.
+"""
+
+import logging
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from probe import open_reader
+
+__all__ = ('SeekEntry', 'TrackIndex', 'SeekIndex', 'sidecar_path')
+
+SIDECAR_EXTEND = '.seekidx'
+SIDECAR_MAGIC = b'PVSI'
+SIDECAR_VERSION = 1
+SIDECAR_HEADER = struct.Struct('>4sHHH')  # magic, version, track count, identity length
+TRACK_HEADER = struct.Struct('>II4sI')  # track id, time scale, handler type, entry count
+
+SeekEntry = namedtuple('SeekEntry', ('track_id', 'time', 'offset', 'size'))
+
+
+def sidecar_path(loc: str) -> str:
+    return loc + SIDECAR_EXTEND
+
+
+def _to_big_endian(values: array) -> bytes:
+    if sys.byteorder == 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_big_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+class TrackIndex:
+    """Key frames of one track, times in the media time scale"""
+
+    __slots__ = ('track_id', 'time_scale', 'handler_type', 'times', 'offsets', 'sizes')
+
+    def __init__(self, track_id: int, time_scale: int, handler_type: str, times: array, offsets: array,
+                 sizes: array):
+        self.track_id = track_id
+        self.time_scale = time_scale
+        self.handler_type = handler_type
+        self.times = times
+        self.offsets = offsets
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.times)
+
+    def entry(self, i: int) -> SeekEntry:
+        return SeekEntry(self.track_id, self.times[i] / self.time_scale, self.offsets[i], self.sizes[i])
+
+    def lookup(self, timestamp: float):
+        """Nearest key frame at or before timestamp (seconds), the first one if before all, None if empty"""
+        if not self.times:
+            return None
+        i = bisect_right(self.times, round(timestamp * self.time_scale)) - 1
+        return self.entry(max(i, 0))
+
+    def json(self) -> dict:
+        return {'track_id': self.track_id, 'time_scale': self.time_scale, 'handler_type': self.handler_type,
+                'keyframes': [list(self.entry(i)[1:]) for i in range(len(self))]}
+
+
+class SeekIndex:
+
+    def __init__(self, tracks: list, identity: str=''):
+        self.tracks = tracks
+        self.identity = identity  # identity of the video indexed, ref ProbeCache.identity
+
+    def track(self, track_id: int=None):
+        """Track of track_id, default the first video track (or the first track)"""
+        for track in self.tracks:
+            if track.track_id == track_id or (track_id is None and track.handler_type == 'vide'):
+                return track
+        return self.tracks[0] if track_id is None and self.tracks else None
+
+    def lookup(self, timestamp: float, track_id: int=None):
+        """SeekEntry of the nearest key frame at or before timestamp (seconds), None if no such track"""
+        track = self.track(track_id)
+        return track.lookup(timestamp) if track is not None else None
+
+    @classmethod
+    def build(cls, reader, identity: str=''):
+        """Index the tracks of the first moov of a mp4 (mov) reader
+
+        Video tracks and tracks with a stss are indexed, the others (e.g. audio) have
+        every sample as a key frame and are left out to keep the index small.
+        """
+        from parsers import mp4
+        tracks = []
+        moov = mp4.LazyBox.root(reader).child('moov')
+        if moov is None:
+            raise Exception('No moov box found in {}'.format(reader.video_loc))
+        for trak in moov.iter_children('trak'):
+            tkhd, mdhd, hdlr = trak.child('tkhd'), trak.find('mdia', 'mdhd'), trak.find('mdia', 'hdlr')
+            stbl = trak.find('mdia', 'minf', 'stbl')
+            if None in (tkhd, mdhd, stbl):
+                continue
+            handler_type = hdlr.box.handler_type if hdlr is not None else ''
+            if handler_type != 'vide' and stbl.box.stss_box is None:
+                continue
+            times, offsets, sizes = stbl.box.keyframe_index()
+            tracks.append(TrackIndex(
+                tkhd.box.track_id, mdhd.box.time_scale, handler_type, times, offsets, sizes))
+        return cls(tracks, identity)
+
+    def dumps(self) -> bytes:
+        identity = self.identity.encode('utf8')
+        data_list = [SIDECAR_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, len(self.tracks), len(identity)),
+                     identity]
+        for track in self.tracks:
+            data_list.append(TRACK_HEADER.pack(
+                track.track_id, track.time_scale, track.handler_type.encode('latin-1'), len(track)))
+            data_list += [_to_big_endian(track.times), _to_big_endian(track.offsets), _to_big_endian(track.sizes)]
+        return b''.join(data_list)
+
+    @classmethod
+    def loads(cls, data: bytes):
+        magic, version, track_count, identity_length = SIDECAR_HEADER.unpack_from(data)
+        if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION:
+            raise Exception('Not a seek index (version {})'.format(SIDECAR_VERSION))
+        position = SIDECAR_HEADER.size
+        identity = data[position: position + identity_length].decode('utf8')
+        position += identity_length
+        tracks = []
+        for _ in range(track_count):
+            track_id, time_scale, handler_type, count = TRACK_HEADER.unpack_from(data, position)
+            position += TRACK_HEADER.size
+            columns = []
+            for typecode, itemsize in (('Q', 8), ('Q', 8), ('I', 4)):
+                columns.append(_from_big_endian(typecode, data[position: position + count * itemsize]))
+                position += count * itemsize
+            if any(len(column) != count for column in columns):
+                raise Exception('Truncated seek index')
+            tracks.append(TrackIndex(track_id, time_scale, handler_type.decode('latin-1'), *columns))
+        return cls(tracks, identity)
+
+    def save(self, path: str) -> None:
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(self.dumps())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, 'rb') as f:
+            return cls.loads(f.read())
+
+    @classmethod
+    def load_or_build(cls, loc: str, path: str=None, save: bool=True):
+        """Index from the sidecar file at path if it matches the video, otherwise build (and save) it
+
+        :param path: sidecar file, default loc + SIDECAR_EXTEND for local videos, none for remote ones
+        """
+        from probe_cache import ProbeCache
+        identity = ProbeCache.identity(loc)
+        if path is None and '://' not in loc:
+            path = sidecar_path(loc)
+        if path is not None and identity is not None and os.path.isfile(path):
+            try:
+                index = cls.load(path)
+                if index.identity == identity:
+                    return index
+                logging.debug("Seek index '{}' is stale".format(path))
+            except Exception as e:  # noqa
+                logging.debug("Seek index '{}' error: {}".format(path, repr(e)))
+        with open_reader(loc) as reader:
+            index = cls.build(reader, identity or '')
+        if save and path is not None and identity is not None:
+            index.save(path)
+        return index
+
+    def json(self) -> dict:
+        return {'tracks': [track.json() for track in self.tracks]}
@@ -6,9 +6,10 @@ Check video type
 
 from importlib import import_module
 
+from consts import ASF_HEADER_GUID, MOV_FIRST_ATOM_TYPES, MOV_FTYP_BRAND, MP4_FTYP_BRANDS, TYPE_CHECK_MAX_BYTES
 from input import VideoReader
 
-__all__ = ('VideoTypeEnum', 'type_to_parser', 'check_video_type')
+__all__ = ('VideoTypeEnum', 'PARSER_REGISTRY', 'type_to_parser', 'check_video_type', 'match_video_type')
 
 
 class VideoTypeEnum:
@@ -44,44 +45,72 @@ class VideoTypeEnum:
         return VideoTypeEnum._all
 
 
+# VideoTypeEnum.? -> parser module, a parser is imported the first time its type is met
+# rm and rmvb share one parser
+PARSER_REGISTRY = {
+    VideoTypeEnum.ASF: 'parsers.asf',
+    VideoTypeEnum.AVI: 'parsers.avi',
+    VideoTypeEnum.FLV: 'parsers.flv',
+    VideoTypeEnum.MKV: 'parsers.mkv',
+    VideoTypeEnum.MOV: 'parsers.mov',
+    VideoTypeEnum.MP4: 'parsers.mp4',
+    VideoTypeEnum.RM: 'parsers.rmvb',
+    VideoTypeEnum.RMVB: 'parsers.rmvb',
+}
+
+
 def type_to_parser(t: str):
     """Map VideoTypeEnum.? to parser module in parsers"""
+    if t not in PARSER_REGISTRY:
+        raise Exception('No parser for video type {}'.format(t))
+    return import_module(PARSER_REGISTRY[t])
 
-    return _type_to_parser(t.split('.')[-1].lower())
 
+# first 3 bytes -> (type in lower case, ((offset, expected bytes), ...))
+# rm and rmvb share the '.RMF' container, 'rm' stands for both
+_MAGIC_TABLE = {
+    b'RIF': ('avi', ((0, b'RIFF'), (8, b'AVI '))),
+    b'FLV': ('flv', ((0, b'FLV'), )),
+    b'\x1A\x45\xDF': ('mkv', ((0, b'\x1A\x45\xDF\xA3'), )),
+    b'.RM': ('rm', ((0, b'.RMF'), )),
+    ASF_HEADER_GUID[:3]: ('asf', ((0, ASF_HEADER_GUID), )),
+}
+
+# brand following 'ftyp' -> type in lower case
+_FTYP_BRAND_TABLE = {MOV_FTYP_BRAND: 'mov', **{brand: 'mp4' for brand in MP4_FTYP_BRANDS}}
 
-def _type_to_parser(t: str):
-    """Map video type to parser module in parsers
-    't' belongs to one of VideoTypeEnum._all
-    """
-    return import_module('parsers.{}'.format(t))
 
+def match_video_type(head: bytes, potential=VideoTypeEnum.UNKNOWN) -> str:
+    """Match the head bytes of a video against known signatures
 
-def _video_parser_iter(first: str=None) -> iter:
-    """ Iteration of all video parsers
-    yield 'type in lower case' and 'parser module'
+    :param head: the first bytes of the video, TYPE_CHECK_MAX_BYTES are enough
+    :param potential: used to tell rm from rmvb, which share the same container
+    :return: VideoTypeEnum.?, VideoTypeEnum.UNKNOWN if no signature matches
     """
-    if first is not None:
-        if first in VideoTypeEnum.get_all_types():
-            yield first, _type_to_parser(first)
-        else:
-            first = None
-    for t in VideoTypeEnum.get_all_types():
-        if t == first:
-            continue
-        yield t, _type_to_parser(t)
+    magic = _MAGIC_TABLE.get(bytes(head[:3]))
+    if magic is not None:
+        t, signatures = magic
+        if all(head[offset: offset + len(expected)] == expected for offset, expected in signatures):
+            if t == 'rm' and potential == VideoTypeEnum.RMVB:
+                return VideoTypeEnum.RMVB
+            return VideoTypeEnum.get_type(t)
+        return VideoTypeEnum.UNKNOWN
+    # search 4-bytes aligned 'ftyp' and the brand after it
+    for offset in range(0, len(head) - 7, 4):
+        if head[offset: offset + 4] == b'ftyp':
+            t = _FTYP_BRAND_TABLE.get(bytes(head[offset + 4: offset + 8]))
+            return VideoTypeEnum.UNKNOWN if t is None else VideoTypeEnum.get_type(t)
+    # old QuickTime files have no ftyp, but start with one of a few atoms (size 0, 1 or a whole header at least)
+    if bytes(head[4:8]) in MOV_FIRST_ATOM_TYPES and int.from_bytes(head[:4], byteorder='big') not in range(2, 8):
+        return VideoTypeEnum.MOV
+    return VideoTypeEnum.UNKNOWN
 
 
 def check_video_type(reader: VideoReader, potential=VideoTypeEnum.UNKNOWN):
-    if potential == VideoTypeEnum.UNKNOWN:
-        first = None
-    else:
-        first = potential.split('.')[-1].lower()
-
-    for t, parser in _video_parser_iter(first):
-        res = parser.type_checking_passed(reader)
-        reader.refresh()
-        if res:
-            return VideoTypeEnum.get_type(t)
-
-    raise Exception('Unrecognized video type!')
+    """Read the head of the video once and match it, the reader is refreshed afterwards"""
+    head = reader.read(TYPE_CHECK_MAX_BYTES)
+    reader.refresh()
+    t = match_video_type(head, potential)
+    if t == VideoTypeEnum.UNKNOWN:
+        raise Exception('Unrecognized video type!')
+    return t
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 
 
@@ -7,12 +8,35 @@ def set_logging(level=logging.INFO):
     logging.basicConfig(format='%(levelname)s: %(message)s', level=level)
 
 
-def format_video_info(video_info: dict, fmt: str='json'):
+def _text_value(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value, default=str, ensure_ascii=False)
+
+
+def _text_lines(value, indent: int=0) -> list:
+    """'key: value' lines of a dict, '- value' lines of a list, nested ones indented by 2 spaces"""
+    if isinstance(value, dict):
+        items = [('{}:'.format(key), item) for key, item in value.items()]
+    else:
+        items = [('-', item) for item in value]
+    lines = []
+    for label, item in items:
+        if isinstance(item, (dict, list, tuple)) and item:
+            lines.append('  ' * indent + label)
+            lines.extend(_text_lines(item, indent + 1))
+        else:
+            lines.append('{}{} {}'.format('  ' * indent, label, _text_value(item)))
+    return lines
+
+
+def format_video_info(video_info: dict, fmt: str='json') -> str:
     """
 
     :param video_info: dict
-    :param fmt: json, text
+    :param fmt: json (one line), text (a 'key: value' line per field, nested fields indented)
     :return:
     """
-    # TODO
-    return str(video_info)
+    if fmt == 'json':
+        return json.dumps(video_info, default=str, ensure_ascii=False)
+    if fmt == 'text':
+        return '\n'.join(_text_lines(video_info))
+    raise Exception('Unknown format: {}, supported: json, text'.format(fmt))
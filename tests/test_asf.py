@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import unittest
+
+from consts import ASF_HEADER_GUID
+from parsers import asf
+from src.input import BytesVideoReader
+from tests.utils import CountingBytesReader
+
+AUDIO_MEDIA_GUID = asf.guid('F8699E40-5B4D-11CF-A8FD-00805F5C442B')
+VIDEO_MEDIA_GUID = asf.guid('BC19EFC0-5B4D-11CF-A8FD-00805F5C442B')
+
+
+def utf16(text: str) -> bytes:
+    return (text + '\x00').encode('utf-16-le')
+
+
+def make_object(object_guid: bytes, payload: bytes) -> bytes:
+    return asf.OBJECT_HEADER.pack(object_guid, asf.OBJECT_HEADER.size + len(payload)) + payload
+
+
+def make_stream_properties(stream_type: bytes, stream_number: int, type_specific: bytes) -> bytes:
+    return make_object(asf.STREAM_PROPERTIES_GUID, asf.STREAM_PROPERTIES.pack(
+        stream_type, bytes(16), 0, len(type_specific), 0, stream_number, 0) + type_specific)
+
+
+def make_wmv(data_size: int=1000, broadcast: bool=False, broken: bool=False) -> bytes:
+    """A WMV3 640x360 video stream (1) and a wmav2 44.1 kHz stereo audio stream (2), 60 s and 3 s preroll"""
+    objects = [
+        make_object(asf.FILE_PROPERTIES_GUID, asf.FILE_PROPERTIES.pack(
+            bytes(16), 123456, 0, 42, 630000000, 600000000, 3000, 0x01 if broadcast else 0x02, 3200, 3200, 2000000)),
+        make_stream_properties(VIDEO_MEDIA_GUID, 1, asf.VIDEO_MEDIA_HEADER.pack(640, 360, 2, 40) +
+                               asf.BITMAPINFOHEADER.pack(40, 640, 360, 1, 24, b'WMV3', 0) + bytes(16)),
+        make_stream_properties(AUDIO_MEDIA_GUID, 2, asf.WAVEFORMATEX.pack(0x161, 2, 44100, 16000, 5945, 16) +
+                               bytes(12)),
+        make_object(asf.CONTENT_DESCRIPTION_GUID, struct.pack(
+            '<5H', len(utf16('A Title')), len(utf16('An Author')), 0, 0, 0) + utf16('A Title') + utf16('An Author')),
+        make_object(asf.EXTENDED_CONTENT_DESCRIPTION_GUID, struct.pack('<H', 3) + b''.join((
+            struct.pack('<H', len(utf16('WM/EncodingSettings'))) + utf16('WM/EncodingSettings') +
+            struct.pack('<HH', 0, len(utf16('Lavf57'))) + utf16('Lavf57'),
+            struct.pack('<H', len(utf16('IsVBR'))) + utf16('IsVBR') + struct.pack('<HHI', 2, 4, 1),
+            struct.pack('<H', len(utf16('WM/Year'))) + utf16('WM/Year') + struct.pack('<HHI', 3, 4, 2009),
+        ))),
+        make_object(asf.CODEC_LIST_GUID, bytes(16) + struct.pack('<IHH', 1, 1, 4) + utf16('WMV') +
+                    struct.pack('<HH', 0, 4) + b'WMV3'),
+        make_object(bytes(16), bytes(7)),  # unknown, skipped
+        make_object(asf.HEADER_EXTENSION_GUID, asf.HEADER_EXTENSION.pack(bytes(16), 6, 64 + 24) + make_object(
+            asf.EXTENDED_STREAM_PROPERTIES_GUID,
+            asf.EXTENDED_STREAM_PROPERTIES.pack(0, 0, 1800000, 0, 0, 0, 0, 0, 30000, 0, 1, 0, 400000, 0, 0))),
+    ]
+    if broken:
+        objects.insert(2, make_object(asf.CONTENT_DESCRIPTION_GUID, bytes(4)))  # too short for its lengths
+    payload = b''.join(objects)
+    header = asf.HEADER_OBJECT_HEADER.pack(
+        ASF_HEADER_GUID, asf.HEADER_OBJECT_HEADER.size + len(payload), len(objects), 1, 2) + payload
+    return header + make_object(asf.DATA_OBJECT_GUID, bytes(data_size))
+
+
+class ASFTest(unittest.TestCase):
+
+    def test_guid(self):
+        self.assertEqual(asf.guid('75B22630-668E-11CF-A6D9-00AA0062CE6C'), ASF_HEADER_GUID)
+
+    def test_parse(self):
+        data = make_wmv()
+        info = asf.parse(BytesVideoReader(data))
+        self.assertEqual(info['duration'], 60.0)
+        properties = info['file_properties']
+        self.assertEqual((properties['play_duration'], properties['preroll'], properties['data_packets_count'],
+                          properties['max_bitrate'], properties['seekable']), (63.0, 3000, 42, 2000000, True))
+        video, audio = info['streams']
+        self.assertEqual((video['stream_number'], video['type'], video['codec'], video['width'], video['height']),
+                         (1, 'video', 'WMV3', 640, 360))
+        self.assertEqual((video['frame_rate'], video['data_bitrate']), (25.0, 1800000))
+        self.assertEqual((audio['stream_number'], audio['type'], audio['codec'], audio['channels'],
+                          audio['sample_rate'], audio['bitrate']), (2, 'audio', 'wmav2', 2, 44100, 128000))
+        self.assertEqual(info['content_description']['title'], 'A Title')
+        self.assertEqual(info['content_description']['author'], 'An Author')
+        self.assertEqual(info['extended_content_description'],
+                         {'WM/EncodingSettings': 'Lavf57', 'IsVBR': True, 'WM/Year': 2009})
+        self.assertEqual(info['codecs'], [{'type': 'video', 'name': 'WMV', 'description': ''}])
+        self.assertEqual(info['data_object'], {'offset': len(data) - 1024, 'size': 1024})
+        self.assertEqual(info['skipped_objects'], [])
+
+    def test_data_object_is_not_read(self):
+        small, large = CountingBytesReader(make_wmv(10)), CountingBytesReader(make_wmv(10000000))
+        self.assertEqual(asf.parse(small)['streams'], asf.parse(large)['streams'])
+        self.assertEqual((small.calls, small.bytes_read), (large.calls, large.bytes_read))
+        self.assertEqual(large.calls, 2)
+
+    def test_broadcast(self):
+        self.assertIsNone(asf.parse(BytesVideoReader(make_wmv(broadcast=True)))['duration'])
+
+    def test_broken_object(self):
+        data = make_wmv(broken=True)
+        info = asf.parse(BytesVideoReader(data))
+        skipped, = info['skipped_objects']
+        self.assertEqual(skipped['guid'], asf.CONTENT_DESCRIPTION_GUID.hex())
+        self.assertEqual(data[skipped['offset']: skipped['offset'] + 16], asf.CONTENT_DESCRIPTION_GUID)
+        size = data[skipped['offset'] + 16: skipped['offset'] + 24]
+        self.assertEqual(size, struct.pack('<Q', 28))  # GUID, size and 4 bytes
+        # the objects before and after it are still decoded
+        self.assertEqual([s['codec'] for s in info['streams']], ['WMV3', 'wmav2'])
+        self.assertEqual(info['content_description']['title'], 'A Title')
+        self.assertEqual(info['streams'][0]['data_bitrate'], 1800000)
+
+    def test_invalid(self):
+        data = make_wmv()
+        with self.assertRaises(Exception):
+            asf.parse(BytesVideoReader(data[:200]))
+        with self.assertRaises(Exception):
+            asf.parse(BytesVideoReader(b'FLV' + data[3:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
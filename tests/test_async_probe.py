@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import gc
+import unittest
+
+from excptions import ProbeLimitExceeded
+from limits import ProbeLimits
+from parsers import mp4
+from src import async_input
+from src.async_input import AsyncHTTPPool, AsyncRemoteReader, close_pool, get_pool
+from src.async_probe import probe, probe_many
+from src.probe import probe as sync_probe
+from tests.test_input import MOV_TEST_VIDEO_LOC, start_local_server
+
+
+class AsyncProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.url = start_local_server()
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_async_reader(self):
+        async def run():
+            async with AsyncRemoteReader(self.url, AsyncHTTPPool()) as reader:
+                self.assertEqual(await reader.read(8), b'\x00\x00\x00\x14ftyp')
+                self.assertEqual(await reader.read_str(4), 'qt  ')
+                reader.seek(28 + 0x21c31a)
+                self.assertEqual((await reader.read(8))[4:], b'moov')
+                reader.refresh()
+                self.assertEqual(await reader.read_int(4), 0x14)
+                # a blocking parser driven by the async reader
+                box_size, box_type, _, _ = await reader.drive(mp4.find_first_box_by_type, 'moov')
+                self.assertEqual((box_size, box_type), (34538, 'moov'))
+        asyncio.run(run())
+        self.assertEqual(len(self.server.requests), 2)  # head and moov, the rest is served from memory
+
+    def test_page_store_too_small(self):
+        async def run():
+            async with AsyncRemoteReader(self.url, AsyncHTTPPool(), page_length=1024,
+                                         max_buffer_length=16 * 1024) as reader:
+                box_size, _, _, _ = await reader.drive(mp4.find_first_box_by_type, 'moov')
+                self.assertEqual(box_size, 34538)
+                with self.assertRaisesRegex(Exception, 'page store'):
+                    await reader.drive(mp4.parse)  # the 34538 bytes moov does not fit 16 KiB
+        asyncio.run(run())
+        self.assertLess(len(self.server.requests), 64)  # given up long before MAX_DRIVE_ROUNDS
+
+    def test_pools(self):
+        async def pool_of_loop():
+            return get_pool()
+
+        loop = asyncio.new_event_loop()
+        pool = loop.run_until_complete(pool_of_loop())
+        loop.close()
+        self.assertIs(async_input._pools[loop], pool)
+        self.assertIsNot(asyncio.run(pool_of_loop()), pool)
+        self.assertNotIn(loop, async_input._pools)  # the pool of the closed loop is closed and dropped
+
+        async def closed_pool():
+            get_pool()
+            close_pool()
+            return asyncio.get_running_loop() in async_input._pools
+        self.assertFalse(asyncio.run(closed_pool()))
+        async_input._pools.clear()
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(pool_of_loop())
+        loop.close()
+        del loop
+        gc.collect()
+        self.assertEqual(len(async_input._pools), 0)  # no strong reference to the loop
+
+        async def read_head():
+            async with AsyncRemoteReader(self.url) as reader:  # its connection is left idle in the shared pool
+                return await reader.read(4)
+        self.assertEqual(asyncio.run(read_head()), b'\x00\x00\x00\x14')
+        self.assertEqual(asyncio.run(read_head()), b'\x00\x00\x00\x14')  # closing the pool of the closed loop
+
+    def test_probe(self):
+        result = asyncio.run(probe(self.url))
+        expected = sync_probe(MOV_TEST_VIDEO_LOC)
+        self.assertEqual(result['type'], expected['type'])
+        self.assertEqual(result['info'], expected['info'])
+
+    def test_limits(self):
+        with self.assertRaises(ProbeLimitExceeded) as context:
+            asyncio.run(probe(self.url, limits=ProbeLimits(max_boxes=20)))
+        self.assertEqual(context.exception.limit, 'boxes')
+        # the deadline runs across the fetches and replays of a drive
+        with self.assertRaises(ProbeLimitExceeded) as context:
+            asyncio.run(probe(self.url, limits=ProbeLimits(max_seconds=0)))
+        self.assertEqual(context.exception.limit, 'seconds')
+        # the counters restart with each replay, the default limits are not hit by replays
+        self.assertEqual(asyncio.run(probe(self.url, limits=ProbeLimits(max_bytes=64 * 1024)))['type'], 'mov')
+
+        async def run():
+            locations = [self.url, MOV_TEST_VIDEO_LOC]
+            return [r async for r in probe_many(locations, limits=ProbeLimits(max_entries=100))]
+        results = asyncio.run(run())
+        self.assertEqual([r['limit_exceeded']['limit'] for r in results], ['entries', 'entries'])
+
+    def test_probe_many(self):
+        async def run():
+            pool = AsyncHTTPPool(limit_per_host=3)
+            locations = [self.url] * 20 + ['http://127.0.0.1:1/unreachable.mp4', MOV_TEST_VIDEO_LOC]
+            results = [r async for r in probe_many(locations, concurrency=8, pool=pool)]
+            return pool, locations, results
+        pool, locations, results = asyncio.run(run())
+        self.assertEqual(sorted(r['location'] for r in results), sorted(locations))
+        self.assertEqual([r['location'] for r in results if 'error' in r], ['http://127.0.0.1:1/unreachable.mp4'])
+        self.assertLessEqual(pool.connections_opened, 3 + 1)
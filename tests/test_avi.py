@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import unittest
+
+from parsers import avi
+from src.input import BytesVideoReader, FileVideoReader
+from tests.utils import CountingBytesReader
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+
+AVI_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.avi')
+
+
+def make_chunk(chunk_id: bytes, payload: bytes) -> bytes:
+    return struct.pack('<4sI', chunk_id, len(payload)) + payload + b'\x00' * (len(payload) & 1)
+
+
+def make_list(chunk_id: bytes, list_type: bytes, payload: bytes) -> bytes:
+    return make_chunk(chunk_id, list_type + payload)
+
+
+def make_open_dml(avix_count: int, movi_size: int=100000, scale: int=1, rate: int=25,
+                   frames_per_riff: int=250) -> bytes:
+    """OpenDML AVI of one 640x480 MJPG 25 fps stream, avih counting the first RIFF only (250 frames)"""
+    total_frames = frames_per_riff * (avix_count + 1)
+    hdrl = make_list(b'LIST', b'hdrl', b''.join((
+        make_chunk(b'avih', avi.AVIH.pack(40000, 0, 0, avi.AVIF_HASINDEX, frames_per_riff, 0, 1, 0, 640, 480)),
+        make_list(b'LIST', b'strl', b''.join((
+            make_chunk(b'strh', avi.STRH.pack(b'vids', b'MJPG', 0, 0, 0, 0, scale, rate, 0, total_frames,
+                                              0, 0, 0, 0, 0, 640, 480)),
+            make_chunk(b'strf', avi.BITMAPINFOHEADER.pack(40, 640, 480, 1, 24, b'MJPG', 0) + bytes(16)),
+            make_chunk(b'strn', b'camera\x00'),
+        ))),
+        make_list(b'LIST', b'odml', make_chunk(b'dmlh', struct.pack('<I', total_frames) + bytes(244))),
+    )))
+    movi = make_list(b'LIST', b'movi', make_chunk(b'00dc', bytes(movi_size)))
+    data = make_list(b'RIFF', b'AVI ', hdrl + make_chunk(b'JUNK', bytes(3)) + movi + make_chunk(b'idx1', bytes(160)))
+    for _ in range(avix_count):
+        data += make_list(b'RIFF', b'AVIX', movi)
+    return data
+
+
+class AVITest(unittest.TestCase):
+
+    def test_parse(self):
+        with FileVideoReader(AVI_TEST_VIDEO_LOC) as reader:
+            info = avi.parse(reader)
+        self.assertEqual((info['duration'], info['total_frames'], info['width'], info['height']),
+                         (30.033, 901, 1920, 1080))
+        self.assertEqual(info['avih']['micro_sec_per_frame'], 33333)
+        self.assertEqual(info['avih']['streams'], 2)
+        video, audio = info['streams']
+        self.assertEqual((video['type'], video['codec'], video['width'], video['height']),
+                         ('video', 'H264', 1920, 1080))
+        self.assertEqual((video['frame_rate'], video['length']), (30.0, 901))
+        self.assertEqual((audio['type'], audio['codec'], audio['channels'], audio['sample_rate']),
+                         ('audio', 'aac', 2, 48000))
+        self.assertEqual(audio['duration'], 30.613)
+        self.assertIsNone(info['odml'])
+        self.assertEqual(info['info'], {'ISFT': 'Lavf57.19.100'})
+        self.assertEqual(info['riff_chunks'], [{'type': 'AVI ', 'offset': 0, 'size': 2279786}])
+        self.assertTrue(info['has_idx1'])
+
+    def test_open_dml(self):
+        info = avi.parse(BytesVideoReader(make_open_dml(3)))
+        self.assertEqual(info['odml'], {'total_frames': 1000})
+        self.assertEqual((info['total_frames'], info['duration']), (1000, 40.0))
+        self.assertEqual([c['type'] for c in info['riff_chunks']], ['AVI ', 'AVIX', 'AVIX', 'AVIX'])
+        stream, = info['streams']
+        self.assertEqual((stream['codec'], stream['name'], stream['frame_rate']), ('MJPG', 'camera', 25.0))
+
+    def test_ntsc_duration(self):
+        # 100000 frames of 1001 / 30000 s, not of 1 / 29.97 s (3336.67 s)
+        info = avi.parse(BytesVideoReader(make_open_dml(3, 100, scale=1001, rate=30000, frames_per_riff=25000)))
+        self.assertEqual((info['total_frames'], info['duration']), (100000, 3336.667))
+        self.assertEqual(info['streams'][0]['frame_rate'], 29.97)
+
+    def test_movi_is_skipped(self):
+        small, large = CountingBytesReader(make_open_dml(1, 100)), CountingBytesReader(make_open_dml(1, 10000000))
+        avi.parse(small)
+        avi.parse(large)
+        self.assertEqual(small.bytes_read, large.bytes_read)
+        self.assertLess(large.bytes_read, 1024)
+        reader = CountingBytesReader(make_open_dml(50))
+        self.assertEqual(len(avi.parse(reader)['riff_chunks']), 51)
+        self.assertLess(reader.bytes_read, small.bytes_read + 50 * 12)  # a header per AVIX
+
+    def test_truncated(self):
+        data = make_open_dml(2)
+        info = avi.parse(BytesVideoReader(data[:len(data) // 2]))
+        self.assertEqual(info['odml'], {'total_frames': 750})
+        with self.assertRaises(Exception):
+            avi.parse(BytesVideoReader(b'RIFF\x04\x00\x00\x00AVI '))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import unittest
+
+from excptions import EOF
+from parsers import flv
+from src.input import BytesVideoReader
+from tests.utils import CountingBytesReader
+
+
+def amf_string(value: str) -> bytes:
+    data = value.encode('utf8')
+    return struct.pack('>H', len(data)) + data
+
+
+def amf_value(value) -> bytes:
+    if isinstance(value, bool):
+        return struct.pack('>BB', flv.AMF_BOOLEAN, value)
+    if isinstance(value, (int, float)):
+        return struct.pack('>Bd', flv.AMF_NUMBER, value)
+    if isinstance(value, str):
+        return bytes((flv.AMF_STRING, )) + amf_string(value)
+    if isinstance(value, list):
+        return struct.pack('>BI', flv.AMF_STRICT_ARRAY, len(value)) + b''.join(map(amf_value, value))
+    return bytes((flv.AMF_OBJECT, )) + amf_properties(value)
+
+
+def amf_properties(values: dict) -> bytes:
+    return b''.join(amf_string(k) + amf_value(v) for k, v in values.items()) + b'\x00\x00\x09'
+
+
+def make_tag(tag_type: int, timestamp: int, data: bytes) -> bytes:
+    header = struct.pack('>BHBHBBHB', tag_type, len(data) >> 8, len(data) & 0xff, (timestamp >> 8) & 0xffff,
+                         timestamp & 0xff, timestamp >> 24, 0, 0)
+    return header + data + struct.pack('>I', len(header) + len(data))
+
+
+def make_flv(seconds: int, metadata: dict=None, start: int=0) -> bytes:
+    """25 fps h264 video and 44.1 kHz stereo aac audio tags of 500 bytes, each second"""
+    data = [b'FLV\x01\x05\x00\x00\x00\x09', struct.pack('>I', 0)]
+    if metadata is not None:
+        data.append(make_tag(flv.TAG_SCRIPT, 0, amf_value('onMetaData') + struct.pack(
+            '>BI', flv.AMF_ECMA_ARRAY, len(metadata)) + amf_properties(metadata)))
+    for i in range(seconds * 25):
+        timestamp = start + i * 40
+        data.append(make_tag(flv.TAG_VIDEO, timestamp, bytes((0x17 if i % 25 == 0 else 0x27, )) + bytes(499)))
+        data.append(make_tag(flv.TAG_AUDIO, timestamp + 20, b'\xaf' + bytes(499)))
+    return b''.join(data)
+
+
+METADATA = {
+    'duration': 120.5, 'width': 1280.0, 'height': 720.0, 'framerate': 25.0, 'videodatarate': 1500.0,
+    'audiodatarate': 128.0, 'stereo': True, 'encoder': 'Lavf58.29.100',
+    'keyframes': {'times': [0.0, 1.0, 2.0], 'filepositions': [400.0, 26000.0, 51600.0]},
+}
+
+
+class FLVTest(unittest.TestCase):
+
+    def test_amf0(self):
+        value = {'a': 1.0, 'b': [True, 'x'], 'c': {'d': 2.0}}
+        self.assertEqual(flv.decode_amf0(memoryview(amf_value('onMetaData') + amf_value(value))), ['onMetaData', value])
+        with self.assertRaises(Exception):
+            flv.decode_amf0(memoryview(b'\x0a\xff\xff\xff\xff'))
+
+    def test_metadata(self):
+        info = flv.parse(BytesVideoReader(make_flv(3, METADATA)))
+        self.assertEqual((info['duration'], info['duration_source']), (120.5, 'metadata'))
+        self.assertEqual((info['width'], info['height'], info['frame_rate']), (1280.0, 720.0, 25.0))
+        self.assertEqual((info['video_data_rate'], info['audio_data_rate']), (1500.0, 128.0))
+        self.assertEqual(info['keyframes'], {'times': [0.0, 1.0, 2.0], 'filepositions': [400, 26000, 51600]})
+        self.assertEqual(info['metadata']['encoder'], 'Lavf58.29.100')
+        self.assertNotIn('keyframes', info['metadata'])
+        self.assertEqual((info['video_codec'], info['audio_codec'], info['audio_sample_rate'], info['stereo']),
+                         ('h264', 'aac', 44100, True))
+        self.assertTrue(info['has_audio'] and info['has_video'])
+
+    def test_tail_duration(self):
+        info = flv.parse(BytesVideoReader(make_flv(3)))
+        self.assertEqual((info['duration'], info['duration_source']), (2.98, 'tail'))
+        self.assertIsNone(info['keyframes'])
+        self.assertEqual(info['video_codec'], 'h264')
+        metadata = dict(METADATA, duration=0.0)
+        info = flv.parse(BytesVideoReader(make_flv(3, metadata, start=5000)))
+        self.assertEqual((info['duration'], info['duration_source']), (2.98, 'tail'))
+
+    def test_truncated_tail(self):
+        data = make_flv(3)
+        info = flv.parse(BytesVideoReader(data[:-300]))
+        self.assertEqual((info['duration'], info['duration_source']), (2.96, 'tail'))  # the last whole tag is video
+
+    def test_constant_reads(self):
+        for metadata in (METADATA, None):
+            short, long = CountingBytesReader(make_flv(2, metadata)), CountingBytesReader(make_flv(200, metadata))
+            self.assertEqual(flv.parse(short)['duration_source'], flv.parse(long)['duration_source'])
+            self.assertEqual(short.calls, long.calls)
+
+    def test_not_flv(self):
+        with self.assertRaises(Exception):
+            flv.parse(BytesVideoReader(b'RIFF\x00\x00\x00\x00AVI '))
+        with self.assertRaises(EOF):  # not a bare struct.error
+            flv.parse(BytesVideoReader(b'FLV\x01\x05'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from parsers import mp4
+from src.incremental_probe import IncrementalProbe
+from src.input import MmapFileVideoReader
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+
+AVI_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.avi')
+MOV_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.mov')
+
+
+def iter_chunks(loc: str, chunk_length: int, head_chunk_length: int=None):
+    """Chunks of chunk_length, the first 256 bytes in chunks of head_chunk_length if given"""
+    with open(loc, 'rb') as f:
+        if head_chunk_length:
+            for _ in range(0, 256, head_chunk_length):
+                yield f.read(head_chunk_length)
+        while True:
+            chunk = f.read(chunk_length)
+            if not chunk:
+                return
+            yield chunk
+
+
+class IncrementalProbeTest(unittest.TestCase):
+
+    def test_mov(self):
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            expected = mp4.parse(reader)
+        for chunk_length, head_chunk_length in ((997, 1), (4096, 7), (1 << 22, None)):
+            p = IncrementalProbe()
+            max_kept_bytes = 0
+            for chunk in iter_chunks(MOV_TEST_VIDEO_LOC, chunk_length, head_chunk_length):
+                done = p.feed(chunk)
+                max_kept_bytes = max(max_kept_bytes, p.kept_bytes)
+                if p.bytes_received >= 12:
+                    self.assertEqual(p.video_type, 'mov')
+                if done:
+                    break
+                self.assertIsNone(p.result['info'] if p.result else None)
+            self.assertEqual(p.result, {'type': 'mov', 'info': expected})
+            self.assertEqual(p.bytes_received, os.path.getsize(MOV_TEST_VIDEO_LOC))  # moov is the last box
+            self.assertLessEqual(max_kept_bytes, 20 + 34538)  # ftyp and moov, mdat is dropped
+            self.assertEqual(p.kept_bytes, 0)
+
+    def test_type_only(self):
+        p = IncrementalProbe()
+        self.assertFalse(p.feed(b'RIFF'))
+        self.assertIsNone(p.result)
+        chunks = iter_chunks(AVI_TEST_VIDEO_LOC, 64)
+        p = IncrementalProbe()
+        self.assertTrue(p.feed(next(chunks)))
+        self.assertEqual(p.result, {'type': 'avi', 'info': None})
+        with self.assertRaises(Exception):
+            IncrementalProbe().feed(bytes(256))
+
+    def test_limits(self):
+        with self.assertRaises(Exception):
+            p = IncrementalProbe(max_header_bytes=1024)
+            for chunk in iter_chunks(MOV_TEST_VIDEO_LOC, 65536):
+                p.feed(chunk)
+        # a moov extending to the end of stream is complete at close
+        data = b''.join(iter_chunks(MOV_TEST_VIDEO_LOC, 1 << 22))
+        moov_start = 2212662
+        with IncrementalProbe() as p:
+            p.feed(data[:moov_start] + bytes(4) + data[moov_start + 4:])
+            self.assertIsNone(p.result['info'])
+        self.assertEqual(p.result['info']['moov'][0]['mvhd_box']['time_scale'], 1000)
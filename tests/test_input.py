@@ -1,16 +1,72 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-from src.input import FileVideoReader, RemoteFileReader
+from parsers import mp4
+from src.input import FileVideoReader, MmapFileVideoReader, RemoteFileReader, configure_session, get_session, \
+    reserve_session_pool
 
 CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
 
 MP4_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.mp4')
+MOV_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.mov')
 MP4_TEST_VIDEO_URL = 'https://sample-videos.com/video123/mp4/480/big_buck_bunny_480p_10mb.mp4'
 
 
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serve MOV_TEST_VIDEO_LOC, honour 'Range' unless server.support_range is False"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        with open(MOV_TEST_VIDEO_LOC, 'rb') as f:
+            data = f.read()
+        self.server.requests.append(self.headers.get('Range'))
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+        if match is None or not self.server.support_range:
+            self.send_response(200)
+            body = data
+        else:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            end = min(end, len(data) - 1)
+            body = data[start: end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(ThreadingHTTPServer):
+
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+def start_local_server(support_range=True):
+    server = LocalServer(('127.0.0.1', 0), RangeRequestHandler)
+    server.support_range = support_range
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/test_video.mov'.format(server.server_address[1])
+
+
 # noinspection PyMethodMayBeStatic
 class InputUnitTest(unittest.TestCase):
 
@@ -46,6 +102,151 @@ class InputUnitTest(unittest.TestCase):
             self.assertEqual(file_reader.read(2), b'\x00\x00')
             file_reader.refresh()
 
+    def test_file_video_reader_seek(self):
+        with FileVideoReader(MOV_TEST_VIDEO_LOC) as file_reader:
+            self.assertEqual(file_reader.read(8), b'\x00\x00\x00\x14ftyp')
+            self.assertEqual(file_reader.tell(), 8)
+            file_reader.seek(28)
+            self.assertEqual(file_reader.read(8), b'\x00\x21\xc3\x1amdat')
+            file_reader.skip(0x21c31a - 8)  # jump over mdat
+            self.assertEqual(file_reader.read(8)[4:], b'moov')
+            file_reader.seek(4)
+            self.assertEqual(file_reader.read(4), b'ftyp')
+            file_reader.seek(-4, os.SEEK_END)
+            self.assertEqual(file_reader.tell(), file_reader.total_bytes - 4)
+            self.assertEqual(len(file_reader.read(-1)), 4)
+            self.assertEqual(file_reader.read(4), b'')
+
+    def test_file_video_reader_skip_does_not_read(self):
+        with FileVideoReader(MOV_TEST_VIDEO_LOC, max_buffer_length=16, page_length=16) as file_reader:
+            read_bytes = []
+            stream_read = file_reader.stream.read
+            file_reader.stream.read = lambda *args: read_bytes.append(args) or stream_read(*args)
+            file_reader.seek(28 + 0x21c31a)
+            self.assertEqual(file_reader.read(8)[4:], b'moov')
+            file_reader.refresh()
+            self.assertEqual(file_reader.read(4), b'\x00\x00\x00\x14')
+            self.assertEqual(read_bytes, [(16, ), (16, )])  # one page of moov and one page of head
+
+    def test_file_video_reader_page_cache(self):
+        with FileVideoReader(MOV_TEST_VIDEO_LOC, max_buffer_length=32, page_length=16) as file_reader:
+            read_bytes = []
+            stream_read = file_reader.stream.read
+            file_reader.stream.read = lambda *args: read_bytes.append(args) or stream_read(*args)
+            self.assertEqual(file_reader.read(20), b'\x00\x00\x00\x14ftypqt  \x00\x00\x02\x00qt  ')
+            file_reader.refresh()
+            self.assertEqual(file_reader.read(8), b'\x00\x00\x00\x14ftyp')
+            self.assertEqual(read_bytes, [(32, )])  # two pages at once, re-read from cache
+            file_reader.seek(40)
+            file_reader.read(4)  # page 2 evicts page 1, the least recently used one
+            file_reader.refresh()
+            file_reader.read(4)
+            self.assertEqual(read_bytes, [(32, ), (16, )])
+            file_reader.seek(16)
+            file_reader.read(4)
+            self.assertEqual(read_bytes, [(32, ), (16, ), (16, )])
+            self.assertLessEqual(file_reader._cache.cached_bytes, 32)
+
+    def test_file_video_reader_prefetch_within_cache(self):
+        stream_bytes = []
+        for max_buffer_length in (16384, 1 << 20):  # smaller and larger than the 34538 bytes moov
+            with FileVideoReader(MOV_TEST_VIDEO_LOC, max_buffer_length=max_buffer_length, page_length=4096) as reader:
+                read_bytes = []
+                stream_read = reader.stream.read
+
+                def counting_read(*args):
+                    data = stream_read(*args)
+                    read_bytes.append(len(data))
+                    return data
+
+                reader.stream.read = counting_read
+                mp4.parse(reader)
+                stream_bytes.append(sum(read_bytes))
+        # a moov larger than the cache is not prefetched, its pages would be evicted and read twice
+        self.assertEqual(stream_bytes, [39456, 39456])
+
+    def test_mmap_file_video_reader(self):
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as file_reader:
+            self.assertEqual(file_reader.read_int(4), 0x14)
+            self.assertEqual(file_reader.read_str(4), 'ftyp')
+            self.assertEqual(bytes(file_reader.read_view(4)), b'qt  ')
+            file_reader.refresh()
+            self.assertEqual(file_reader.read(8), b'\x00\x00\x00\x14ftyp')
+            file_reader.skip(20)
+            self.assertEqual(file_reader.read(8), b'\x00\x21\xc3\x1amdat')
+            file_reader.seek(-2, os.SEEK_END)
+            self.assertEqual(len(file_reader.read(10)), 2)
+            self.assertEqual(file_reader.tell(), file_reader.total_bytes)
+            self.assertEqual(file_reader.read(-1), b'')
+
+    def test_remote_video_reader_range(self):
+        server, url = start_local_server()
+        try:
+            with RemoteFileReader(url, block_length=1024) as file_reader:
+                self.assertEqual(file_reader.total_bytes, os.path.getsize(MOV_TEST_VIDEO_LOC))
+                self.assertEqual(file_reader.read(8), b'\x00\x00\x00\x14ftyp')
+                file_reader.seek(28 + 0x21c31a)
+                self.assertEqual(file_reader.read(8)[4:], b'moov')
+                file_reader.refresh()
+                self.assertEqual(file_reader.read(4), b'\x00\x00\x00\x14')
+                file_reader.seek(-2, os.SEEK_END)
+                self.assertEqual(len(file_reader.read(10)), 2)
+            # the head is fetched once: refresh is served by the page cache
+            self.assertEqual(server.requests, ['bytes=0-1023', 'bytes=2211840-2212863', 'bytes=2246656-2247679'])
+        finally:
+            server.shutdown()
+
+    def test_remote_video_reader_prefetch(self):
+        server, url = start_local_server()
+        try:
+            with RemoteFileReader(url, block_length=1024) as file_reader:
+                file_reader.prefetch(2212662, 2247200)  # moov
+                file_reader.seek(2212662)
+                for _ in range(100):
+                    file_reader.read(300)
+            self.assertEqual(server.requests, ['bytes=0-1023', 'bytes=2211840-2247679'])
+        finally:
+            server.shutdown()
+
+    def test_remote_video_reader_session_reuse(self):
+        server, url = start_local_server()
+        session = configure_session(pool_maxsize=2)
+        try:
+            for _ in range(5):
+                with RemoteFileReader(url, block_length=1024) as file_reader:
+                    file_reader.seek(28 + 0x21c31a)
+                    self.assertEqual(file_reader.read(8)[4:], b'moov')
+                with RemoteFileReader(url, block_length=1024, session=session) as file_reader:
+                    self.assertEqual(file_reader.read(4), b'\x00\x00\x00\x14')
+            self.assertEqual(len(server.requests), 15)
+            self.assertEqual(server.connections, 1)
+        finally:
+            server.shutdown()
+
+    def test_reserve_session_pool(self):
+        session = configure_session(pool_maxsize=2)
+        try:
+            reserve_session_pool(1)
+            self.assertIs(get_session(), session)
+            reserve_session_pool(16)  # one connection per worker
+            self.assertIsNot(get_session(), session)
+            pool_kw = get_session().get_adapter('http://localhost/').poolmanager.connection_pool_kw
+            self.assertEqual(pool_kw['maxsize'], 16)
+        finally:
+            configure_session()
+
+    def test_remote_video_reader_range_not_supported(self):
+        server, url = start_local_server(support_range=False)
+        try:
+            with RemoteFileReader(url) as file_reader:
+                self.assertEqual(file_reader.total_bytes, os.path.getsize(MOV_TEST_VIDEO_LOC))
+                file_reader.seek(28 + 0x21c31a)
+                self.assertEqual(file_reader.read(8)[4:], b'moov')
+                file_reader.refresh()
+                self.assertEqual(file_reader.read(8), b'\x00\x00\x00\x14ftyp')
+        finally:
+            server.shutdown()
+
     def test_remote_video_reader_read(self):
         with RemoteFileReader(MP4_TEST_VIDEO_URL) as file_reader:
             self.assertEqual(file_reader.read(), b'\x00')
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import struct
+import time
+import unittest
+
+from excptions import ProbeLimitExceeded  # the class raised by the parsers
+from limits import ProbeBudget, ProbeLimits, parse_limits
+from parsers import mp4
+from src.input import BytesVideoReader
+from src.probe import probe
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+
+MOV_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.mov')
+
+FUZZ_SEED = 20201119
+FUZZ_CASES = 300
+
+
+def make_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def make_full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return make_box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+
+def budget_reader(data: bytes, **limits) -> BytesVideoReader:
+    reader = BytesVideoReader(data)
+    reader.budget = ProbeBudget(ProbeLimits(**limits))
+    return reader
+
+
+def header_only_movie() -> bytes:
+    """ftyp and moov of the test video, mdat dropped"""
+    with open(MOV_TEST_VIDEO_LOC, 'rb') as f:
+        data = f.read()
+    return data[:20] + data[2212662:]
+
+
+def mutate(data: bytes, rand: random.Random) -> bytes:
+    """Flip bytes, or overwrite a box size or a table count with a nasty value"""
+    data = bytearray(data)
+    for _ in range(rand.randint(1, 4)):
+        position = rand.randrange(0, len(data) - 4)
+        if rand.random() < 0.5:
+            data[position] = rand.randrange(256)
+        else:
+            value = rand.choice((0, 1, 4, 7, 8, 0x7fffffff, 0xffffffff, rand.randrange(1 << 32)))
+            data[position: position + 4] = struct.pack('>I', value)
+    return bytes(data)
+
+
+def run_parsers(data: bytes) -> ProbeBudget:
+    """Everything the box engine does with a file, under the default limits"""
+    budget = ProbeBudget(ProbeLimits(max_seconds=5))
+    for work in (mp4.parse, lambda r: list(mp4.iter_box_events(r)), mp4.scan_layout,
+                 lambda r: mp4.query(r, ['duration', 'video.frame_rate', 'tracks[*].codec', 'fragment_count'])):
+        reader = BytesVideoReader(data)
+        reader.budget = budget
+        try:
+            work(reader)
+        except ProbeLimitExceeded:
+            raise
+        except Exception:  # noqa, broken files may fail, but not hang or blow up
+            pass
+    return budget
+
+
+class LimitsTest(unittest.TestCase):
+
+    def test_parse_limits(self):
+        limits = parse_limits('boxes=10, seconds=0.5')
+        self.assertEqual((limits.max_boxes, limits.max_seconds, limits.max_depth), (10, 0.5, 32))
+        with self.assertRaises(Exception):
+            parse_limits('boxes=10,files=1')
+
+    def test_probe_limits(self):
+        with self.assertRaises(ProbeLimitExceeded) as context:
+            probe(MOV_TEST_VIDEO_LOC, limits=ProbeLimits(max_boxes=10))
+        self.assertEqual(context.exception.json(), {'limit': 'boxes', 'value': 11, 'maximum': 10})
+        with self.assertRaises(ProbeLimitExceeded) as context:
+            probe(MOV_TEST_VIDEO_LOC, limits=ProbeLimits(max_bytes=4096))
+        self.assertEqual(context.exception.limit, 'bytes')
+        with self.assertRaises(ProbeLimitExceeded) as context:
+            probe(MOV_TEST_VIDEO_LOC, limits=ProbeLimits(max_seconds=0))
+        self.assertEqual(context.exception.limit, 'seconds')
+        self.assertEqual(probe(MOV_TEST_VIDEO_LOC)['type'], 'mov')  # the default limits are far
+
+    def test_crafted(self):
+        ftyp = make_box(b'ftyp', b'isom' + bytes(4))
+        # a size smaller than the header used to move backward for ever
+        with self.assertRaises(Exception):
+            mp4.parse(budget_reader(ftyp + struct.pack('>I4s', 4, b'free') + bytes(64)))
+        # size 0: the last box
+        self.assertEqual(mp4.parse(budget_reader(ftyp + struct.pack('>I4s', 0, b'free') + bytes(64)))['moov'], [])
+        # nesting
+        nested = bytes(0)
+        for _ in range(1000):
+            nested = make_box(b'moov', nested)
+        with self.assertRaises(ProbeLimitExceeded) as context:
+            list(mp4.iter_box_events(budget_reader(nested)))
+        self.assertEqual(context.exception.limit, 'depth')
+        # box count
+        with self.assertRaises(ProbeLimitExceeded) as context:
+            mp4.parse(budget_reader(ftyp + make_box(b'free', b'') * 100000, max_boxes=1000))
+        self.assertEqual(context.exception.limit, 'boxes')
+        # table entries
+        stsd = make_full_box(b'stsd', 0, 0, struct.pack('>I', 0xffffffff))
+        with self.assertRaises(ProbeLimitExceeded) as context:
+            mp4.STSDBox(budget_reader(stsd))
+        self.assertEqual(context.exception.json(), {'limit': 'entries', 'value': 0xffffffff, 'maximum': 1 << 24})
+        # stts claiming 4G samples of 4G ticks each, stsz has 2
+        stbl = make_box(b'stbl', b''.join((
+            make_full_box(b'stts', 0, 0, struct.pack('>III', 1, 0xffffffff, 0xffffffff)),
+            make_full_box(b'stsz', 0, 0, struct.pack('>IIII', 0, 2, 10, 10)),
+        )))
+        start = time.monotonic()
+        statistics = mp4.STBLBox(budget_reader(stbl)).statistics(1)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(statistics['sample_count'], 2)
+
+    def test_fuzz(self):
+        data = header_only_movie()
+        rand = random.Random(FUZZ_SEED)
+        worst = {'boxes': 0, 'bytes': 0, 'depth': 0, 'entries': 0}
+        worst_seconds = 0
+        for _ in range(FUZZ_CASES):
+            start = time.monotonic()
+            work = run_parsers(mutate(data, rand)).json()
+            worst_seconds = max(worst_seconds, time.monotonic() - start)
+            worst = {key: max(worst[key], work[key]) for key in worst}
+        # the work per input is bounded by the input, not by the sizes and counts it claims
+        self.assertLess(worst['bytes'], 16 * len(data))
+        self.assertLess(worst['boxes'], len(data) // 8 * 4)
+        self.assertLessEqual(worst['depth'], 32)
+        self.assertLess(worst_seconds, 2)
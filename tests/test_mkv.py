@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import unittest
+
+from parsers import mkv
+from src.input import BytesVideoReader
+from tests.utils import CountingBytesReader
+
+
+def encode_id(element_id: int) -> bytes:
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, byteorder='big')
+
+
+def encode_size(size: int, length: int=0) -> bytes:
+    length = length or next(n for n in range(1, 9) if size < (1 << (7 * n)) - 1)
+    return ((1 << (7 * length)) | size).to_bytes(length, byteorder='big')
+
+
+def make_element(element_id: int, payload: bytes, size_length: int=0) -> bytes:
+    return encode_id(element_id) + encode_size(len(payload), size_length) + payload
+
+
+def make_uint(element_id: int, value: int) -> bytes:
+    return make_element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), byteorder='big'))
+
+
+def make_mkv(cluster_count: int, seek_head: bool=True, cue_count: int=0, unknown_cluster: bool=False) -> bytes:
+    """A Segment of Info, Tracks (video 1280x720 25 fps, audio 48 kHz stereo), Clusters and Cues"""
+    ebml = make_element(mkv.EBML_ID, make_element(0x4282, b'webm') + make_uint(0x4287, 4))
+    info = make_element(mkv.INFO_ID, b''.join((
+        make_uint(0x2AD7B1, 1000000),
+        make_element(0x4489, struct.pack('>d', 12345.0)),
+        make_element(0x4D80, b'libebml'),
+        make_element(0x5741, 'writer é'.encode('utf8')),
+    )))
+    tracks = make_element(mkv.TRACKS_ID, b''.join((
+        make_element(0xAE, b''.join((
+            make_uint(0xD7, 1), make_uint(0x73C5, 111), make_uint(0x83, 1), make_element(0x86, b'V_VP9'),
+            make_uint(0x23E383, 40000000),
+            make_element(0xE0, make_uint(0xB0, 1280) + make_uint(0xBA, 720)),
+        ))),
+        make_element(0xAE, b''.join((
+            make_uint(0xD7, 2), make_uint(0x83, 2), make_element(0x86, b'A_OPUS'), make_element(0x22B59C, b'jpn'),
+            make_element(0xE1, make_element(0xB5, struct.pack('>f', 48000.0)) + make_uint(0x9F, 2)),
+        ))),
+    )))
+    clusters = b''.join(make_element(
+        mkv.CLUSTER_ID, make_element(0xE7, (i * 1000).to_bytes(4, 'big')) + make_element(0xA3, bytes(4000)), 8)
+        for i in range(cluster_count))
+    if unknown_cluster:
+        clusters += mkv.CLUSTER_ID.to_bytes(4, byteorder='big') + b'\x01\xff\xff\xff\xff\xff\xff\xff' + bytes(100)
+
+    def build(head_size: int) -> (bytes, bytes):
+        cluster_start = head_size + len(info) + len(tracks)
+        cluster_size = len(clusters) // max(1, cluster_count)
+        cues = make_element(mkv.CUES_ID, b''.join(
+            make_element(0xBB, make_uint(0xB3, i * 1000) + make_element(
+                0xB7, make_uint(0xF7, 1) + make_uint(0xF1, cluster_start + i * cluster_size)))
+            for i in range(cue_count))) if cue_count else b''
+        body = info + tracks + clusters + cues
+        if not seek_head:
+            return b'', body
+        seeks = [(mkv.INFO_ID, head_size), (mkv.TRACKS_ID, head_size + len(info))]
+        if cues:
+            seeks.append((mkv.CUES_ID, head_size + len(info) + len(tracks) + len(clusters)))
+        head = make_element(mkv.SEEK_HEAD_ID, b''.join(
+            make_element(0x4DBB, make_element(0x53AB, encode_id(i)) + make_element(0x53AC, p.to_bytes(8, 'big')))
+            for i, p in seeks))
+        return head, body
+
+    head, _ = build(0)
+    head, body = build(len(head))
+    segment_payload = head + body
+    return ebml + make_element(mkv.SEGMENT_ID, segment_payload, 8)
+
+
+class MKVTest(unittest.TestCase):
+
+    def test_vint(self):
+        self.assertEqual(mkv.read_vint(memoryview(b'\x1A\x45\xDF\xA3'), 0, True), (0x1A45DFA3, 4))
+        self.assertEqual(mkv.read_vint(memoryview(b'\x81'), 0, False), (1, 1))
+        self.assertEqual(mkv.read_vint(memoryview(b'\x40\x02'), 0, False), (2, 2))
+        self.assertEqual(mkv.read_vint(memoryview(b'\xff'), 0, False), (mkv.UNKNOWN_SIZE, 1))
+        self.assertEqual(mkv.read_vint(memoryview(b'\x01\xff\xff\xff\xff\xff\xff\xff'), 0, False),
+                         (mkv.UNKNOWN_SIZE, 8))
+        with self.assertRaises(Exception):
+            mkv.read_vint(memoryview(b'\x00'), 0, False)
+
+    def test_parse(self):
+        info = mkv.parse(BytesVideoReader(make_mkv(3)))
+        self.assertEqual(info['ebml'], {'doc_type': 'webm', 'doc_type_version': 4})
+        self.assertEqual(info['info']['timecode_scale'], 1000000)
+        self.assertEqual(info['info']['duration'], 12.345)
+        self.assertEqual(info['info']['muxing_app'], 'libebml')
+        self.assertEqual(info['info']['writing_app'], 'writer é')
+        video, audio = info['tracks']
+        self.assertEqual((video['number'], video['uid'], video['type'], video['codec_id']), (1, 111, 'video', 'V_VP9'))
+        self.assertEqual((video['width'], video['height'], video['frame_rate']), (1280, 720, 25.0))
+        self.assertEqual((video['display_width'], video['display_height']), (1280, 720))
+        self.assertEqual((audio['number'], audio['type'], audio['codec_id']), (2, 'audio', 'A_OPUS'))
+        self.assertEqual((audio['sampling_frequency'], audio['channels'], audio['language']), (48000.0, 2, 'jpn'))
+        self.assertEqual(video['language'], 'eng')
+        self.assertNotIn('cues', info)
+
+    def test_clusters_are_skipped(self):
+        small, large = CountingBytesReader(make_mkv(2)), CountingBytesReader(make_mkv(2000))
+        self.assertEqual(mkv.parse(small), mkv.parse(large))
+        self.assertEqual(small.calls, large.calls)
+        self.assertEqual(small.bytes_read, large.bytes_read)
+        self.assertLess(large.bytes_read, 1024)
+
+    def test_without_seek_head(self):
+        self.assertEqual(mkv.parse(BytesVideoReader(make_mkv(3, seek_head=False))),
+                         mkv.parse(BytesVideoReader(make_mkv(3))))
+        reader = CountingBytesReader(make_mkv(2000, seek_head=False))
+        mkv.parse(reader)  # Info and Tracks come before the Clusters, the walk stops there
+        self.assertLess(reader.calls, 10)
+
+    def test_cues(self):
+        data = make_mkv(10, cue_count=5)
+        info = mkv.parse(BytesVideoReader(data), cues=True)
+        self.assertEqual(info['cues']['count'], 5)
+        self.assertEqual(info['cues']['times'], [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(info['cues']['tracks'], [1] * 5)
+        for position in info['cues']['cluster_positions']:
+            reader = BytesVideoReader(data)
+            reader.seek(position)
+            self.assertEqual(mkv.read_element_header(reader)[0], mkv.CLUSTER_ID)
+        reader = CountingBytesReader(make_mkv(2000, seek_head=False, cue_count=5))
+        self.assertEqual(mkv.parse(reader, cues=True)['cues']['count'], 5)
+        self.assertLess(reader.bytes_read, 2000 * 64)  # cluster headers only
+
+    def test_unknown_size_cluster(self):
+        info = mkv.parse(BytesVideoReader(make_mkv(3, seek_head=False, unknown_cluster=True)), cues=True)
+        self.assertEqual(len(info['tracks']), 2)
+        self.assertEqual(info['cues']['count'], 0)
+
+    def test_not_ebml(self):
+        with self.assertRaises(Exception):
+            mkv.parse(BytesVideoReader(b'\x00\x00\x00\x08free'))
+
+
+if __name__ == '__main__':
+    unittest.main()
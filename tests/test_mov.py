@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import unittest
+
+from parsers import mov, mp4
+from src.input import BytesVideoReader, MmapFileVideoReader
+from src.probe import probe
+from src.type_checker import VideoTypeEnum, match_video_type
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+
+MOV_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.mov')
+
+
+def make_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def make_full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return make_box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+
+def make_timecode_movie(frame_number: int) -> bytes:
+    """Old QuickTime (no ftyp): wide, mdat holding the timecode sample, moov with a tmcd track"""
+    mdat_offset = 8
+    head = make_box(b'wide', b'') + make_box(b'mdat', struct.pack('>i', frame_number))
+    tmcd_entry = struct.pack('>I4s6xH', 34, b'tmcd', 1) + struct.pack('>4xIIIBx', 1, 30000, 1001, 30)
+    stbl = make_box(b'stbl', b''.join((
+        make_full_box(b'stsd', 0, 0, struct.pack('>I', 1) + tmcd_entry),
+        make_full_box(b'stco', 0, 0, struct.pack('>II', 1, mdat_offset + 8)),
+    )))
+    mdia = make_box(b'mdia', b''.join((
+        make_full_box(b'mdhd', 0, 0, struct.pack('>IIIIH2x', 0, 0, 30000, 0, 0)),
+        make_full_box(b'hdlr', 0, 0, struct.pack('>4s4s12x', b'mhlr', b'tmcd') + b'\x0fTimeCodeHandler'),
+        make_box(b'minf', stbl),
+    )))
+    tapt = make_box(b'tapt', b''.join(
+        make_full_box(box_type, 0, 0, struct.pack('>II', width << 16, 1080 << 16))
+        for box_type, width in ((b'clef', 1888), (b'prof', 1920), (b'enof', 1920))))
+    trak = make_box(b'trak', b''.join((
+        make_full_box(b'tkhd', 0, 3, struct.pack('>III4xI8xhhh2x36xII', 0, 0, 3, 0, 0, 0, 0, 0, 0)),
+        tapt, mdia)))
+    mvhd = make_full_box(b'mvhd', 0, 0, struct.pack('>IIIIih', 0, 0, 600, 6000, 0x00010000, 0x0100) + bytes(70))
+    return head + make_box(b'moov', mvhd + trak)
+
+
+class MOVTest(unittest.TestCase):
+
+    def test_parse(self):
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            info = mov.parse(reader)
+        self.assertEqual(info['ftyp']['major_brand'], 'qt  ')
+        moov = info['moov'][0]
+        self.assertEqual(moov['udta_box']['items'], {'\xa9swr': 'Lavf57.19.100'})
+        hdlr_box = moov['track_box_list'][0]['media_box']['hdlr_box']
+        self.assertEqual((hdlr_box['component_type'], hdlr_box['name']), ('mhlr', 'VideoHandler'))
+        result = probe(MOV_TEST_VIDEO_LOC, fields=['duration', 'user_data', 'video.width', 'audio.sample_rate'])
+        self.assertEqual(result['type'], 'mov')
+        self.assertEqual(result['info'], {'duration': 30.571, 'user_data': {'\xa9swr': 'Lavf57.19.100'},
+                                          'video.width': 1920.0, 'audio.sample_rate': 48000.0})
+
+    def test_timecode_track(self):
+        data = make_timecode_movie(107892)  # one hour at 29.97 drop frame
+        self.assertEqual(match_video_type(data[:128]), VideoTypeEnum.MOV)
+        info = mov.parse(BytesVideoReader(data))
+        self.assertIsNone(info['ftyp'])
+        track = info['moov'][0]['track_box_list'][0]
+        self.assertEqual(track['timecode'], '01:00:00;00')
+        self.assertEqual(track['tapt_box']['clef_box']['width'], 1888.0)
+        entry = track['media_box']['minf_box']['stbl_box']['stsd_box']['sample_descriptions'][0]
+        self.assertEqual((entry['drop_frame'], entry['number_of_frames']), (True, 30))
+        self.assertEqual(mov.query(BytesVideoReader(data), [
+            'timecode.timecode', 'tracks[0].clean_aperture', 'tracks[0].encoded_pixels', 'duration']), {
+            'timecode.timecode': '01:00:00;00', 'tracks[0].clean_aperture': [1888.0, 1080.0],
+            'tracks[0].encoded_pixels': [1920.0, 1080.0], 'duration': 10.0})
+
+    def test_timecode_string(self):
+        self.assertEqual(mp4.timecode_string(1799, 30, True), '00:00:59;29')
+        self.assertEqual(mp4.timecode_string(1800, 30, True), '00:01:00;02')
+        self.assertEqual(mp4.timecode_string(17982, 30, True), '00:10:00;00')
+        self.assertEqual(mp4.timecode_string(90000 + 12, 25, False), '01:00:00:12')
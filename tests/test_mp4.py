@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import sys
+import time
+import unittest
+from array import array
+
+from excptions import ProbeLimitExceeded
+from limits import ProbeBudget, ProbeLimits
+from parsers import mp4
+from src.input import BytesVideoReader, FileVideoReader, MmapFileVideoReader
+from tests.utils import CountingBytesReader, CountingMmapReader
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+
+MOV_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.mov')
+
+
+def make_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def make_full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return make_box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+
+def uint32_table(values) -> bytes:
+    table = array('I', values)
+    if sys.byteorder == 'little':
+        table.byteswap()
+    return struct.pack('>I', len(table)) + table.tobytes()
+
+
+def make_large_stbl(sample_count: int, sync_interval: int=None, samples_per_chunk: int=30) -> bytes:
+    """Samples of 1000 ticks and 100, 200, 300... bytes, a key frame every sync_interval (no stss if None)"""
+    chunk_count = sample_count // samples_per_chunk
+    children = [make_full_box(b'stts', 0, 0, struct.pack('>III', 1, sample_count, 1000))]
+    if sync_interval is not None:
+        children.append(make_full_box(b'stss', 0, 0, uint32_table(range(1, sample_count + 1, sync_interval))))
+    children += [
+        make_full_box(b'stsz', 0, 0, struct.pack('>I', 0) + uint32_table([100, 200, 300] * (sample_count // 3))),
+        make_full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, samples_per_chunk, 1)),
+        make_full_box(b'stco', 0, 0, uint32_table(range(1000, 1000 + chunk_count * 7000, 7000))),
+    ]
+    return make_box(b'stbl', b''.join(children))
+
+
+def make_fragmented(fragment_count: int, mfra: bool=True, tfdt: bool=True, start: int=5000) -> bytes:
+    """One video track (time scale 1000), fragments of 10 samples of 100 (1 s), starting at start"""
+    moov = make_box(b'moov', b''.join((
+        make_full_box(b'mvhd', 0, 0, struct.pack('>IIIIih', 0, 0, 1000, 0, 0x00010000, 0x0100) + bytes(70)),
+        make_box(b'trak', b''.join((
+            make_full_box(b'tkhd', 0, 3, struct.pack('>III4xI8xhhh2x36xII', 0, 0, 1, 0, 0, 0, 0, 640 << 16, 360 << 16)),
+            make_box(b'mdia', b''.join((
+                make_full_box(b'mdhd', 0, 0, struct.pack('>IIIIH2x', 0, 0, 1000, 0, 0x55c4)),
+                make_full_box(b'hdlr', 0, 0, struct.pack('>4x4s12x', b'vide') + b'\0'),
+            ))),
+        ))),
+        make_box(b'mvex', make_full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, 100, 0, 0))),
+    )))
+    data = make_box(b'ftyp', b'iso5' + bytes(4) + b'iso5dash') + moov
+    moof_offsets = []
+    for i in range(fragment_count):
+        moof_offsets.append(len(data))
+        traf = [make_full_box(b'tfhd', 0, 0x020000, struct.pack('>I', 1))]
+        if tfdt:
+            traf.append(make_full_box(b'tfdt', 1, 0, struct.pack('>Q', start + i * 1000)))
+        if i % 2:  # per sample durations and sizes
+            traf.append(make_full_box(b'trun', 0, 0x301, struct.pack('>Ii', 10, 0) + struct.pack('>II', 100, 1) * 10))
+        else:  # durations of trex
+            traf.append(make_full_box(b'trun', 0, 0x200, struct.pack('>I', 10) + struct.pack('>I', 1) * 10))
+        mfhd = make_full_box(b'mfhd', 0, 0, struct.pack('>I', i + 1))
+        data += make_box(b'moof', mfhd + make_box(b'traf', b''.join(traf)))
+        data += make_box(b'mdat', bytes(10))
+    if mfra:
+        entries = b''.join(struct.pack('>QQBBB', start + i * 1000, offset, 1, 1, 1)
+                           for i, offset in enumerate(moof_offsets[::10]))
+        tfra = make_full_box(b'tfra', 1, 0, struct.pack('>III', 1, 0, len(moof_offsets[::10])) + entries)
+        data += make_box(b'mfra', tfra + make_full_box(b'mfro', 0, 0, struct.pack('>I', 8 + len(tfra) + 16)))
+    return data
+
+
+class MP4Test(unittest.TestCase):
+
+    def test_parse(self):
+        with FileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            info = mp4.parse(reader)
+        self.assertEqual(info['ftyp']['major_brand'], 'qt  ')
+        moov = info['moov'][0]
+        self.assertEqual(moov['mvhd_box']['scaled_duration'], 30.571)
+        video, audio = moov['track_box_list']
+        self.assertEqual((video['tkhd_box']['width'], video['tkhd_box']['height']), (1920.0, 1080.0))
+        self.assertEqual(video['media_box']['hdlr_box']['handler_type'], 'vide')
+        self.assertEqual(video['media_box']['mdhd_box']['time_scale'], 15360)
+        entry = video['media_box']['minf_box']['stbl_box']['stsd_box']['sample_descriptions'][0]
+        self.assertEqual((entry['type'], entry['width'], entry['height']), ('avc1', 1920, 1080))
+        self.assertEqual(audio['tkhd_box']['track_id'], 2)
+        self.assertEqual(audio['media_box']['minf_box']['head_box']['box_type'], 'smhd')
+        entry = audio['media_box']['minf_box']['stbl_box']['stsd_box']['sample_descriptions'][0]
+        self.assertEqual(entry['type'], 'mp4a')
+        self.assertEqual(entry['channel_count'], 2)
+
+    def test_parse_read_calls(self):
+        with CountingMmapReader(MOV_TEST_VIDEO_LOC) as reader:
+            mp4.parse(reader)
+        self.assertLess(reader.calls, 64)
+
+    def test_version_1(self):
+        payload = struct.pack('>QQIQih', 1, 2, 90000, 2 ** 33, 0x00010000, 0x0100) + bytes(70)
+        box = make_full_box(b'mvhd', 1, 0, payload)
+        mvhd = mp4.MVHDBox(BytesVideoReader(box))
+        self.assertEqual(mvhd.version, 1)
+        self.assertEqual(mvhd.duration, 2 ** 33)
+        self.assertEqual(mvhd.scaled_duration, round(2 ** 33 / 90000, 3))
+        self.assertEqual(mvhd.suggested_rate, 1.0)
+        self.assertEqual(mvhd.creation_time, mp4.mp4_datetime(1))
+        self.assertFalse(hasattr(mvhd, '__dict__'))
+
+    def test_query(self):
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            info = mp4.parse(reader, fields=[
+                'duration', 'track_count', 'video.width', 'video.codec', 'audio.sample_rate',
+                'tracks[*].handler_type', 'tracks[0].time_scale', 'tracks[5].codec', 'subtitle.codec'])
+        self.assertEqual(info, {
+            'duration': 30.571, 'track_count': 2, 'video.width': 1920.0, 'video.codec': 'avc1',
+            'audio.sample_rate': 48000.0, 'tracks[*].handler_type': ['vide', 'soun'], 'tracks[0].time_scale': 15360,
+            'tracks[5].codec': None, 'subtitle.codec': None,
+        })
+
+    def test_query_duration_stops_after_mvhd(self):
+        with CountingMmapReader(MOV_TEST_VIDEO_LOC) as reader:
+            self.assertEqual(mp4.query(reader, ['duration']), {'duration': 30.571})
+        mvhd_end = 2212670 + 108
+        self.assertEqual(reader.furthest, mvhd_end)
+        self.assertLessEqual(reader.calls, 6)
+
+    def test_lazy_box(self):
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            root = mp4.LazyBox.root(reader)
+            self.assertEqual([child.box_type for child in root.iter_children()], ['ftyp', 'wide', 'mdat', 'moov'])
+            self.assertEqual(root.moov.mvhd.time_scale, 1000)
+            self.assertEqual(root.moov.trak.mdia.hdlr.handler_type, 'vide')
+            self.assertEqual(len(list(root.moov.iter_children('trak'))), 2)
+            self.assertIsNone(root.moov.find('mvex', 'trex'))
+            with self.assertRaises(AttributeError):
+                _ = root.moov.mvhd.not_a_field
+            with self.assertRaises(Exception):
+                mp4.query(reader, ['video.not_a_field'])
+
+    def test_statistics(self):
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            video, audio = mp4.parse(reader)['moov'][0]['track_box_list']
+        self.assertEqual(video['statistics']['sample_count'], 901)
+        self.assertEqual(video['statistics']['frame_rate'], 30.0)
+        self.assertEqual(video['statistics']['keyframe_count'], 4)
+        self.assertEqual(video['statistics']['gop'], {'min': 151, 'max': 250, 'average': 225.25})
+        self.assertGreaterEqual(video['statistics']['peak_bitrate'], video['statistics']['average_bitrate'])
+        self.assertEqual(audio['statistics']['keyframe_count'], 1433)  # no stss, all sync samples
+        self.assertEqual(audio['statistics']['frame_rate'], 46.875)
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            info = mp4.query(reader, ['video.frame_rate', 'video.gop', 'tracks[*].keyframe_count'])
+        self.assertEqual(info['video.frame_rate'], 30.0)
+        self.assertEqual(info['video.gop'], video['statistics']['gop'])
+        self.assertEqual(info['tracks[*].keyframe_count'], [4, 1433])
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            box_size, box_type, offset, _ = mp4.find_first_box_by_type(reader, wanted_box_type='moov')
+            track_box = mp4.MOOVBox(reader, box_meta=mp4.BoxMeta(box_size, box_type, offset)).track_box_list[0]
+        stbl_box = track_box.media_box.minf_box.stbl_box
+        self.assertIsNone(getattr(stbl_box, '_statistics', None))  # computed on first access only
+        self.assertEqual(track_box.statistics['keyframe_count'], 4)
+        self.assertIs(track_box.statistics, stbl_box._statistics)
+
+    def test_sample_tables(self):
+        # 4 samples of 1 / 2 s at time scale 10, key frames 1 and 3
+        stbl = make_box(b'stbl', b''.join((
+            make_full_box(b'stts', 0, 0, struct.pack('>IIIII', 2, 2, 5, 2, 10)),
+            make_full_box(b'stss', 0, 0, struct.pack('>III', 2, 1, 3)),
+            make_full_box(b'stsz', 0, 0, struct.pack('>IIIIII', 0, 4, 10, 20, 30, 40)),
+            make_full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, 4, 1)),
+            make_full_box(b'co64', 0, 0, struct.pack('>IQ', 1, 1 << 33)),
+            make_full_box(b'ctts', 1, 0, struct.pack('>III', 1, 4, 0xfffffffe)),
+        )))
+        box = mp4.STBLBox(BytesVideoReader(stbl))
+        self.assertEqual(list(box.stts_box.sample_deltas), [5, 10])
+        self.assertEqual(list(box.stco_box.chunk_offsets), [1 << 33])
+        self.assertEqual(list(box.ctts_box.sample_offsets), [-2])
+        self.assertEqual(list(box.decoding_times()), [0, 5, 10, 20, 30])
+        statistics = box.statistics(10)
+        self.assertEqual(statistics['duration'], 3.0)
+        self.assertEqual(statistics['average_bitrate'], round(100 * 8 / 3))
+        self.assertEqual(statistics['peak_bitrate'], 40 * 8)  # [2, 3) s: sample 4
+        self.assertEqual(statistics['gop'], {'min': 2, 'max': 2, 'average': 2.0})
+        self.assertEqual(box.json()['stts_box']['entry_count'], 2)
+        self.assertNotIn('sample_deltas', box.json()['stts_box'])
+
+    def test_statistics_of_invalid_sync_samples(self):
+        def statistics(stss: bytes=None) -> dict:
+            # 6 samples of 1 s at time scale 1
+            return mp4.STBLBox(BytesVideoReader(make_box(b'stbl', b''.join((
+                make_full_box(b'stts', 0, 0, struct.pack('>III', 1, 6, 1)),
+                make_full_box(b'stss', 0, 0, stss) if stss is not None else b'',
+                make_full_box(b'stsz', 0, 0, struct.pack('>III', 10, 6, 0)),
+            ))))).statistics(1)
+        # sorted, repeated, 0 and past the last sample entries are ignored: key frames 1, 2 and 3
+        bad = statistics(struct.pack('>7I', 6, 1, 3, 3, 2, 0, 9))
+        self.assertEqual((bad['keyframe_count'], bad['gop']), (3, {'min': 1, 'max': 4, 'average': 2.0}))
+        every = statistics()
+        self.assertEqual((every['keyframe_count'], every['gop'], every['keyframe_interval']),
+                         (6, {'min': 1, 'max': 1, 'average': 1.0}, 1.0))
+
+    def test_sample_count_of_single_size(self):
+        def stbl(sample_count: int, budget: ProbeBudget=None) -> mp4.STBLBox:
+            # 12 bytes of stsz for sample_count samples of 10 bytes
+            reader = BytesVideoReader(make_box(b'stbl', b''.join((
+                make_full_box(b'stts', 0, 0, struct.pack('>III', 1, 6, 1)),
+                make_full_box(b'stsz', 0, 0, struct.pack('>II', 10, sample_count)),
+            ))))
+            reader.budget = budget
+            return mp4.STBLBox(reader)
+        box = stbl(6)
+        self.assertEqual((box.sample_count(), len(box.sample_sizes()), len(box.decoding_times())), (6, 6, 7))
+        self.assertEqual(box.statistics(1)['average_bitrate'], 80)
+        start = time.monotonic()
+        with self.assertRaises(ProbeLimitExceeded) as context:  # nothing allocated
+            stbl(2 ** 32 - 1).statistics(1)
+        self.assertEqual(context.exception.json(), {'limit': 'entries', 'value': 2 ** 32 - 1,
+                                                    'maximum': mp4.MAX_SAMPLE_COUNT})
+        self.assertLess(time.monotonic() - start, 0.1)
+        with self.assertRaises(ProbeLimitExceeded):  # charged on decode with a budget
+            stbl(2 ** 32 - 1, ProbeBudget(ProbeLimits()))
+
+    def test_statistics_of_millions_of_samples(self):
+        for sync_interval in (None, 30):
+            box = mp4.STBLBox(BytesVideoReader(make_large_stbl(3000000, sync_interval)))
+            start = time.monotonic()
+            statistics = box.statistics(30000)
+            self.assertLess(time.monotonic() - start, 1)  # no Python loop over samples, key frames or seconds
+            self.assertEqual((statistics['sample_count'], statistics['frame_rate'], statistics['duration']),
+                             (3000000, 30.0, 100000.0))
+            self.assertEqual(statistics['peak_bitrate'], 30 * 200 * 8)
+            self.assertEqual(statistics['keyframe_count'], 3000000 // (sync_interval or 1))
+            self.assertEqual(statistics['gop']['average'], sync_interval or 1)
+
+    def test_keyframe_index_of_millions_of_samples(self):
+        for sync_interval in (None, 30):
+            box = mp4.STBLBox(BytesVideoReader(make_large_stbl(3000000, sync_interval)))
+            start = time.monotonic()
+            times, offsets, sizes = box.keyframe_index()
+            self.assertLess(time.monotonic() - start, 2)  # no Python loop over samples or key frames
+            self.assertEqual(len(times), 3000000 // (sync_interval or 1))
+            if sync_interval is None:  # samples 0 to 2 of chunk 0, then sample 30 first of chunk 1
+                self.assertEqual((list(times[:3]), list(offsets[:3]), list(sizes[:3])),
+                                 ([0, 1000, 2000], [1000, 1100, 1300], [100, 200, 300]))
+                self.assertEqual((times[30], offsets[30], offsets[-1]), (30000, 8000, 1000 + 99999 * 7000 + 5700))
+            else:
+                self.assertEqual((list(times[:2]), list(offsets[:2]), list(sizes[:2])),
+                                 ([0, 30000], [1000, 8000], [100, 100]))
+
+    def test_fragmented(self):
+        expected = {'fragment_count': 95, 'duration': 95.0, 'random_access_index': True,
+                    'tracks': [{'track_id': 1, 'duration': 95.0}]}
+        info = mp4.parse(BytesVideoReader(make_fragmented(95)))
+        self.assertEqual(info['fragments'], expected)
+        self.assertEqual(info['moov'][0]['mvex_box']['trex_box_list'][0]['default_sample_duration'], 100)
+        # without mfra all the moof boxes are walked, without tfdt durations are summed from 0
+        info = mp4.parse(BytesVideoReader(make_fragmented(95, mfra=False, tfdt=False)))
+        self.assertEqual(info['fragments'], dict(expected, random_access_index=False))
+        # tfdt missing: mfra can not tell the end, fall back to the walk
+        info = mp4.parse(BytesVideoReader(make_fragmented(95, tfdt=False)))
+        self.assertEqual(info['fragments'], expected)
+        info = mp4.query(BytesVideoReader(make_fragmented(95)), ['duration', 'fragment_count', 'video.width'])
+        self.assertEqual(info, {'duration': 95.0, 'fragment_count': 95, 'video.width': 640.0})
+
+    def test_fragmented_tail_first(self):
+        # the first fragment and the ones after the last random access point (every 10th) only
+        data = make_fragmented(2000)
+        with CountingBytesReader(data) as reader:
+            self.assertEqual(mp4.query(reader, ['fragment_count', 'fragment_duration']),
+                             {'fragment_count': 2000, 'fragment_duration': 2000.0})
+        tail_first_calls = reader.calls
+        self.assertLess(tail_first_calls, 400)
+        with CountingBytesReader(make_fragmented(2000, mfra=False)) as reader:
+            mp4.query(reader, ['fragment_count'])
+        self.assertGreater(reader.calls, 50 * tail_first_calls)
+
+    def test_box_events(self):
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            events = list(mp4.iter_box_events(reader))
+        self.assertEqual(len(events), 45)
+        self.assertEqual([(e.depth, e.path, e.offset, e.size) for e in events[:5]], [
+            (0, 'ftyp', 0, 20), (0, 'wide', 20, 8), (0, 'mdat', 28, 2212634), (0, 'moov', 2212662, 34538),
+            (1, 'moov/mvhd', 2212670, 108)])
+        self.assertEqual(events[4].header['time_scale'], 1000)
+        self.assertIsNone(events[3].header)
+        stsz = [e for e in events if e.path == 'moov/trak/mdia/minf/stbl/stsz']
+        self.assertEqual([e.header['sample_count'] for e in stsz], [901, 1433])
+        with CountingMmapReader(MOV_TEST_VIDEO_LOC) as reader:  # stop early, nothing after is read
+            for event in mp4.iter_box_events(reader, decode=False):
+                self.assertIsNone(event.header)
+                if event.type == 'mvhd':
+                    break
+        self.assertEqual(reader.furthest, 2212670 + 8)
+        with MmapFileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            self.assertEqual([e.type for e in mp4.iter_box_events(reader, max_depth=0)],
+                             ['ftyp', 'wide', 'mdat', 'moov'])
+        with self.assertRaises(Exception):
+            list(mp4.iter_box_events(BytesVideoReader(make_box(b'moov', struct.pack('>I4s', 4, b'free')))))
+
+    def test_scan_layout(self):
+        with CountingMmapReader(MOV_TEST_VIDEO_LOC) as reader:
+            layout = mp4.scan_layout(reader)
+        self.assertEqual(layout['boxes'], [
+            {'type': 'ftyp', 'offset': 0, 'size': 20}, {'type': 'wide', 'offset': 20, 'size': 8},
+            {'type': 'mdat', 'offset': 28, 'size': 2212634}, {'type': 'moov', 'offset': 2212662, 'size': 34538}])
+        self.assertFalse(layout['faststart'])
+        self.assertEqual(layout['read_plan'], {'strategy': 'tail', 'ranges': [[0, 20], [2212662, 2247200]]})
+        self.assertEqual(reader.calls, 4)  # one header each
+        faststart = make_box(b'ftyp', b'isom' + bytes(4)) + make_box(b'moov', b'') + make_box(b'mdat', bytes(100))
+        layout = mp4.scan_layout(BytesVideoReader(faststart))
+        self.assertTrue(layout['faststart'])
+        self.assertEqual(layout['read_plan'], {'strategy': 'head', 'ranges': [[0, 24]]})
+        layout = mp4.scan_layout(BytesVideoReader(make_fragmented(30)), max_boxes=10)
+        self.assertTrue(layout['fragmented'] and layout['truncated'])
+        self.assertEqual(len(layout['boxes']), 10)
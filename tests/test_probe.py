@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import unittest
+
+from src.probe import iter_locations, open_reader, probe, probe_many
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+SRC_PATH = os.path.join(os.path.dirname(CURRENT_PATH), 'src')
+
+TEST_VIDEOS_PATH = os.path.join(CURRENT_PATH, 'test_videos')
+AVI_TEST_VIDEO_LOC = os.path.join(TEST_VIDEOS_PATH, 'test_video.avi')
+RM_TEST_VIDEO_LOC = os.path.join(TEST_VIDEOS_PATH, 'test_video.rm')
+RMVB_TEST_VIDEO_LOC = os.path.join(TEST_VIDEOS_PATH, 'test_video.rmvb')
+
+
+class ProbeTest(unittest.TestCase):
+
+    def test_probe(self):
+        result = probe(AVI_TEST_VIDEO_LOC)
+        self.assertEqual(result['location'], AVI_TEST_VIDEO_LOC)
+        self.assertEqual(result['type'], 'avi')
+        self.assertIn('info', result)
+
+    def test_iter_locations(self):
+        locations = list(iter_locations([TEST_VIDEOS_PATH, os.path.join(TEST_VIDEOS_PATH, '*.rm*'), 'http://x/a.mp4']))
+        self.assertEqual(len(locations), len(os.listdir(TEST_VIDEOS_PATH)) + 3)
+        self.assertEqual(locations[-3:], [RM_TEST_VIDEO_LOC, RMVB_TEST_VIDEO_LOC, 'http://x/a.mp4'])
+
+    def test_open_reader(self):
+        with open_reader(AVI_TEST_VIDEO_LOC) as reader:
+            self.assertEqual(reader.read(4), b'RIFF')
+        for loc, message in (('s3:/bucket/a.mp4', 'scheme'), ('ftp://host/a.mp4', 'scheme'), ('ftp:', 'scheme'),
+                             ('not_exist.mp4', 'No such file'), (TEST_VIDEOS_PATH, 'No such file')):
+            with self.assertRaisesRegex(Exception, message):
+                open_reader(loc)
+
+    def test_probe_many(self):
+        locations = [AVI_TEST_VIDEO_LOC, RM_TEST_VIDEO_LOC, 'not_exist.mp4'] * 10
+        results = list(probe_many(iter(locations), workers=3))
+        self.assertEqual(len(results), len(locations))
+        self.assertEqual(sorted(r['location'] for r in results), sorted(locations))
+        errors = [r for r in results if 'error' in r]
+        self.assertEqual(len(errors), 10)
+        self.assertTrue(all(r['location'] == 'not_exist.mp4' for r in errors))
+
+    def test_local_probe_imports(self):
+        code = ('import sys; sys.argv = ["main.py", {!r}, "--json"]; import main; main.main()\n'
+                'print(sorted(m for m in ("requests", "urllib3", "sqlite3", "concurrent.futures", "parsers.mp4") '
+                'if m in sys.modules))').format(AVI_TEST_VIDEO_LOC)
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=SRC_PATH, stdout=subprocess.PIPE, universal_newlines=True, check=True
+        ).stdout
+        self.assertEqual(output.splitlines()[-1], '[]')
+
+    def test_batch_session_pool(self):
+        # -w sizes the pool of the shared session, still created on first remote use only
+        code = ('import sys; sys.argv = ["main.py", {!r}, {!r}, "--jsonl", "-w", "32"]; import main\n'
+                'try:\n    main.main()\nexcept SystemExit:\n    pass\n'
+                'import input; print(input._session_pool_maxsize, input._session, "requests" in sys.modules)'
+                ).format(AVI_TEST_VIDEO_LOC, RM_TEST_VIDEO_LOC)
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=SRC_PATH, stdout=subprocess.PIPE, universal_newlines=True, check=True
+        ).stdout
+        self.assertEqual(output.splitlines()[-1], '32 None False')
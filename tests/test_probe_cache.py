@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.probe import probe
+from src.probe_cache import ProbeCache
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+
+AVI_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.avi')
+
+
+class ProbeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.video_loc = os.path.join(self.tmp_dir, 'video.avi')
+        shutil.copy(AVI_TEST_VIDEO_LOC, self.video_loc)
+        self.cache = ProbeCache(os.path.join(self.tmp_dir, 'cache.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hit_and_stale(self):
+        identity = self.cache.identity(self.video_loc)
+        self.assertIsNone(self.cache.get(self.video_loc, identity))
+        result = probe(self.video_loc, self.cache)
+        self.assertEqual(self.cache.get(self.video_loc, identity), result)
+        self.assertEqual(probe(self.video_loc, self.cache), result)
+
+        st = os.stat(self.video_loc)
+        os.utime(self.video_loc, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(self.cache.identity(self.video_loc), identity)
+        self.assertIsNone(self.cache.get(self.video_loc, self.cache.identity(self.video_loc)))
+
+    def test_persistent(self):
+        result = probe(self.video_loc, self.cache)
+        self.cache.close()
+        self.cache = ProbeCache(os.path.join(self.tmp_dir, 'cache.db'))
+        self.assertEqual(self.cache.get(self.video_loc, self.cache.identity(self.video_loc)), result)
+
+    def test_evict(self):
+        self.cache.max_bytes = 100
+        for i in range(10):
+            self.cache.put('video_{}'.format(i), 'identity', {'info': 'x' * 20})
+        self.assertLessEqual(self.cache.total_bytes, 100)
+        self.assertEqual(len(self.cache), self.cache.total_bytes // len('{"info": "' + 'x' * 20 + '"}'))
+        self.assertIsNotNone(self.cache.get('video_9', 'identity'))
+        self.assertIsNone(self.cache.get('video_0', 'identity'))
+
+    def test_invalidate(self):
+        for i in range(3):
+            self.cache.put('video_{}'.format(i), 'identity', {})
+        self.assertEqual(self.cache.invalidate(['video_0', 'not_cached']), 1)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.invalidate(), 2)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.total_bytes, 0)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import unittest
+
+from parsers import rm, rmvb
+from src.input import BytesVideoReader, FileVideoReader
+from tests.utils import CountingFileReader
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+
+RM_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.rm')
+RMVB_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.rmvb')
+
+
+class RMTest(unittest.TestCase):
+
+    def test_re_export(self):
+        self.assertIs(rm.parse, rmvb.parse)
+        self.assertIs(rm.read_chunk_header, rmvb.read_chunk_header)
+
+    def test_rm(self):
+        with FileVideoReader(RM_TEST_VIDEO_LOC) as reader:
+            info = rm.parse(reader)
+        self.assertEqual(info['duration'], 70.533)
+        prop = info['prop']
+        self.assertEqual((prop['avg_bitrate'], prop['packets_count'], prop['preroll'], prop['streams_count']),
+                         (350106, 2611, 2268, 3))
+        self.assertEqual((prop['data_offset'], prop['index_offset']), (1037, 3058789))
+        self.assertEqual(info['data_offset'], 1037)
+        audio, video = info['streams']
+        self.assertEqual((audio['type'], audio['mime_type'], audio['codec'], audio['sample_rate'], audio['channels']),
+                         ('audio', 'audio/x-pn-realaudio', 'cook', 44100, 1))
+        self.assertEqual((audio['avg_bitrate'], audio['duration']), (32148, 70.541))
+        self.assertEqual((video['type'], video['codec'], video['width'], video['height'], video['frame_rate']),
+                         ('video', 'RV30', 320, 240, 25.0))
+        self.assertEqual(video['duration'], 70.4)
+        self.assertEqual((info['content']['title'], info['content']['copyright']), (None, None))  # not utf8
+        self.assertEqual(info['content']['raw']['copyright'], 'a932303033')
+        self.assertEqual(info['skipped_chunks'], [])
+        self.assertEqual(info['logical_properties']['Indexable'], 1)
+        self.assertEqual(info['logical_properties']['Audio Format'], 'Music')
+        self.assertNotIn('index', info)
+
+    def test_charset(self):
+        with FileVideoReader(RM_TEST_VIDEO_LOC) as reader:
+            content = rm.parse(reader, charset='cp1251')['content']
+        self.assertEqual((content['title'], content['copyright']), ('Гимн России на РТР', '©2003'))
+        self.assertNotIn('raw', content)
+
+    def test_rmvb(self):
+        with FileVideoReader(RMVB_TEST_VIDEO_LOC) as reader:
+            info = rmvb.parse(reader)
+        self.assertEqual((info['duration'], info['data_offset']), (10.01, 962))
+        audio, video = info['streams']
+        self.assertEqual((audio['codec'], audio['sample_rate'], audio['channels']), ('cook', 44100, 2))
+        self.assertEqual((video['codec'], video['width'], video['height'], video['frame_rate']),
+                         ('RV40', 720, 480, 29.97))
+        self.assertEqual(info['content'], {'title': '', 'author': '', 'copyright': '', 'comment': ''})
+
+    def test_data_is_not_read(self):
+        with CountingFileReader(RM_TEST_VIDEO_LOC) as reader:
+            info = rm.parse(reader)
+        self.assertLessEqual(max(reader.positions), info['data_offset'])
+
+    def test_index(self):
+        with CountingFileReader(RM_TEST_VIDEO_LOC) as reader:
+            info = rm.parse(reader, index=True)
+        audio_index, video_index, logical_index = info['index']
+        self.assertEqual((audio_index['stream_number'], audio_index['count']), (0, 31))
+        self.assertEqual((video_index['stream_number'], video_index['count']), (1, 528))
+        self.assertEqual(audio_index['times'][:3], [0.0, 2.274, 4.55])
+        self.assertEqual(audio_index['offsets'][0], 1055)
+        self.assertEqual(logical_index['count'], 0)
+        # the header chunks, then the INDX chain only: nothing read inside DATA
+        self.assertFalse([p for p in reader.positions if info['data_offset'] < p < info['prop']['index_offset']])
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            rm.parse(BytesVideoReader(b'RIFF' + bytes(14)))
+        with open(RM_TEST_VIDEO_LOC, 'rb') as f:
+            data = bytearray(f.read())
+        info = rm.parse(BytesVideoReader(bytes(data[:200])))  # cut in the middle of a MDPR
+        self.assertEqual(info['duration'], 70.533)
+        self.assertEqual([(c['id'], c['offset']) for c in info['skipped_chunks']], [('MDPR', 68)])
+        data[68 + 10 + 30] = 0xff  # name of the audio MDPR past its end
+        info = rm.parse(BytesVideoReader(bytes(data)))
+        self.assertEqual([(c['id'], c['offset']) for c in info['skipped_chunks']], [('MDPR', 68)])
+        self.assertEqual([s['codec'] for s in info['streams']], ['RV30'])
+        self.assertEqual(info['data_offset'], 1037)
+        data[68 + 10 + 30] = 12  # name back to its 12 bytes
+        data[68 + 10 + 30 + 1 + 12 + 1] = 0xff  # mime type of the audio MDPR not decodable
+        info = rm.parse(BytesVideoReader(bytes(data)))
+        self.assertEqual(info['skipped_chunks'], [])
+        self.assertEqual([(s['mime_type'], s.get('type')) for s in info['streams']],
+                         [('\ufffdudio/x-pn-realaudio', None), ('video/x-pn-realvideo', 'video')])
+        with open(RMVB_TEST_VIDEO_LOC, 'rb') as f:
+            bad_index = bytearray(f.read())
+        struct.pack_into('>I', bad_index, 18 + 10 + 28, 500)  # index offset into the headers
+        with self.assertRaises(Exception):
+            rm.parse(BytesVideoReader(bytes(bad_index)), index=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
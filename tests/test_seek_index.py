@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from src.input import MmapFileVideoReader
+from src.seek_index import SeekIndex, sidecar_path
+
+CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
+
+MOV_TEST_VIDEO_LOC = os.path.join(CURRENT_PATH, './test_videos/test_video.mov')
+
+
+class SeekIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.video_loc = os.path.join(self.temp_dir, 'test_video.mov')
+        shutil.copy(MOV_TEST_VIDEO_LOC, self.video_loc)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_build_and_lookup(self):
+        with MmapFileVideoReader(self.video_loc) as reader:
+            index = SeekIndex.build(reader)
+        self.assertEqual([track.track_id for track in index.tracks], [1])  # audio has no stss
+        self.assertEqual(len(index.track(1)), 4)
+        self.assertEqual(tuple(index.lookup(0)), (1, 0.0, 36, 37133))  # first sample right after mdat header
+        entry = index.lookup(20)
+        self.assertEqual((entry.time, entry.offset, entry.size), (256000 / 15360, 1280346, 41547))
+        self.assertEqual(index.lookup(16.6).offset, 646245)
+        self.assertEqual(index.lookup(1000).offset, 1833028)
+        self.assertIsNone(index.lookup(1, track_id=2))
+        with MmapFileVideoReader(self.video_loc) as reader:  # an avc1 sample starts with a NAL unit length
+            reader.seek(entry.offset)
+            self.assertLess(reader.read_int(4), entry.size)
+
+    def test_sidecar(self):
+        index = SeekIndex.load_or_build(self.video_loc)
+        self.assertTrue(os.path.isfile(sidecar_path(self.video_loc)))
+        self.assertLess(os.path.getsize(sidecar_path(self.video_loc)), 256)
+        with mock.patch.object(SeekIndex, 'build', side_effect=AssertionError('parsed again')):
+            loaded = SeekIndex.load_or_build(self.video_loc)
+        self.assertEqual(loaded.json(), index.json())
+        self.assertEqual(loaded.lookup(9), index.lookup(9))
+        with open(self.video_loc, 'ab') as f:  # a changed video is indexed again
+            f.write(b'\0' * 8)
+        with mock.patch.object(SeekIndex, 'build', wraps=SeekIndex.build) as build:
+            SeekIndex.load_or_build(self.video_loc)
+        self.assertEqual(build.call_count, 1)
+        with self.assertRaises(Exception):
+            SeekIndex.loads(b'PVSI\x00\x01\x00\x01\x00\x00' + b'\0' * 12 + b'\0\0\0\x09')
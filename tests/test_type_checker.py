@@ -4,9 +4,10 @@
 import os
 import unittest
 
+from consts import TYPE_CHECK_MAX_BYTES
 from parsers import asf, avi, flv, mkv, mov, mp4, rm, rmvb
 from src.input import FileVideoReader
-from src.type_checker import check_video_type, VideoTypeEnum
+from src.type_checker import check_video_type, match_video_type, VideoTypeEnum
 
 CURRENT_PATH = os.path.split(os.path.realpath(__file__))[0]
 
@@ -61,3 +62,29 @@ class TypeCheckerTest(unittest.TestCase):
         with FileVideoReader(RMVB_TEST_VIDEO_LOC) as reader:
             t = check_video_type(reader)
             self.assertEqual(t, VideoTypeEnum.RM or VideoTypeEnum.RMVB)
+
+    def test_match_video_type(self):
+        heads = {
+            b'\x30\x26\xB2\x75\x8E\x66\xCF\x11\xA6\xD9\x00\xAA\x00\x62\xCE\x6C' + bytes(8): VideoTypeEnum.ASF,
+            b'RIFF\x00\x00\x00\x00AVI LIST': VideoTypeEnum.AVI,
+            b'RIFF\x00\x00\x00\x00WAVEfmt ': VideoTypeEnum.UNKNOWN,
+            b'FLV\x01\x05\x00\x00\x00\x09': VideoTypeEnum.FLV,
+            b'\x1A\x45\xDF\xA3\x9F\x42\x86\x81': VideoTypeEnum.MKV,
+            b'\x00\x00\x00\x14ftypqt  \x00\x00\x02\x00': VideoTypeEnum.MOV,
+            b'\x00\x00\x00\x20ftypisom\x00\x00\x02\x00': VideoTypeEnum.MP4,
+            b'\x00\x00\x00\x20ftypheic\x00\x00\x00\x00': VideoTypeEnum.UNKNOWN,
+            b'.RMF\x00\x00\x00\x12': VideoTypeEnum.RM,
+            b'\x00' * 16: VideoTypeEnum.UNKNOWN,
+        }
+        for head, t in heads.items():
+            self.assertEqual(match_video_type(head), t, head)
+        self.assertEqual(match_video_type(b'.RMF\x00\x00\x00\x12', VideoTypeEnum.RMVB), VideoTypeEnum.RMVB)
+
+    def test_single_read(self):
+        with FileVideoReader(MOV_TEST_VIDEO_LOC) as reader:
+            read_args = []
+            reader_read = reader.read
+            reader.read = lambda *args: read_args.append(args) or reader_read(*args)
+            self.assertEqual(check_video_type(reader, VideoTypeEnum.MP4), VideoTypeEnum.MOV)
+            self.assertEqual(read_args, [(TYPE_CHECK_MAX_BYTES, )])
+            self.assertEqual(reader.tell(), 0)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from src.utils import format_video_info
+
+
+class FormatVideoInfoTest(unittest.TestCase):
+
+    def test_text(self):
+        video_info = {'type': 'mp4', 'duration': 10.5, 'title': None,
+                      'streams': [{'codec': 'avc1', 'size': [1920, 1080]}], 'metadata': {}, 'tags': ['a']}
+        self.assertEqual(format_video_info(video_info, fmt='text').split('\n'), [
+            'type: mp4',
+            'duration: 10.5',
+            'title: null',
+            'streams:',
+            '  -',
+            '    codec: avc1',
+            '    size:',
+            '      - 1920',
+            '      - 1080',
+            'metadata: {}',
+            'tags:',
+            '  - a',
+        ])
+
+    def test_json(self):
+        self.assertEqual(format_video_info({'title': 'Гимн'}), '{"title": "Гимн"}')
+        with self.assertRaises(Exception):
+            format_video_info({}, fmt='xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""Readers recording what a parser reads, for the tests of constant-read properties"""
+
+from src.input import BytesVideoReader, FileVideoReader, MmapFileVideoReader
+
+__all__ = ('CountingBytesReader', 'CountingFileReader', 'CountingMmapReader')
+
+
+class CountingMixin:
+    """Count read and read_view calls and their bytes, record where each read starts and the end of the furthest"""
+
+    def __init__(self, *args, **kwargs):
+        self.calls = 0
+        self.bytes_read = 0
+        self.positions = []
+        self.furthest = 0
+        self._reading = False
+        super().__init__(*args, **kwargs)
+
+    def _counted(self, read, num_of_byte: int):
+        if self._reading:  # e.g. read_view calling read, counted once
+            return read(num_of_byte)
+        position = self.tell()
+        self._reading = True
+        try:
+            data = read(num_of_byte)
+        finally:
+            self._reading = False
+        self.calls += 1
+        self.bytes_read += len(data)
+        self.positions.append(position)
+        self.furthest = max(self.furthest, self.tell())
+        return data
+
+    def read(self, num_of_byte: int=1) -> bytes:
+        return self._counted(super().read, num_of_byte)
+
+    def read_view(self, num_of_byte: int=1) -> memoryview:
+        return self._counted(super().read_view, num_of_byte)
+
+
+class CountingBytesReader(CountingMixin, BytesVideoReader):
+    pass
+
+
+class CountingFileReader(CountingMixin, FileVideoReader):
+    pass
+
+
+class CountingMmapReader(CountingMixin, MmapFileVideoReader):
+    pass